@@ -0,0 +1,134 @@
+"""Admission control and graceful degradation of analyses run within a request
+
+At most ``max_active`` analyses run at once and ``max_queued`` more wait
+for a slot; past that a request is refused with a Retry-After estimated
+from how long analyses have been taking. A request may carry a deadline,
+the seconds it is willing to wait: it is refused if the deadline passes
+while it waits, and otherwise degraded as far as needed to finish in time,
+or as far as the queue is full. Degradations are cumulative, in the order
+of DEGRADATIONS:
+
+- ``llm_skipped``: the statistical explanation instead of an LLM call
+- ``coarser_segments``: segments twice the requested size
+- ``components_dropped``: no cosine drift component and no p-values
+
+Costs are predicted from moving averages of past analyses, per word of
+text, and of past LLM explanations.
+"""
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+DEGRADATIONS = ('llm_skipped', 'coarser_segments', 'components_dropped')
+
+# share of the queue that must be waiting before each degradation applies regardless of deadlines
+PRESSURE_LEVELS = (0.25, 0.5, 0.75)
+
+# analysis cost with segments twice as large, and also without cosine drift and p-values, measured
+# relative to a full analysis; tokenization and tagging, which nothing skips, dominate
+DEGRADED_COSTS = (0.85, 0.75)
+
+# weight of the newest observation in the moving averages
+SMOOTHING = 0.2
+
+class Overloaded(Exception):
+    """An analysis refused for lack of capacity; retry_after is in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class QueueFullError(Overloaded):
+    """Too many analyses are already waiting"""
+
+class DeadlineExceeded(Overloaded):
+    """The request's deadline passed before an analysis slot came free"""
+
+class AdmissionController:
+    """Bounded concurrency and queue for analyses, and the degradations a request needs"""
+
+    def __init__(self, max_active=1, max_queued=32):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.active = 0
+        self.waiting = 0
+        # moving averages; None until something has been observed
+        self.seconds_per_word = None
+        self.analysis_seconds = None
+        self.llm_seconds = None
+        # created on first use so it binds to the running event loop
+        self._semaphore = None
+
+    @property
+    def pressure(self):
+        """Share of the queue waiting for a slot"""
+        return self.waiting / self.max_queued if self.max_queued else 0.0
+
+    def retry_after(self):
+        """Whole seconds until a request queued now could expect a slot"""
+        seconds = (self.waiting + 1) / self.max_active * (self.analysis_seconds or 1.0)
+        return max(1, math.ceil(seconds))
+
+    @asynccontextmanager
+    async def admit(self, deadline=None):
+        """Hold an analysis slot for the enclosed block
+
+        Raises QueueFullError when max_queued requests are already waiting
+        and DeadlineExceeded when ``deadline``, a time.monotonic() value,
+        passes first.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_active)
+        if self.waiting >= self.max_queued and self._semaphore.locked():
+            raise QueueFullError(f"{self.waiting} analyses are already waiting", self.retry_after())
+
+        self.waiting += 1
+        try:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("The deadline passed while waiting for an analysis slot",
+                                   self.retry_after()) from None
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+            self.analysis_seconds = _averaged(self.analysis_seconds, time.monotonic() - started)
+
+    def plan(self, words, deadline=None, llm=True):
+        """Degradations, a prefix of DEGRADATIONS, for analyzing ``words`` words by ``deadline``
+
+        Without an LLM to call there is none to skip; the other
+        degradations apply as they would with one.
+        """
+        level = sum(self.pressure >= threshold for threshold in PRESSURE_LEVELS)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            analysis = words * (self.seconds_per_word or 0.0)
+            # predicted seconds at each level, from a full analysis with an explanation on
+            costs = (analysis + (self.llm_seconds or 0.0) * llm, analysis) + tuple(
+                analysis * share for share in DEGRADED_COSTS)
+            fitting = [i for i, cost in enumerate(costs) if cost <= remaining]
+            level = max(level, fitting[0] if fitting else len(DEGRADATIONS))
+        degradations = list(DEGRADATIONS[:level])
+        if not llm and degradations:
+            degradations.remove('llm_skipped')
+        return degradations
+
+    def record_analysis(self, words, seconds):
+        """Observe a full analysis of ``words`` words that took ``seconds``"""
+        if words:
+            self.seconds_per_word = _averaged(self.seconds_per_word, seconds / words)
+
+    def record_llm(self, seconds):
+        self.llm_seconds = _averaged(self.llm_seconds, seconds)
+
+def _averaged(average, value):
+    return value if average is None else average + SMOOTHING * (value - average)
@@ -1,11 +1,35 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import contextvars
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
 
 from models.llama_analyzer import LlamaStyleAnalyzer
 from models.stylometry import StylometricAnalyzer
-from models.obfuscation_scorer import ObfuscationScorer
+from models.obfuscation_scorer import ObfuscationScorer, FEATURE_COLUMNS, features_to_matrix
+from models.author_profiles import AuthorProfiles
+from utils import nlp_resources
+from utils.cache import CacheLayer, ResultCache
+from utils.lexicon import cache_stats as lexicon_cache_stats
+from utils.metrics import (ANALYSES_REFUSED, ANALYSIS_DEGRADATIONS, REGISTRY, REVISION_EXPLANATIONS, TimingMiddleware,
+                           record_stage, timed)
+from pipeline import (AnalysisInputError, EncodingUnavailableError, JSON, LADDER_SIZES, check_text,
+                      segment_document, iter_features, llm_segments, window_step, featurize, ngram_features,
+                      build_response, encoding_for, encode, ladder, to_json)
+import admission
+import batch
+import jobs
+import revisions
+import shards
+import uploads
 
 app = FastAPI(title="Authorship Obfuscation Detector")
 
@@ -17,53 +41,842 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# PROFILE_DIR lets a request opt into a cProfile dump with an X-Profile: 1 header
+app.add_middleware(TimingMiddleware, profile_dir=os.environ.get("PROFILE_DIR"))
 
 llama_analyzer = LlamaStyleAnalyzer()
 stylometric_analyzer = StylometricAnalyzer()
 obfuscation_scorer = ObfuscationScorer()
+# CACHE_DIR enables the on-disk tier that survives restarts
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", "256")),
+    disk_dir=os.environ.get("CACHE_DIR")
+)
+# revisions of documents being edited, for /analyze/revisions; memory only
+revision_store = CacheLayer('revisions', int(os.environ.get("REVISIONS_MAX_ENTRIES", "32")))
+
+# process pool for /analyze/batch and sharded documents, started on first use
+batch_workers = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+batch_executor = None
+# documents of at least SHARD_MIN_WORDS words are tokenized and featurized on the
+# process pool in SHARD_WORKERS shards; SHARD_WORKERS=1 keeps every document in-process
+shard_min_words = int(os.environ.get("SHARD_MIN_WORDS", "20000"))
+shard_workers = int(os.environ.get("SHARD_WORKERS", batch_workers))
+
+# uploads to /analyze/upload are spooled to disk past UPLOAD_SPOOL_BYTES
+upload_spool_bytes = int(os.environ.get("UPLOAD_SPOOL_BYTES", 1024 * 1024))
+
+# /analyze/ladder scores at most LADDER_MAX_SIZES segment sizes per request
+ladder_max_sizes = int(os.environ.get("LADDER_MAX_SIZES", "8"))
+
+# analyses run within a request: ANALYZE_MAX_ACTIVE at a time, ANALYZE_MAX_QUEUED more waiting,
+# and the rest turned away with a 429
+analysis_admission = admission.AdmissionController(
+    max_active=int(os.environ.get("ANALYZE_MAX_ACTIVE", os.cpu_count() or 1)),
+    max_queued=int(os.environ.get("ANALYZE_MAX_QUEUED", "32"))
+)
+
+# background jobs for documents too large to analyze within a request,
+# kept in SQLite so queued jobs survive a restart
+job_store = jobs.JobStore(os.environ.get("JOBS_DB", "jobs.sqlite3"))
+
+# author profile catalogue built with `python -m models.author_profiles build`, opened on first use
+profiles_dir = os.environ.get("PROFILES_DIR")
+author_profiles = None
+
+# NLP_PRELOAD=1 loads NLTK at import so a pre-forking server (gunicorn --preload)
+# shares it with its workers; otherwise it loads in the background after startup
+if os.environ.get("NLP_PRELOAD") == "1":
+    nlp_resources.warm_up(freeze=True)
+
+# binary responses send features as float32, seven significant digits
+BINARY_FEATURE_DTYPE = '<f4'
 
 class TextInput(BaseModel):
     text: str
     segment_size: int = 200
+    # overlapping windows starting every `stride` tokens instead of consecutive segments
+    stride: Optional[int] = None
+    # segment features as columns and suspicious segments by index; implied by binary encodings
+    compact: bool = False
+    # seconds /analyze may take; it degrades the analysis to finish in time (see admission.py)
+    deadline: Optional[float] = None
+
+class RevisionInput(TextInput):
+    # revision this text is an edit of, the revision id of an earlier /analyze/revisions response
+    base: Optional[str] = None
+
+class LadderInput(BaseModel):
+    text: str
+    # segment sizes to score the text at, in tokens
+    segment_sizes: List[int] = list(LADDER_SIZES)
+    # also score the text's paragraphs as segments
+    paragraphs: bool = True
+
+class ProfileQuery(BaseModel):
+    text: str
+    k: int = 5
+    # also compare the text with this author's profile
+    author: Optional[str] = None
+
+def format_event(name, payload, sse):
+    """One event of a streamed response: a server-sent event or an NDJSON line"""
+    if sse:
+        return f"event: {name}\ndata: {to_json(payload)}\n\n"
+    return to_json({'event': name, **payload}) + '\n'
+
+def segment_params(input_data):
+    params = {'segment_size': input_data.segment_size}
+    if input_data.stride is not None:
+        params['stride'] = input_data.stride
+    return params
+
+def features_key(text_key, params):
+    """Cache key of a text's features and scores; features that change meaning change the key"""
+    return result_cache.params_key(text_key, features=stylometric_analyzer.feature_version,
+                                   calibration=obfuscation_scorer.calibration_id, **params)
+
+def segments_key(text, text_key, params):
+    """features_key of a text's segments; overlapping windows carry character spans, which need the exact text"""
+    return features_key(text_key if params.get('stride') is None else result_cache.document_key(text), params)
+
+def segment_params_of(params):
+    """The segment parameters among a job's parameters"""
+    return {k: v for k, v in params.items() if k != 'compact'}
+
+def explanation_key(text_key, obfuscation_results):
+    """An unchanged score reuses the explanation, whatever the segment size"""
+    return result_cache.params_key(
+        text_key,
+        overall_score=obfuscation_results['overall_score'],
+        risk_level=obfuscation_results['risk_level'],
+        component_scores=obfuscation_results['component_scores']
+    )
+
+async def in_executor(func, *args):
+    """Run blocking work on the default thread pool, keeping the event loop
+    free for other requests; stage timings still count toward the request"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(None, context.run, func, *args)
+
+async def process_pool():
+    """The process pool of /analyze/batch and sharded documents, started on first use"""
+    global batch_executor
+    if batch_executor is None:
+        # workers forked after the warm-up inherit the loaded tokenizer
+        await asyncio.get_running_loop().run_in_executor(None, nlp_resources.warm_up)
+        if batch_executor is None:
+            batch_executor = batch.create_executor(batch_workers)
+    return batch_executor
+
+async def shard_executor(text):
+    """The process pool if a text is long enough to be sharded, otherwise None"""
+    if shard_workers < 2 or len(text.split()) < shard_min_words:
+        return None
+    return await process_pool()
+
+def tokenized_document(text, executor=None):
+    """Tokenization of a text, cached; sharded on ``executor`` when one is given
+
+    Keyed by the exact text, since the document maps tokens back to
+    character offsets.
+    """
+    document_key = result_cache.document_key(text)
+    document = result_cache.documents.get(document_key)
+    if document is None:
+        with timed('tokenize'):
+            if executor is None:
+                document = stylometric_analyzer.tokenize(text)
+            else:
+                document = shards.tokenize(executor, text, shard_workers)
+        result_cache.documents.put(document_key, document)
+    return document
+
+def statistics(text, params_key, segment_size, stride=None, executor=None, progress=None,
+               components=True):
+    """Features and scores of a text, from the caches or computed and cached, and whether
+    the features had to be computed
+
+    Blocks for as long as the analysis takes; call it through in_executor.
+    With an executor the document is sharded across it. Without
+    ``components``, scores that are not cached already are computed
+    without cosine drift and p-values, and not cached.
+    """
+    cached_features = result_cache.features.get(params_key)
+    computed = cached_features is None
+    if computed:
+        # a new segment_size or stride still reuses the tokenization of the text
+        document = tokenized_document(text, executor)
+        if executor is None:
+            cached_features = featurize(stylometric_analyzer, document, segment_size, stride, progress)
+        else:
+            cached_features = shards.featurize(
+                executor, stylometric_analyzer, document, segment_size, stride, shard_workers, progress
+            )
+        result_cache.features.put(params_key, cached_features)
+    segment_texts, segment_features, _, ngram_matrix = cached_features
+    if not computed and progress is not None:
+        # every segment is done when they all come from the cache
+        progress(len(segment_features), len(segment_features))
+    
+    cached_scores = result_cache.scores.get(params_key)
+    if cached_scores is None:
+        with timed('calculate_obfuscation_score'):
+            obfuscation_results = obfuscation_scorer.calculate_obfuscation_score(
+                segment_features, window_step(segment_size, stride), ngram_matrix if components else None,
+                p_values=components
+            )
+        with timed('detect_inconsistencies'):
+            llama_inconsistencies = llama_analyzer.detect_inconsistencies(segment_texts)
+        cached_scores = (obfuscation_results, llama_inconsistencies)
+        if components:
+            result_cache.scores.put(params_key, cached_scores)
+    return cached_features, cached_scores, computed
+
+def ladder_statistics(text, segment_sizes, paragraphs, executor=None):
+    """Scores of a text at every segment size of a ladder, from the caches or computed and cached
+
+    Levels carry character spans and paragraphs, so they are keyed by the
+    exact text.
+    """
+    params_key = features_key(result_cache.document_key(text),
+                              {'segment_sizes': segment_sizes, 'paragraphs': paragraphs})
+    levels = result_cache.scores.get(params_key)
+    if levels is None:
+        document = tokenized_document(text, executor)
+        levels = ladder(stylometric_analyzer, obfuscation_scorer, document, segment_sizes, paragraphs)
+        result_cache.scores.put(params_key, levels)
+    return levels
+
+async def explain(obfuscation_results, segment_texts, text_key):
+    with timed('generate_explanation'):
+        return await llama_analyzer.generate_explanation_async(
+            obfuscation_results,
+            segment_texts,
+            cache=result_cache.explanations,
+            cache_key=explanation_key(text_key, obfuscation_results)
+        )
+
+async def explain_by(deadline, degradations, obfuscation_results, segment_texts, text_key):
+    """An explanation by the deadline: the statistical one when the LLM is skipped or runs out of time
+
+    An explanation already cached is used even when the LLM is skipped.
+    Running out of time adds llm_skipped to ``degradations``; the LLM call
+    carries on, so a later request with the same prompt finds its
+    completion cached.
+    """
+    if 'llm_skipped' in degradations:
+        cached = result_cache.explanations.get(explanation_key(text_key, obfuscation_results))
+        if cached is not None:
+            degradations.remove('llm_skipped')
+            return cached
+        return llama_analyzer._fallback_explanation(obfuscation_results)
+    
+    started = time.monotonic()
+    try:
+        timeout = None if deadline is None else max(deadline - started, 0.0)
+        explanation = await asyncio.wait_for(explain(obfuscation_results, segment_texts, text_key), timeout)
+    except asyncio.TimeoutError:
+        degradations.insert(0, 'llm_skipped')
+        return llama_analyzer._fallback_explanation(obfuscation_results)
+    if llama_analyzer.api_key:
+        analysis_admission.record_llm(time.monotonic() - started)
+    return explanation
+
+@asynccontextmanager
+async def analysis_slot(deadline=None):
+    """Run the enclosed analysis under admission control
+
+    Refused with a 429 when the queue is full, or a 503 when the deadline
+    passes while queued, both with a Retry-After.
+    """
+    try:
+        async with analysis_admission.admit(deadline):
+            yield
+    except admission.QueueFullError as e:
+        ANALYSES_REFUSED.inc(reason='queue_full')
+        raise HTTPException(429, f"Too many analyses in progress: {e}", headers={"Retry-After": str(e.retry_after)})
+    except admission.DeadlineExceeded as e:
+        ANALYSES_REFUSED.inc(reason='deadline')
+        raise HTTPException(503, str(e), headers={"Retry-After": str(e.retry_after)})
+
+def cache_metrics():
+    """Cache statistics as Prometheus metrics, read at scrape time"""
+    stats = {**result_cache.stats(), 'pos_tags': stylometric_analyzer.pos_tagger.cache.stats(),
+             'revisions': revision_store.stats(), 'llm_prompts': llama_analyzer.prompt_cache.cache.stats()}
+    for field, metric_type, help in (
+        ('hits', 'counter', 'Lookups answered from memory'),
+        ('disk_hits', 'counter', 'Lookups answered from the disk tier'),
+        ('misses', 'counter', 'Lookups that missed every tier'),
+        ('evictions', 'counter', 'Entries evicted from memory'),
+        ('expirations', 'counter', 'Entries dropped for being older than their time to live'),
+        ('entries', 'gauge', 'Entries held in memory'),
+    ):
+        name = f'analysis_cache_{field}' + ('_total' if metric_type == 'counter' else '')
+        yield name, metric_type, help, [({'layer': layer}, layer_stats[field]) for layer, layer_stats in stats.items()]
+
+REGISTRY.add_collector(cache_metrics)
+
+def lexicon_metrics():
+    """Word type memo statistics as Prometheus metrics"""
+    stats = lexicon_cache_stats()
+    yield 'lexicon_memo_hits_total', 'counter', 'Word type lookups answered from the memo', [({}, stats['hits'])]
+    yield 'lexicon_memo_misses_total', 'counter', 'Word types computed', [({}, stats['misses'])]
+    yield 'lexicon_memo_entries', 'gauge', 'Word types held in the memo', [({}, stats['entries'])]
+
+REGISTRY.add_collector(lexicon_metrics)
 
 @app.post("/analyze")
-async def analyze_text(input_data: TextInput):
-    """Main analysis endpoint"""
+async def analyze_text(input_data: TextInput, request: Request):
+    """
+    Main analysis endpoint
+    Responds in JSON, or in MessagePack or Arrow IPC when the Accept header
+    asks for application/msgpack or application/vnd.apache.arrow.stream.
+    Runs under admission control; under load or to meet the request's
+    ``deadline`` the analysis is degraded, and ``degradations`` lists how
+    (see admission.py).
+    """
+    received = time.monotonic()
+    try:
+        media_type = encoding_for(request.headers.get('accept'))
+    except EncodingUnavailableError as e:
+        raise HTTPException(406, str(e))
+    
     try:
         text = input_data.text
         
-        if len(text.split()) < 100:
-            raise HTTPException(400, "Text too short. Need at least 100 words.")
+        try:
+            check_text(text)
+        except AnalysisInputError as e:
+            raise HTTPException(400, str(e))
+        if input_data.deadline is not None and input_data.deadline <= 0:
+            raise HTTPException(400, "Deadline must be a positive number of seconds.")
+        deadline = None if input_data.deadline is None else received + input_data.deadline
+        
+        text_key = result_cache.text_key(text)
+        words = len(text.split())
+        async with analysis_slot(deadline):
+            degradations = analysis_admission.plan(words, deadline, llm=bool(llama_analyzer.api_key))
+            params = segment_params(input_data)
+            if 'coarser_segments' in degradations:
+                if words >= 4 * input_data.segment_size:
+                    # twice the segment size, and for windows twice the stride
+                    params = {k: v * 2 for k, v in params.items()}
+                else:
+                    # too short for two segments of twice the size
+                    degradations.remove('coarser_segments')
+            params_key = segments_key(text, text_key, params)
+            
+            # the statistical analysis runs off the event loop, which keeps serving
+            # other requests; a large document is sharded across the process pool
+            executor = await shard_executor(text)
+            started = time.monotonic()
+            try:
+                cached_features, cached_scores, computed = await in_executor(
+                    statistics, text, params_key, params['segment_size'], params.get('stride'), executor,
+                    None, 'components_dropped' not in degradations
+                )
+            except AnalysisInputError as e:
+                raise HTTPException(400, str(e))
+            # a cache hit says nothing about how long an analysis takes
+            if computed and 'coarser_segments' not in degradations:
+                analysis_admission.record_analysis(words, time.monotonic() - started)
+        segment_texts, segment_features, segment_spans, _ = cached_features
+        obfuscation_results, llama_inconsistencies = cached_scores
+        if 'cosine_drift' in obfuscation_results['component_scores'] and 'components_dropped' in degradations:
+            # scores cached by a full analysis have every component
+            degradations.remove('components_dropped')
+        explanation = await explain_by(deadline, degradations, obfuscation_results, segment_texts, text_key)
         
-        segments = stylometric_analyzer.segment_text(text, input_data.segment_size)
+        response = build_response(
+            obfuscation_results,
+            llama_inconsistencies,
+            segment_texts,
+            segment_features,
+            explanation,
+            segment_spans,
+            compact=input_data.compact or media_type != JSON,
+            feature_dtype=BINARY_FEATURE_DTYPE if media_type != JSON else '<f8'
+        )
+        response['degradations'] = degradations
+        for degradation in degradations:
+            ANALYSIS_DEGRADATIONS.inc(degradation=degradation)
+        if 'coarser_segments' in degradations:
+            response['segment_size'] = params['segment_size']
+        with timed('encode_response'):
+            return Response(encode(response, media_type), media_type=media_type)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+@app.post("/analyze/stream")
+async def analyze_text_stream(input_data: TextInput, request: Request):
+    """
+    Streaming variant of /analyze for long documents
+    Emits each segment's features as soon as they are computed, then the
+    scores, then the explanation once it arrives. Events are NDJSON lines,
+    or server-sent events when the client accepts text/event-stream.
+    Suspicious and outlier segments reference segments by index instead of
+    repeating their features. With a stride, segment events also carry the
+    character span of their window.
+    """
+    sse = 'text/event-stream' in request.headers.get('accept', '')
+    text = input_data.text
+    
+    try:
+        check_text(text)
+    except AnalysisInputError as e:
+        raise HTTPException(400, str(e))
+    
+    text_key = result_cache.text_key(text)
+    stride = input_data.stride
+    executor = await shard_executor(text)
+    
+    def prepare():
+        document = tokenized_document(text, executor)
+        with timed('segment_text'):
+            segments = segment_document(stylometric_analyzer, document, input_data.segment_size, stride)
+        stylometric_analyzer.tag(document)
+        return segments
+    
+    try:
+        segments = await in_executor(prepare)
+    except AnalysisInputError as e:
+        raise HTTPException(400, str(e))
+    
+    def event(name, **payload):
+        return format_event(name, payload, sse)
+    
+    async def events():
+        yield event('start', num_segments=len(segments))
         
-        if len(segments) < 2:
-            raise HTTPException(400, "Text too short for reliable analysis. Need at least 2 segments.")
+        # only the feature matrix is kept, not the responses
+        matrix = np.empty((len(segments), len(FEATURE_COLUMNS)))
+        features_iter = iter_features(stylometric_analyzer, segments, stride)
+        feature_seconds = 0.0
+        for i, segment in enumerate(segments):
+            started = time.perf_counter()
+            features = next(features_iter)
+            feature_seconds += time.perf_counter() - started
+            matrix[i] = features_to_matrix([features])[0]
+            if stride is None:
+                yield event('segment', index=i, features=features)
+            else:
+                yield event('segment', index=i, features=features, span=segment.char_span)
         
-        segment_features = [stylometric_analyzer.extract_features(seg) for seg in segments]
+        # time spent streaming each segment out is not feature extraction
+        record_stage('extract_features', feature_seconds)
+        segment_texts = [seg.text for seg in llm_segments(segments, input_data.segment_size, stride)]
         
-        obfuscation_results = obfuscation_scorer.calculate_obfuscation_score(segment_features)
+        def score():
+            ngram_matrix = ngram_features(segments, input_data.segment_size, stride)
+            with timed('calculate_obfuscation_score'):
+                return obfuscation_scorer.score_matrix(
+                    matrix, window_step(input_data.segment_size, stride), ngram_matrix
+                )
         
-        llama_inconsistencies = llama_analyzer.detect_inconsistencies(segments)
-        explanation = llama_analyzer.generate_explanation(
-            obfuscation_results,
-            segments
+        obfuscation_results = await in_executor(score)
+        explanation_task = asyncio.create_task(explain(obfuscation_results, segment_texts, text_key))
+        try:
+            with timed('detect_inconsistencies'):
+                llama_inconsistencies = llama_analyzer.detect_inconsistencies(segment_texts)
+            yield event(
+                'scores',
+                overall_score=obfuscation_results['overall_score'],
+                risk_level=obfuscation_results['risk_level'],
+                component_scores=obfuscation_results['component_scores'],
+                component_p_values=obfuscation_results['component_p_values'],
+                suspicious_segments=obfuscation_results['suspicious_segments'],
+                outlier_segments=obfuscation_results['outlier_segments'],
+                change_points=obfuscation_results['change_points'],
+                llama_analysis=llama_inconsistencies
+            )
+            yield event('explanation', explanation=await explanation_task)
+        finally:
+            # a disconnecting client stops the stream; do not leave the LLM call behind
+            explanation_task.cancel()
+        
+        yield event('done')
+    
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
+async def spool_upload(request):
+    """The uploaded file: the ``file`` field of a multipart form, or else the
+    raw request body, spooled to disk rather than held in memory"""
+    if request.headers.get('content-type', '').startswith('multipart/form-data'):
+        form = await request.form()
+        upload = form.get('file')
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(400, "Send the text file in a 'file' field.")
+        return upload.file
+    
+    spool = tempfile.SpooledTemporaryFile(max_size=upload_spool_bytes)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+@app.post("/analyze/upload")
+async def analyze_upload(request: Request, segment_size: int = 200, stride: Optional[int] = None,
+                         normalize: bool = True):
+    """
+    Streaming analysis of a text file, for texts too large to send as JSON
+    Send the file (UTF-8) as multipart/form-data in a ``file`` field, or as
+    the raw request body, with the segment parameters in the query string.
+    The file is read in chunks and each segment featurized as soon as its
+    tokens are known, so memory does not grow with the size of the file
+    (see uploads.py). Unless ``normalize=false``, the text is first cleaned
+    as TextPreprocessor does. Emits the events of /analyze/stream, without
+    ``start``; every segment event carries its character span in the
+    (normalized) text and the scores event the number of segments.
+    """
+    sse = 'text/event-stream' in request.headers.get('accept', '')
+    file = await spool_upload(request)
+    try:
+        analysis = uploads.UploadAnalysis(
+            stylometric_analyzer, llama_analyzer, file, segment_size, stride, normalize
         )
+        # a text too short is refused before the response starts
+        first = await in_executor(analysis.first_segments)
+    except AnalysisInputError as e:
+        file.close()
+        raise HTTPException(400, str(e))
+    
+    def event(name, **payload):
+        return format_event(name, payload, sse)
+    
+    async def events():
+        try:
+            segments = first
+            while segments:
+                for index, features, span in segments:
+                    yield event('segment', index=index, features=features, span=span)
+                segments = await in_executor(analysis.next_segments)
+        finally:
+            file.close()
         
-        return {
-            'overall_score': obfuscation_results['overall_score'],
-            'risk_level': obfuscation_results['risk_level'],
-            'component_scores': obfuscation_results['component_scores'],
-            'suspicious_segments': obfuscation_results['suspicious_segments'],
-            'explanation': explanation,
-            'llama_analysis': llama_inconsistencies,
-            'num_segments': len(segments),
-            'segment_features': segment_features
-        }
+        obfuscation_results, llama_inconsistencies = await in_executor(analysis.scores, obfuscation_scorer)
+        explanation_task = asyncio.create_task(
+            explain(obfuscation_results, [analysis.sample_text], analysis.text_key)
+        )
+        try:
+            yield event(
+                'scores',
+                num_segments=len(analysis.segment_features),
+                overall_score=obfuscation_results['overall_score'],
+                risk_level=obfuscation_results['risk_level'],
+                component_scores=obfuscation_results['component_scores'],
+                component_p_values=obfuscation_results['component_p_values'],
+                suspicious_segments=obfuscation_results['suspicious_segments'],
+                outlier_segments=obfuscation_results['outlier_segments'],
+                change_points=obfuscation_results['change_points'],
+                llama_analysis=llama_inconsistencies
+            )
+            yield event('explanation', explanation=await explanation_task)
+        finally:
+            explanation_task.cancel()
         
-    except Exception as e:
-        raise HTTPException(500, str(e))
+        yield event('done')
+    
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
+@app.post("/analyze/revisions")
+async def analyze_revision(input_data: RevisionInput, request: Request):
+    """
+    Analysis of a document as it is edited
+    Send the first version without a base, then every edited version with
+    the revision id of the previous response as ``base``. Only the segments
+    the edit touched are tokenized and featurized again; the others keep
+    their boundaries and features (see revisions.py). The explanation is
+    reused unless the risk level or the most suspicious segments change.
+    A base that is unknown, has expired or was analyzed with other segment
+    parameters is ignored and the text analyzed in full.
+    Responds as /analyze does, with every segment's character span and a
+    ``revision`` entry.
+    """
+    try:
+        media_type = encoding_for(request.headers.get('accept'))
+    except EncodingUnavailableError as e:
+        raise HTTPException(406, str(e))
+    
+    base = revision_store.get(input_data.base) if input_data.base else None
+    if base is not None and not base.matches(input_data.segment_size, input_data.stride):
+        base = None
+    
+    def analyze():
+        if base is None:
+            revision = revisions.analyze(
+                stylometric_analyzer, input_data.text, input_data.segment_size, input_data.stride
+            )
+        else:
+            revision = revisions.revise(stylometric_analyzer, base, input_data.text)
+        revisions.score(revision, obfuscation_scorer, llama_analyzer)
+        return revision
+    
+    try:
+        async with analysis_slot():
+            revision = await in_executor(analyze)
+    except AnalysisInputError as e:
+        raise HTTPException(400, str(e))
+    
+    subject = revision.subject()
+    explanation_reused = base is not None and base.explanation is not None and base.explained == subject
+    if explanation_reused:
+        explanation = base.explanation
+    else:
+        explanation = await explain(
+            revision.obfuscation_results, revision.segment_texts, result_cache.text_key(input_data.text)
+        )
+    if base is not None:
+        REVISION_EXPLANATIONS.inc(outcome='reused' if explanation_reused else 'generated')
+    revision.explanation, revision.explained = explanation, subject
+    revision_store.put(revision.id, revision)
+    
+    response = build_response(
+        revision.obfuscation_results,
+        revision.llama_inconsistencies,
+        revision.segment_texts,
+        revision.segment_features,
+        explanation,
+        [seg.char_span for seg in revision.segments],
+        compact=input_data.compact or media_type != JSON,
+        feature_dtype=BINARY_FEATURE_DTYPE if media_type != JSON else '<f8'
+    )
+    response['revision'] = {
+        'id': revision.id,
+        'base': revision.base,
+        'segments_reused': revision.segments_reused,
+        'segments_analyzed': len(revision.segments) - revision.segments_reused,
+        'explanation_reused': explanation_reused
+    }
+    with timed('encode_response'):
+        return Response(encode(response, media_type), media_type=media_type)
+
+@app.post("/analyze/ladder")
+async def analyze_ladder(input_data: LadderInput):
+    """
+    Scores of a text at several segment sizes at once
+    Each of ``segment_sizes`` and, with ``paragraphs``, the text's
+    paragraphs is scored as /analyze scores consecutive segments, with
+    every segment's character span. The text is tokenized, tagged and
+    counted once for all of them (see pipeline.ladder). No explanation is
+    generated.
+    """
+    text = input_data.text
+    try:
+        check_text(text)
+    except AnalysisInputError as e:
+        raise HTTPException(400, str(e))
+    segment_sizes = input_data.segment_sizes
+    if not segment_sizes and not input_data.paragraphs:
+        raise HTTPException(400, "Give at least one segment size or ask for paragraphs.")
+    if len(segment_sizes) > ladder_max_sizes:
+        raise HTTPException(400, f"At most {ladder_max_sizes} segment sizes per request.")
+    if any(size < 1 for size in segment_sizes):
+        raise HTTPException(400, "Segment sizes must be at least 1 token.")
+    
+    executor = await shard_executor(text)
+    async with analysis_slot():
+        levels = await in_executor(
+            ladder_statistics, text, segment_sizes, input_data.paragraphs, executor
+        )
+    with timed('encode_response'):
+        return Response(to_json({'levels': levels}), media_type=JSON)
+
+@app.post("/analyze/batch")
+async def analyze_batch(request: Request):
+    """
+    Statistical analysis of many documents sent as JSONL
+    Streams one JSON line per document back in completion order
+    """
+    executor = await process_pool()
+    
+    # read the whole body up front: the streaming response listens for
+    # client disconnects on the same receive channel
+    body = await request.body()
+    lines = (line for line in body.decode('utf-8').splitlines() if line.strip())
+    records = (batch.parse_record(line, index) for index, line in enumerate(lines))
+    
+    async def results():
+        async for result in batch.analyze_stream(records, executor, batch_workers * 4):
+            yield batch.to_json_line(result)
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+async def run_job(job):
+    """Analyze a job's document as /analyze does, reporting segments processed"""
+    text_key = result_cache.text_key(job.text)
+    params_key = segments_key(job.text, text_key, segment_params_of(job.params))
+    
+    # tokenizing and scoring a large document would block the event loop for seconds
+    cached_features, cached_scores, _ = await in_executor(
+        statistics, job.text, params_key, job.params['segment_size'], job.params.get('stride'),
+        await shard_executor(job.text), job.progress
+    )
+    segment_texts, segment_features, segment_spans, _ = cached_features
+    obfuscation_results, llama_inconsistencies = cached_scores
+    explanation = await explain(obfuscation_results, segment_texts, text_key)
+    return to_json(build_response(
+        obfuscation_results,
+        llama_inconsistencies,
+        segment_texts,
+        segment_features,
+        explanation,
+        segment_spans,
+        compact=job.params.get('compact', False)
+    ))
+
+job_queue = jobs.JobQueue(
+    job_store,
+    run_job,
+    workers=int(os.environ.get("JOBS_WORKERS", "1")),
+    max_queued=int(os.environ.get("JOBS_MAX_QUEUED", "100")),
+    retention=float(os.environ.get("JOBS_RETENTION_SECONDS", "86400"))
+)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(input_data: TextInput):
+    """
+    Queue a document for background analysis
+    Returns the job's status; poll GET /jobs/{job_id} or follow
+    GET /jobs/{job_id}/events, then fetch GET /jobs/{job_id}/result
+    """
+    try:
+        check_text(input_data.text)
+    except AnalysisInputError as e:
+        raise HTTPException(400, str(e))
+    if input_data.stride is not None and input_data.stride < 1:
+        raise HTTPException(400, "Stride must be at least 1 token.")
+    
+    params = segment_params(input_data)
+    if input_data.compact:
+        params['compact'] = True
+    try:
+        return job_queue.submit(params, input_data.text)
+    except jobs.QueueFullError as e:
+        raise HTTPException(429, f"Job queue is full: {e}", headers={"Retry-After": "30"})
+
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return get_job(job_id)
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = get_job(job_id)
+    if job['status'] != jobs.DONE:
+        raise HTTPException(409, f"Job is {job['status']}")
+    return Response(job_store.result(job_id), media_type="application/json")
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Follow a job's progress
+    Emits a progress event whenever the job advances, and a final event
+    with its outcome. NDJSON, or server-sent events when the client accepts
+    text/event-stream.
+    """
+    sse = 'text/event-stream' in request.headers.get('accept', '')
+    get_job(job_id)
+    
+    async def events():
+        async for job in job_queue.watch(job_id):
+            name = job['status'] if job['status'] in jobs.FINISHED else 'progress'
+            yield format_event(name, job, sse)
+    
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job; finished jobs are left as they are"""
+    get_job(job_id)
+    return job_queue.cancel(job_id)
+
+def get_author_profiles():
+    global author_profiles
+    if author_profiles is None:
+        if not profiles_dir:
+            raise HTTPException(503, "No author profiles configured")
+        author_profiles = AuthorProfiles(profiles_dir, stylometric_analyzer)
+    return author_profiles
+
+@app.post("/profiles/match")
+async def match_profiles(query: ProfileQuery):
+    """
+    Closest author profiles to a text
+    With an author, also reports the text's similarity to that author's
+    profile and how far each of its features deviates from the author's
+    """
+    try:
+        check_text(query.text)
+    except AnalysisInputError as e:
+        raise HTTPException(400, str(e))
+    if query.k < 1:
+        raise HTTPException(400, "k must be at least 1.")
+    
+    profiles = get_author_profiles()
+    if query.author is not None and profiles.index.row(query.author) is None:
+        raise HTTPException(404, "Unknown author")
+    
+    executor = await shard_executor(query.text)
+    
+    def match():
+        document = tokenized_document(query.text, executor)
+        with timed('match_profiles'):
+            return profiles.match(document, query.k, query.author)
+    
+    return await in_executor(match)
+
+def warm_up():
+    try:
+        nlp_resources.warm_up()
+    except LookupError as e:
+        print(f"NLP warm-up failed: {e}")
+    calibration = obfuscation_scorer.calibration
+    if calibration is not None and calibration['feature_version'] != stylometric_analyzer.feature_version:
+        print(f"Scorer calibration {calibration['id']} was fitted on features {calibration['feature_version']}, "
+              f"not {stylometric_analyzer.feature_version}; its limits may not fit these features")
+    # imported lazily by the scorer
+    import scipy.stats, sklearn.covariance  # noqa: F401
+
+@app.on_event("startup")
+async def start_warm_up():
+    """Load NLTK and the scoring libraries off the event loop so /health
+    answers while they load; requests that need NLTK meanwhile wait for
+    the same load"""
+    asyncio.get_running_loop().run_in_executor(None, warm_up)
+
+@app.on_event("startup")
+async def start_jobs():
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def close_clients():
+    await job_queue.stop()
+    await llama_analyzer.aclose()
+    if batch_executor is not None:
+        batch_executor.shutdown(cancel_futures=True)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of stage latencies, LLM usage and cache statistics"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return result_cache.stats()
 
 @app.get("/health")
 async def health_check():
@@ -0,0 +1,153 @@
+"""Batch analysis of many documents over a process pool
+
+Input is JSONL, one ``{"id": ..., "text": ..., "segment_size": 200}`` object
+per line; ``id`` defaults to the line number and ``segment_size`` to 200. An
+optional ``stride`` analyzes overlapping windows and ``compact`` selects the
+compact layout, as in /analyze.
+Output is one JSON line per document in completion order, carrying either
+the statistical /analyze results or an ``error``. The p-values may have
+been reached with another number of shuffles than /analyze's (see
+ObfuscationScorer.component_p_values).
+
+    python batch.py submissions.jsonl -o results.jsonl --workers 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+
+from pipeline import AnalysisInputError, analyze_statistics, to_json
+from utils.nlp_resources import warm_up
+
+# per-process analyzers, created once by the pool initializer
+_stylometric_analyzer = None
+_obfuscation_scorer = None
+_llama_analyzer = None
+
+def _init_worker():
+    """Create the analyzers once per worker process
+
+    Forked workers inherit resources the parent already warmed up; others
+    load punkt and stopwords here.
+    """
+    global _stylometric_analyzer, _obfuscation_scorer, _llama_analyzer
+    from models.llama_analyzer import LlamaStyleAnalyzer
+    from models.stylometry import StylometricAnalyzer
+    from models.obfuscation_scorer import ObfuscationScorer
+
+    _stylometric_analyzer = StylometricAnalyzer()
+    _obfuscation_scorer = ObfuscationScorer()
+    _llama_analyzer = LlamaStyleAnalyzer()
+    warm_up()
+
+def create_executor(max_workers=None):
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+
+def parse_record(line, index, segment_size=200):
+    """Parse one JSONL line; malformed lines become records carrying their error"""
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict) or not isinstance(record.get('text'), str):
+            raise ValueError("expected an object with a 'text' string")
+    except ValueError as e:
+        return {'id': index, 'error': f"Invalid input line: {e}"}
+
+    record.setdefault('id', index)
+    record.setdefault('segment_size', segment_size)
+    return record
+
+def analyze_record(record):
+    """Analyze one record in a worker, isolating its errors from the batch"""
+    if 'error' in record:
+        return record
+
+    try:
+        result = analyze_statistics(
+            record['text'],
+            int(record['segment_size']),
+            _stylometric_analyzer,
+            _obfuscation_scorer,
+            _llama_analyzer,
+            stride=None if record.get('stride') is None else int(record['stride']),
+            compact=bool(record.get('compact', False))
+        )
+    except AnalysisInputError as e:
+        return {'id': record['id'], 'error': str(e)}
+    except Exception as e:
+        return {'id': record['id'], 'error': f"{type(e).__name__}: {e}"}
+
+    result['id'] = record['id']
+    return result
+
+def to_json_line(result):
+    return to_json(result) + '\n'
+
+async def analyze_stream(records, executor, max_in_flight):
+    """Analyze records on the executor, yielding results as they complete
+
+    At most ``max_in_flight`` documents are queued on the executor at a time.
+    """
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    for record in records:
+        pending.add(loop.run_in_executor(executor, analyze_record, record))
+        return_when = FIRST_COMPLETED if len(pending) >= max_in_flight else None
+        done, pending = await _collect(pending, return_when)
+        for future in done:
+            yield future.result()
+
+    while pending:
+        done, pending = await _collect(pending, FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+async def _collect(pending, return_when):
+    if return_when is None:
+        done = {future for future in pending if future.done()}
+        return done, pending - done
+    return await asyncio.wait(pending, return_when=return_when)
+
+def run(lines, output, max_workers=None, segment_size=200):
+    """Analyze JSONL lines on a process pool, writing results in completion order"""
+    max_workers = max_workers or os.cpu_count() or 1
+    # load once here so forked workers share it copy-on-write
+    warm_up(freeze=True)
+    with create_executor(max_workers) as executor:
+        max_in_flight = max_workers * 4
+        pending = set()
+
+        for index, line in enumerate(line for line in lines if line.strip()):
+            record = parse_record(line, index, segment_size)
+            pending.add(executor.submit(analyze_record, record))
+
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    output.write(to_json_line(future.result()))
+
+        for future in as_completed(pending):
+            output.write(to_json_line(future.result()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score many documents for authorship obfuscation")
+    parser.add_argument('input', help="JSONL file of documents, or - for stdin")
+    parser.add_argument('-o', '--output', help="JSONL file for results (default: stdout)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--segment-size', type=int, default=200, help="segment size for records without one")
+    args = parser.parse_args(argv)
+
+    infile = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    outfile = sys.stdout if args.output is None else open(args.output, 'w', encoding='utf-8')
+    try:
+        run(infile, outfile, args.workers, args.segment_size)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+if __name__ == "__main__":
+    main()
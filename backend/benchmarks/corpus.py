@@ -0,0 +1,164 @@
+"""Benchmark texts: deterministic synthetic prose plus optional public-domain books
+
+Synthetic documents draw words from a Zipfian vocabulary of common English
+words and generated pseudo-words, with sentence lengths, punctuation,
+abbreviations, quotes and paragraph breaks varying by writing style. A
+seed fully determines a document, so every machine benchmarks the same
+text without downloading anything.
+
+Public-domain texts come from a directory of plain-text files (for example
+Project Gutenberg downloads) or from NLTK's gutenberg corpus when it is
+installed locally; they are repeated or truncated to the requested length.
+"""
+import os
+import random
+
+COMMON_WORDS = (
+    "the of and to a in is it you that he was for on are with as his they be at one have this from "
+    "or had by not word but what some we can out other were all there when up use your how said an each "
+    "she which do their time if will way about many then them write would like so these her long make "
+    "thing see him two has look more day could go come did number sound no most people my over know water "
+    "than call first who may down side been now find any new work part take get place made live where "
+    "after back little only round man year came show every good me give our under name very through just "
+    "form sentence great think say help low line differ turn cause much mean before move right boy old too "
+    "same tell does set three want air well also play small end put home read hand port large spell add "
+    "even land here must big high such follow act why ask men change went light kind off need house "
+    "picture try us again animal point mother world near build self earth father head stand own page "
+    "should country found answer school grow study still learn plant cover food sun four between state "
+    "keep eye never last let thought city tree cross farm hard start might story saw far sea draw left "
+    "late run while press close night real life few north open seem together next white children begin "
+    "got walk example ease paper group always music those both mark often letter until mile river car "
+    "feet care second book carry took science eat room friend began idea fish mountain stop once base "
+    "hear horse cut sure watch color face wood main enough plain girl usual young ready above ever red "
+    "list though feel talk bird soon body dog family direct pose leave song measure door product black "
+    "short numeral class wind question happen complete ship area half rock order fire south problem piece "
+    "told knew pass since top whole king space heard best hour better true during hundred five remember "
+    "step early hold west ground interest reach fast verb sing listen six table travel less morning"
+).split()
+
+FORMAL_WORDS = (
+    "notwithstanding furthermore consequently nevertheless organization relationship government "
+    "complexity methodology epistemological hermeneutics quintessential juxtaposition substantive "
+    "predominantly characterization interpretation administration considerable significant "
+    "establishment implementation consideration circumstance phenomenon preliminary subsequent "
+    "infrastructure accountability comprehensive differentiation representation sustainability"
+).split()
+
+ABBREVIATIONS = ("Mr.", "Mrs.", "Dr.", "St.", "etc.", "e.g.", "i.e.", "U.S.", "No.", "vs.")
+
+STYLES = {
+    # sentence length range, share of formal words, comma and semicolon rates per word
+    'plain': {'length': (4, 22), 'formal': 0.01, 'comma': 0.06, 'semicolon': 0.002, 'quote': 0.05},
+    'ornate': {'length': (14, 48), 'formal': 0.18, 'comma': 0.11, 'semicolon': 0.01, 'quote': 0.02},
+    'terse': {'length': (2, 10), 'formal': 0.0, 'comma': 0.02, 'semicolon': 0.0, 'quote': 0.12},
+}
+
+_SYLLABLES = ("ka", "lo", "mi", "ne", "tor", "van", "sel", "ri", "dun", "pha", "quo", "bre", "ist", "ent", "ma")
+
+
+def _pseudo_words(rng, count):
+    """Long tail of invented words so the vocabulary keeps growing with length"""
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _zipf_weights(count, exponent=1.07):
+    return [1.0 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+class SyntheticCorpus:
+    """Generator of seeded synthetic documents"""
+
+    def __init__(self, vocabulary_seed=0, tail_size=20000):
+        rng = random.Random(vocabulary_seed)
+        self.vocabulary = COMMON_WORDS + _pseudo_words(rng, tail_size)
+        self.weights = _zipf_weights(len(self.vocabulary))
+
+    def document(self, seed, n_words, styles=('plain',), block_words=None):
+        """A document of about ``n_words`` words
+
+        With several styles, the style switches every ``block_words`` words
+        (a quarter of the document by default), imitating an author change
+        or an obfuscated insert.
+        """
+        rng = random.Random(seed)
+        block_words = block_words or max(n_words // 4, 1)
+        words_in_block = 0
+        style_index = 0
+        paragraphs, sentences = [], []
+        count = 0
+
+        while count < n_words:
+            if words_in_block >= block_words:
+                style_index = (style_index + 1) % len(styles)
+                words_in_block = 0
+            style = STYLES[styles[style_index]]
+
+            sentence = self._sentence(rng, style)
+            sentences.append(sentence)
+            n = len(sentence.split())
+            count += n
+            words_in_block += n
+
+            if rng.random() < 0.12:
+                paragraphs.append(' '.join(sentences))
+                sentences = []
+
+        if sentences:
+            paragraphs.append(' '.join(sentences))
+        return '\n\n'.join(paragraphs)
+
+    def _sentence(self, rng, style):
+        length = rng.randint(*style['length'])
+        words = rng.choices(self.vocabulary, weights=self.weights, k=length)
+
+        for i in range(length):
+            roll = rng.random()
+            if roll < style['formal']:
+                words[i] = rng.choice(FORMAL_WORDS)
+            elif roll < style['formal'] + 0.01:
+                words[i] = rng.choice(ABBREVIATIONS)
+            elif roll < style['formal'] + 0.015:
+                words[i] = str(rng.randint(2, 1999))
+            if i < length - 1:
+                if rng.random() < style['comma']:
+                    words[i] += ','
+                elif rng.random() < style['semicolon']:
+                    words[i] += ';'
+
+        words[0] = words[0][:1].upper() + words[0][1:]
+        sentence = ' '.join(words) + rng.choice('..........?!')
+        if rng.random() < style['quote']:
+            sentence = f'"{sentence}"'
+        return sentence
+
+
+def load_public_domain(corpus_dir=None):
+    """Plain-text books from ``corpus_dir``, else NLTK's gutenberg corpus if installed
+
+    Returns a list of (name, text); empty when neither is available.
+    """
+    if corpus_dir:
+        texts = []
+        for name in sorted(os.listdir(corpus_dir)):
+            if name.endswith('.txt'):
+                with open(os.path.join(corpus_dir, name), encoding='utf-8', errors='replace') as f:
+                    texts.append((name, f.read()))
+        return texts
+
+    try:
+        from nltk.corpus import gutenberg
+        return [(fileid, gutenberg.raw(fileid)) for fileid in gutenberg.fileids()]
+    except LookupError:
+        return []
+
+
+def fit_length(text, n_words):
+    """Repeat or truncate ``text`` to about ``n_words`` whitespace-separated words"""
+    words = text.split()
+    if not words:
+        return ''
+    repeats = -(-n_words // len(words))
+    return ' '.join((words * repeats)[:n_words])
@@ -0,0 +1,114 @@
+"""Local stand-in for the Groq chat completions API
+
+Answers ``POST /openai/v1/chat/completions`` after a configurable delay with
+a fixed explanation and a usage block, so the LLM path can be benchmarked
+offline. Point the app at it with GROQ_BASE_URL.
+
+    python -m benchmarks.fake_groq --port 8100 --latency 0.4
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETION = ("The segments show broadly consistent lexical and syntactic patterns. "
+              "Variation stays within the range expected of a single author. "
+              "No strong indicators of deliberate obfuscation were found.")
+
+
+class FakeGroqServer:
+    """Threaded HTTP server answering chat completions after ``latency`` seconds
+
+    ``jitter`` adds a uniform random delay of up to that many seconds.
+    ``max_in_flight`` is the most requests that were being answered at once.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.3, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with server._lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                time.sleep(server.latency + random.uniform(0, server.jitter))
+                with server._lock:
+                    server.in_flight -= 1
+
+                prompt = ' '.join(m.get('content', '') for m in body.get('messages', []))
+                payload = json.dumps({
+                    'id': 'fake-completion',
+                    'object': 'chat.completion',
+                    'model': body.get('model'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': COMPLETION},
+                                 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': len(prompt.split()), 'completion_tokens': len(COMPLETION.split())}
+                }).encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a fake Groq chat completions API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', type=float, default=0.3, help="seconds before each response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra uniform random delay, seconds")
+    args = parser.parse_args(argv)
+
+    server = FakeGroqServer(args.host, args.port, args.latency, args.jitter)
+    print(f"Fake Groq API on {server.url} ({args.latency}s latency)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
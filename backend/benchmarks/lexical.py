@@ -0,0 +1,115 @@
+"""Microbenchmark of lexical counting on Zipfian text
+
+Compares the per-token counting that extract_features used to do, with a
+syllable loop and stopword lookup for every token, against
+utils.lexicon.lexical_counts, which counts tokens first and looks up each
+distinct type in the process-wide memo. The memo is measured cold (cleared
+before every run) and warm (as in a long-running server).
+
+    python -m benchmarks.lexical
+    python -m benchmarks.lexical --segment-sizes 100 500 --segments 2000
+
+Run from the backend directory.
+"""
+import argparse
+import json
+import sys
+from collections import Counter
+
+from benchmarks.corpus import SyntheticCorpus
+from benchmarks.run import STYLE_MIX, measure, summarize
+from utils.lexicon import NOUN_SUFFIXES, lexical_counts, word_properties
+from utils.nlp_resources import load_stopwords
+
+
+def _count_syllables(word):
+    word = word.lower()
+    count = 0
+    previous_was_vowel = False
+    for char in word:
+        is_vowel = char in "aeiouy"
+        if is_vowel and not previous_was_vowel:
+            count += 1
+        previous_was_vowel = is_vowel
+    if word.endswith("e"):
+        count -= 1
+    return count or 1
+
+
+def per_token_counts(words, stop_words):
+    """The former per-token loops, for reference"""
+    words_alpha = [w for w in words if w.isalpha()]
+    words_lower = [w.lower() for w in words_alpha]
+    types = Counter(words_lower)
+    return (
+        len(words_alpha),
+        sum(len(w) for w in words_alpha),
+        sum(_count_syllables(w) for w in words_alpha),
+        sum(1 for w in words_lower if w in stop_words),
+        sum(1 for w in words_lower if w.endswith(NOUN_SUFFIXES)),
+        sum(w.count(',') for w in words),
+        sum(w.count(';') for w in words),
+        types,
+        sum(1 for count in types.values() if count == 1)
+    )
+
+
+def zipf_segments(n_segments, segment_size, seed=0):
+    """Whitespace tokens of synthetic Zipfian prose, cut into segments"""
+    text = SyntheticCorpus().document(seed, n_segments * segment_size, STYLE_MIX)
+    tokens = text.split()
+    return [tokens[i:i + segment_size] for i in range(0, len(tokens) - segment_size + 1, segment_size)]
+
+
+def bench(segment_sizes, n_segments, repeat):
+    stop_words = load_stopwords('english')
+    results = {}
+    for segment_size in segment_sizes:
+        segments = zipf_segments(n_segments, segment_size)
+        assert all(tuple(lexical_counts(s)) == per_token_counts(s, stop_words) for s in segments)
+
+        def cold():
+            word_properties.cache_clear()
+            for segment in segments:
+                lexical_counts(segment)
+
+        _, per_token = measure(lambda: [per_token_counts(s, stop_words) for s in segments], repeat)
+        _, cold_runs = measure(cold, repeat)
+        _, warm_runs = measure(lambda: [lexical_counts(s) for s in segments], repeat)
+
+        tokens = sum(len(s) for s in segments)
+        entry = {
+            'segments': len(segments),
+            'tokens': tokens,
+            'types': len({w for s in segments for w in s}),
+            'per_token': summarize(per_token),
+            'memo_cold': summarize(cold_runs),
+            'memo_warm': summarize(warm_runs),
+            'speedup_cold': min(per_token) / min(cold_runs),
+            'speedup_warm': min(per_token) / min(warm_runs),
+        }
+        results[f'seg{segment_size}'] = entry
+        print(f"segment_size {segment_size}: per token {min(per_token) / tokens * 1e9:.0f} ns/token, "
+              f"memo cold {min(cold_runs) / tokens * 1e9:.0f} ns/token ({entry['speedup_cold']:.1f}x), "
+              f"warm {min(warm_runs) / tokens * 1e9:.0f} ns/token ({entry['speedup_warm']:.1f}x)", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark memoized lexical counting on Zipfian text")
+    parser.add_argument('--segment-sizes', type=int, nargs='+', default=[100, 200, 500])
+    parser.add_argument('--segments', type=int, default=500, help="segments per size")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', help="write results JSON here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    encoded = json.dumps(bench(args.segment_sizes, args.segments, args.repeat), indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(encoded + '\n')
+    else:
+        print(encoded)
+
+
+if __name__ == "__main__":
+    main()
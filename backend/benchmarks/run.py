@@ -0,0 +1,399 @@
+"""Benchmark the analysis pipeline stage by stage and /analyze end to end
+
+Runs offline: documents come from the seeded synthetic corpus (plus local
+public-domain books when available) and /analyze talks to a fake Groq
+server with configurable latency. Results are written as JSON and, given a
+baseline from an earlier run, compared against it: stage timings by their
+fastest run, end-to-end figures by throughput and latency percentiles. Any
+metric worse than the baseline by more than the tolerance makes the run
+exit with status 1.
+
+    python -m benchmarks.run --quick
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json -o results.json
+
+Run from the backend directory.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks.corpus import SyntheticCorpus, load_public_domain, fit_length
+from benchmarks.fake_groq import FakeGroqServer
+
+SIZES = (1000, 5000, 20000, 100000, 500000)
+QUICK_SIZES = (1000, 5000, 20000)
+SEGMENT_SIZES = (100, 200, 500)
+CONCURRENCY = (1, 4, 16)
+
+# documents mix styles so the scorer sees realistic shifts
+STYLE_MIX = ('plain', 'ornate', 'plain', 'terse')
+
+# stage timings shorter than this are too noisy to flag as regressions
+MIN_COMPARABLE_SECONDS = 0.002
+
+
+def measure(func, repeat, min_run_time=0.05):
+    """Time ``func`` ``repeat`` times; returns its result and the per-call timings
+
+    Like timeit's autorange, fast functions are looped so that each timed run
+    lasts at least ``min_run_time`` seconds, and the run is divided by the
+    loop count. The untimed first call doubles as a warm-up.
+    """
+    start = time.perf_counter()
+    result = func()
+    first = time.perf_counter() - start
+    loops = max(1, math.ceil(min_run_time / first)) if first > 0 else 1000
+
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        runs.append((time.perf_counter() - start) / loops)
+    return result, runs
+
+
+def summarize(runs):
+    return {'median_s': statistics.median(runs), 'min_s': min(runs), 'runs': runs}
+
+
+def bench_document(text, segment_sizes, repeat, memory, analyzers):
+    """Time every pipeline stage on one text for each segment size"""
+    import revisions
+    from pipeline import analyze_statistics, ladder, ngram_features, to_json
+    from utils.pos_tagging import POSTagger
+
+    stylometric_analyzer, obfuscation_scorer, llama_analyzer = analyzers
+    document, runs = measure(lambda: stylometric_analyzer.tokenize(text), repeat)
+    results = {'words': len(text.split()), 'stages': {'tokenize': summarize(runs)}, 'segment_sizes': {}}
+
+    if stylometric_analyzer.pos_tagging:
+        # every sentence tagged, then every sentence found in the cache
+        def tag(tagger):
+            document.pos_counts = None
+            tagger.document_counts(document)
+
+        _, runs = measure(lambda: tag(POSTagger()), repeat)
+        results['stages']['pos_tagging'] = summarize(runs)
+        _, runs = measure(lambda: tag(stylometric_analyzer.pos_tagger), repeat)
+        results['stages']['pos_tagging_cached'] = summarize(runs)
+
+    # every segment size and the paragraphs scored from one FeatureIndex and one n-gram pass
+    def scan():
+        document.feature_index = None
+        ladder(stylometric_analyzer, obfuscation_scorer, document, segment_sizes)
+
+    _, runs = measure(scan, repeat)
+    results['stages']['ladder'] = summarize(runs)
+
+    for segment_size in segment_sizes:
+        stages = {}
+
+        segments, runs = measure(lambda: stylometric_analyzer.segment_text(document, segment_size), repeat)
+        stages['segment_text'] = summarize(runs)
+        if len(segments) < 2:
+            continue
+
+        features, runs = measure(lambda: [stylometric_analyzer.extract_features(s) for s in segments], repeat)
+        stages['extract_features'] = summarize(runs)
+
+        # from the document's FeatureIndex, already built
+        bounds = [(s.start, s.end) for s in segments]
+        _, runs = measure(lambda: stylometric_analyzer.extract_range_features(document, bounds), repeat)
+        stages['extract_range_features'] = summarize(runs)
+
+        stride = max(1, segment_size // 4)
+        windows = stylometric_analyzer.segment_text(document, segment_size, stride)
+        _, runs = measure(lambda: list(stylometric_analyzer.extract_window_features(windows)), repeat)
+        stages['extract_window_features'] = summarize(runs)
+
+        ngram_matrix, runs = measure(lambda: ngram_features(segments, segment_size), repeat)
+        stages['extract_ngram_features'] = summarize(runs)
+
+        _, runs = measure(lambda: obfuscation_scorer.calculate_obfuscation_score(features), repeat)
+        stages['calculate_obfuscation_score'] = summarize(runs)
+
+        _, runs = measure(lambda: obfuscation_scorer.cosine_drift(ngram_matrix), repeat)
+        stages['cosine_drift'] = summarize(runs)
+
+        texts = [s.text for s in segments]
+        _, runs = measure(lambda: llama_analyzer.detect_inconsistencies(texts), repeat)
+        stages['detect_inconsistencies'] = summarize(runs)
+
+        response, runs = measure(lambda: analyze_statistics(
+            text, segment_size, stylometric_analyzer, obfuscation_scorer, llama_analyzer
+        ), repeat)
+        stages['analyze_statistics'] = summarize(runs)
+
+        # a sentence inserted mid-document, re-analyzed from the previous revision
+        base = revisions.analyze(stylometric_analyzer, text, segment_size)
+        middle = text.find(' ', len(text) // 2)
+        edited = text[:middle] + ' An editor added this sentence.' + text[middle:]
+
+        def revise():
+            revision = revisions.revise(stylometric_analyzer, base, edited)
+            revisions.score(revision, obfuscation_scorer, llama_analyzer)
+
+        _, runs = measure(revise, repeat)
+        stages['analyze_revision'] = summarize(runs)
+
+        _, runs = measure(lambda: to_json(response), repeat)
+        stages['encode_response'] = summarize(runs)
+
+        compact = analyze_statistics(text, segment_size, stylometric_analyzer, obfuscation_scorer, llama_analyzer,
+                                     compact=True)
+        _, runs = measure(lambda: to_json(compact), repeat)
+        stages['encode_compact_response'] = summarize(runs)
+
+        entry = {'segments': len(segments), 'stages': stages}
+        if memory:
+            tracemalloc.start()
+            analyze_statistics(text, segment_size, stylometric_analyzer, obfuscation_scorer, llama_analyzer)
+            entry['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        results['segment_sizes'][f'seg{segment_size}'] = entry
+        print(f"  segment_size {segment_size}: analyze_statistics "
+              f"{stages['analyze_statistics']['median_s'] * 1000:.1f} ms, {len(segments)} segments", file=sys.stderr)
+
+    return results
+
+
+def bench_stages(sizes, segment_sizes, repeat, memory, corpus_dir):
+    from models.llama_analyzer import LlamaStyleAnalyzer
+    from models.stylometry import StylometricAnalyzer
+    from models.obfuscation_scorer import ObfuscationScorer
+
+    analyzers = (StylometricAnalyzer(), ObfuscationScorer(), LlamaStyleAnalyzer())
+    corpus = SyntheticCorpus()
+    results = {}
+
+    for n_words in sizes:
+        print(f"synthetic {n_words} words", file=sys.stderr)
+        text = corpus.document(seed=n_words, n_words=n_words, styles=STYLE_MIX)
+        # very long documents take seconds per stage; one run is stable enough
+        runs = repeat if n_words < 200000 else 1
+        results[f'synthetic/{n_words}w'] = bench_document(text, segment_sizes, runs, memory, analyzers)
+
+    for name, text in load_public_domain(corpus_dir):
+        print(f"public domain {name}", file=sys.stderr)
+        text = fit_length(text, 20000)
+        results[f'public/{name}'] = bench_document(text, (200,), repeat, memory, analyzers)
+
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_app(llm_url, port):
+    """Start the API in a uvicorn subprocess pointed at the fake LLM"""
+    env = dict(os.environ, GROQ_API_KEY='benchmark', GROQ_BASE_URL=llm_url)
+    env.pop('CACHE_DIR', None)
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        env=env
+    )
+
+
+async def wait_ready(client, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get('/health')).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError("API did not become ready")
+
+
+async def load_test(client, texts, concurrency):
+    """POST every text to /analyze with at most ``concurrency`` requests in flight"""
+    latencies = []
+    errors = 0
+    queue = list(texts)
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            text = queue.pop()
+            start = time.perf_counter()
+            try:
+                response = await client.post('/analyze', json={'text': text})
+                if response.status_code != 200:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_s': latencies[len(latencies) // 2],
+        'p95_s': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+async def bench_end_to_end(concurrency_levels, requests, n_words, llm_latency):
+    import httpx
+
+    corpus = SyntheticCorpus()
+    results = {}
+
+    with FakeGroqServer(latency=llm_latency) as llm:
+        port = free_port()
+        start = time.perf_counter()
+        process = start_app(llm.url, port)
+        try:
+            async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=300) as client:
+                await wait_ready(client)
+                ready = time.perf_counter() - start
+                # the first request also pays for any loading left after startup
+                await client.post('/analyze', json={'text': corpus.document(0, n_words, STYLE_MIX)})
+                startup = {'ready_s': ready, 'first_analyze_s': time.perf_counter() - start}
+                print(f"ready after {ready:.2f} s, first /analyze done after "
+                      f"{startup['first_analyze_s']:.2f} s", file=sys.stderr)
+
+                for level, concurrency in enumerate(concurrency_levels):
+                    # distinct texts so the result cache never answers
+                    texts = [corpus.document(1000 * (level + 1) + i, n_words, STYLE_MIX) for i in range(requests)]
+                    result = await load_test(client, texts, concurrency)
+                    results[f'c{concurrency}'] = result
+                    print(f"concurrency {concurrency}: {result['throughput_rps']:.2f} req/s, "
+                          f"p50 {result['p50_s'] * 1000:.0f} ms, p95 {result['p95_s'] * 1000:.0f} ms, "
+                          f"{result['errors']} errors", file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    return {'words': n_words, 'llm_latency_s': llm_latency, 'startup': startup, 'levels': results}
+
+
+def metrics_of(results):
+    """Flatten results to {name: (value, higher_is_better)} for comparison"""
+    metrics = {}
+    for document, doc_entry in results.get('stages', {}).items():
+        for stage, timing in doc_entry['stages'].items():
+            metrics[f'stages/{document}/{stage}'] = (timing['min_s'], False)
+        for key, entry in doc_entry['segment_sizes'].items():
+            # the fastest run is the least disturbed by other load on the machine
+            for stage, timing in entry['stages'].items():
+                metrics[f'stages/{document}/{key}/{stage}'] = (timing['min_s'], False)
+            if 'peak_memory_bytes' in entry:
+                metrics[f'memory/{document}/{key}'] = (entry['peak_memory_bytes'], False)
+
+    for name, seconds in results.get('end_to_end', {}).get('startup', {}).items():
+        metrics[f'end_to_end/startup/{name}'] = (seconds, False)
+    for level, entry in results.get('end_to_end', {}).get('levels', {}).items():
+        metrics[f'end_to_end/{level}/throughput_rps'] = (entry['throughput_rps'], True)
+        metrics[f'end_to_end/{level}/p50_s'] = (entry['p50_s'], False)
+        metrics[f'end_to_end/{level}/p95_s'] = (entry['p95_s'], False)
+    return metrics
+
+
+def compare(results, baseline, tolerance):
+    """Metrics that regressed by more than ``tolerance`` relative to the baseline"""
+    current = metrics_of(results)
+    regressions = []
+    for name, (base_value, higher_is_better) in metrics_of(baseline).items():
+        if name not in current:
+            continue
+        value = current[name][0]
+        if name.startswith('stages/') and max(value, base_value) < MIN_COMPARABLE_SECONDS:
+            continue
+        if higher_is_better:
+            change = (base_value - value) / base_value if base_value else 0.0
+        else:
+            change = (value - base_value) / base_value if base_value else 0.0
+        if change > tolerance:
+            regressions.append((name, base_value, value, change))
+    return regressions
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the obfuscation detector")
+    parser.add_argument('--quick', action='store_true', help=f"only documents up to {QUICK_SIZES[-1]} words")
+    parser.add_argument('--sizes', type=int, nargs='+', help="document sizes in words")
+    parser.add_argument('--segment-sizes', type=int, nargs='+', default=list(SEGMENT_SIZES))
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage, the median is reported")
+    parser.add_argument('--memory', action='store_true', help="also record peak traced memory (slower)")
+    parser.add_argument('--corpus-dir', help="directory of public-domain .txt files to benchmark as well")
+    parser.add_argument('--no-end-to-end', action='store_true', help="skip the /analyze load test")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=list(CONCURRENCY))
+    parser.add_argument('--requests', type=int, default=32, help="requests per concurrency level")
+    parser.add_argument('--request-words', type=int, default=3000, help="words per /analyze request")
+    parser.add_argument('--llm-latency', type=float, default=0.3, help="fake Groq latency in seconds")
+    parser.add_argument('-o', '--output', help="write results JSON here (default: stdout)")
+    parser.add_argument('--baseline', help="results JSON to compare against")
+    parser.add_argument('--save-baseline', help="also write the results to this baseline path")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    results = {
+        'environment': environment(),
+        'stages': bench_stages(sizes, args.segment_sizes, args.repeat, args.memory, args.corpus_dir),
+    }
+    if not args.no_end_to_end:
+        results['end_to_end'] = asyncio.run(bench_end_to_end(
+            args.concurrency, args.requests, args.request_words, args.llm_latency
+        ))
+
+    encoded = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(encoded + '\n')
+    else:
+        print(encoded)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            f.write(encoded + '\n')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, base_value, value, change in regressions:
+            print(f"REGRESSION {name}: {base_value:.4g} -> {value:.4g} ({change:+.0%})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""Background analysis jobs for documents too large to analyze within a request
+
+A job is submitted with its text and segment parameters, runs on one of a
+fixed number of workers in submission order, reports how many segments it
+has processed, and keeps its result until it expires. Jobs live in a SQLite
+database, so jobs still queued or running when the process stops are queued
+again when it starts. Once ``max_queued`` jobs are waiting, submissions are
+refused until the queue drains.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# seconds between progress writes to the database for one job
+PROGRESS_INTERVAL = 0.5
+
+class QueueFullError(Exception):
+    """Too many jobs are already waiting"""
+
+class JobCancelled(Exception):
+    """Raised in a job's work once it has been cancelled"""
+
+class JobStore:
+    """Jobs, their texts and results in a SQLite database"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ':memory:':
+                self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    text TEXT,
+                    segments_done INTEGER NOT NULL DEFAULT 0,
+                    segments_total INTEGER,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            self._db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+
+    def add(self, job_id, params, text):
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO jobs (id, status, params, text, created_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, QUEUED, json.dumps(params), text, time.time())
+            )
+
+    def get(self, job_id):
+        """Status of a job, without its text or result; None if unknown"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id, status, params, segments_done, segments_total, error, created_at, started_at, finished_at '
+                'FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, status, params, done, total, error, created_at, started_at, finished_at = row
+        job = {
+            'job_id': job_id,
+            'status': status,
+            'params': json.loads(params),
+            'progress': {'segments_done': done, 'segments_total': total},
+            'created_at': created_at,
+            'started_at': started_at,
+            'finished_at': finished_at
+        }
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def text(self, job_id):
+        with self._lock:
+            row = self._db.execute('SELECT text FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row and row[0]
+
+    def result(self, job_id):
+        """The JSON-encoded result of a finished job, or None"""
+        with self._lock:
+            row = self._db.execute('SELECT result FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row and row[0]
+
+    def start(self, job_id):
+        with self._lock:
+            self._db.execute(
+                'UPDATE jobs SET status = ?, started_at = ? WHERE id = ?', (RUNNING, time.time(), job_id)
+            )
+
+    def update_progress(self, job_id, done, total):
+        with self._lock:
+            self._db.execute(
+                'UPDATE jobs SET segments_done = ?, segments_total = ? WHERE id = ?', (done, total, job_id)
+            )
+
+    def finish(self, job_id, status, result=None, error=None, only_if=None):
+        """Record a job's outcome and drop its text
+
+        With ``only_if``, the job is only updated while in one of those
+        statuses; returns whether it was updated.
+        """
+        query = 'UPDATE jobs SET status = ?, result = ?, error = ?, text = NULL, finished_at = ? WHERE id = ?'
+        args = [status, result, error, time.time(), job_id]
+        if only_if:
+            query += f' AND status IN ({", ".join("?" * len(only_if))})'
+            args.extend(only_if)
+        with self._lock:
+            return self._db.execute(query, args).rowcount > 0
+
+    def requeue_unfinished(self):
+        """Queue interrupted jobs again; returns the ids of all queued jobs, oldest first"""
+        with self._lock:
+            self._db.execute(
+                'UPDATE jobs SET status = ?, segments_done = 0, started_at = NULL WHERE status = ?',
+                (QUEUED, RUNNING)
+            )
+            rows = self._db.execute(
+                'SELECT id FROM jobs WHERE status = ? ORDER BY created_at', (QUEUED,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def purge(self, finished_before):
+        """Delete jobs that finished before the given time"""
+        with self._lock:
+            self._db.execute('DELETE FROM jobs WHERE finished_at < ?', (finished_before,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class Job:
+    """A running job, shared by the event loop and the thread doing its work"""
+
+    def __init__(self, job_id, params, text, store, notify):
+        self.id = job_id
+        self.params = params
+        self.text = text
+        self.cancel_requested = threading.Event()
+        self.task = None
+        self._store = store
+        self._notify = notify
+        self._last_saved = 0.0
+
+    def progress(self, done, total):
+        """Record ``done`` of ``total`` segments processed; raises JobCancelled once the job is cancelled
+
+        Safe to call from any thread. Writes and notifications are throttled
+        to one per PROGRESS_INTERVAL, except for the first and last segment.
+        """
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+        now = time.monotonic()
+        if done in (0, total) or now - self._last_saved >= PROGRESS_INTERVAL:
+            self._last_saved = now
+            self._store.update_progress(self.id, done, total)
+            self._notify(self.id)
+
+class JobQueue:
+    """Runs jobs from a JobStore on ``workers`` asyncio workers
+
+    ``handler`` is a coroutine function taking a Job and returning its
+    JSON-encoded result. It reports progress with ``job.progress`` and should
+    do CPU-bound work off the event loop. A cancelled job has its handler
+    task cancelled, and its next ``job.progress`` call raises JobCancelled.
+    """
+
+    def __init__(self, store, handler, workers=1, max_queued=100, retention=86400):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self._queue = None
+        self._loop = None
+        self._tasks = []
+        self._running = {}
+        self._changes = {}
+        self._stopping = False
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self.store.purge(time.time() - self.retention)
+        for job_id in self.store.requeue_unfinished():
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers; interrupted jobs run again after the next start"""
+        self._stopping = True
+        for job in self._running.values():
+            job.cancel_requested.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @property
+    def queued(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def submit(self, params, text):
+        """Queue a job, returning its status; raises QueueFullError when the queue is full"""
+        if self.queued >= self.max_queued:
+            raise QueueFullError(f"{self.queued} jobs are already queued")
+
+        self.store.purge(time.time() - self.retention)
+        job_id = uuid.uuid4().hex
+        self.store.add(job_id, params, text)
+        self._queue.put_nowait(job_id)
+        return self.store.get(job_id)
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job, returning its status; None if unknown"""
+        if self.store.finish(job_id, CANCELLED, only_if=(QUEUED,)):
+            self._notify(job_id)
+        elif job_id in self._running:
+            job = self._running[job_id]
+            job.cancel_requested.set()
+            job.task.cancel()
+        return self.store.get(job_id)
+
+    async def watch(self, job_id, heartbeat=15.0):
+        """Yield the job's status whenever it changes, until it finishes
+
+        The status is repeated every ``heartbeat`` seconds without changes.
+        """
+        while True:
+            # taken before reading the status so no change in between is missed
+            changed = self._changes.setdefault(job_id, asyncio.Event())
+            job = self.store.get(job_id)
+            if job is None:
+                return
+            yield job
+            if job['status'] in FINISHED:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                pass
+
+    def _notify(self, job_id):
+        """Wake watchers of a job; safe to call from any thread"""
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._wake(job_id)
+        else:
+            self._loop.call_soon_threadsafe(self._wake, job_id)
+
+    def _wake(self, job_id):
+        changed = self._changes.pop(job_id, None)
+        if changed is not None:
+            changed.set()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            status = self.store.get(job_id)
+            # cancelled while queued
+            if status is None or status['status'] != QUEUED:
+                continue
+
+            job = Job(job_id, status['params'], self.store.text(job_id), self.store, self._notify)
+            self._running[job_id] = job
+            self.store.start(job_id)
+            self._notify(job_id)
+            try:
+                job.task = asyncio.create_task(self.handler(job))
+                result = await job.task
+            except (JobCancelled, asyncio.CancelledError):
+                if self._stopping:
+                    # left running so the next start queues it again
+                    raise
+                self.store.finish(job_id, CANCELLED)
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                self.store.finish(job_id, FAILED, error=str(e))
+            else:
+                self.store.finish(job_id, DONE, result=result)
+            finally:
+                del self._running[job_id]
+                self._notify(job_id)
@@ -0,0 +1,246 @@
+"""Author reference profiles and nearest-profile search
+
+A profile summarizes an author's reference texts: the mean and standard
+deviation of every stylometric feature over fixed-size segments, function
+word frequencies and hashed word-bigram frequencies. Profiles are
+standardized against the whole catalogue and stored in a memory-mapped
+ProfileIndex, which finds the profiles closest to a document without
+scanning all of them.
+
+    python -m models.author_profiles build authors.jsonl -o profiles --workers 4
+
+Input is JSONL with one ``{"author": ..., "text": ...}`` object per line;
+all texts of an author are pooled into one profile.
+"""
+import argparse
+import json
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+from models.obfuscation_scorer import FEATURE_COLUMNS, features_to_matrix
+from models.stylometry import StylometricAnalyzer
+from utils.feature_extractors import FeatureExtractor
+from utils.nlp_resources import warm_up
+from utils.profile_index import ProfileIndex
+
+NGRAM_DIMS = 256
+
+# share of each block in a profile vector's similarity
+BLOCK_WEIGHTS = {'stylometry': 0.4, 'function_words': 0.4, 'ngrams': 0.2}
+
+class AuthorProfiler:
+    """Turns tokenized documents into additive feature totals and profiles"""
+    
+    def __init__(self, stylometric_analyzer=None, segment_size=200, ngram_dims=NGRAM_DIMS):
+        self.stylometric_analyzer = stylometric_analyzer or StylometricAnalyzer()
+        self.feature_extractor = FeatureExtractor()
+        self.segment_size = segment_size
+        self.ngram_dims = ngram_dims
+        
+        n_features = len(FEATURE_COLUMNS)
+        n_function_words = len(self.feature_extractor.function_word_order)
+        # profile layout: feature means and standard deviations, function words, n-gram buckets
+        self.blocks = {
+            'stylometry': slice(0, 2 * n_features),
+            'function_words': slice(2 * n_features, 2 * n_features + n_function_words),
+            'ngrams': slice(2 * n_features + n_function_words, 2 * n_features + n_function_words + ngram_dims)
+        }
+    
+    def totals(self, document):
+        """Feature totals of a tokenized document
+        
+        Totals of several documents add up to those of their concatenation,
+        segment for segment, so an author's texts are pooled by summing.
+        Exactly so when every document but the last ends a sentence after a
+        whole number of segments, save for the word bigram across each seam.
+        Layout: segments, feature sums, squared feature sums, words,
+        function word counts, bigrams, n-gram bucket counts.
+        """
+        segments = self.stylometric_analyzer.segment_text(document, self.segment_size)
+        matrix = features_to_matrix([self.stylometric_analyzer.extract_features(seg) for seg in segments])
+        words = document.tokens
+        return np.concatenate([
+            [len(segments)],
+            matrix.sum(axis=0),
+            (matrix ** 2).sum(axis=0),
+            [len(words)],
+            self.feature_extractor.function_word_vector(words),
+            [max(len(words) - 1, 0)],
+            self.feature_extractor.hashed_ngram_vector(words, 2, self.ngram_dims)
+        ])
+    
+    def profile(self, totals):
+        """Feature means and standard deviations, function word and bigram frequencies"""
+        n_features = len(FEATURE_COLUMNS)
+        n_function_words = len(self.feature_extractor.function_word_order)
+        totals = np.asarray(totals, dtype=np.float64)
+        
+        segments = max(totals[0], 1)
+        means = totals[1:1 + n_features] / segments
+        squares = totals[1 + n_features:1 + 2 * n_features] / segments
+        stds = np.sqrt(np.maximum(squares - means ** 2, 0))
+        
+        words_at = 1 + 2 * n_features
+        function_words = totals[words_at + 1:words_at + 1 + n_function_words] / max(totals[words_at], 1)
+        bigrams_at = words_at + 1 + n_function_words
+        ngrams = totals[bigrams_at + 1:] / max(totals[bigrams_at], 1)
+        return np.concatenate([means, stds, function_words, ngrams])
+    
+    def vectorize(self, profiles, center, scale):
+        """Standardized profiles with each block scaled to its share of the similarity"""
+        standardized = (np.atleast_2d(profiles) - center) / scale
+        parts = []
+        for name, block in self.blocks.items():
+            part = standardized[:, block]
+            norms = np.linalg.norm(part, axis=1, keepdims=True)
+            parts.append(part / np.where(norms > 0, norms, 1) * np.sqrt(BLOCK_WEIGHTS[name]))
+        return np.hstack(parts)
+
+class AuthorProfiles:
+    """A catalogue of author profiles searchable by similarity to a document"""
+    
+    def __init__(self, directory, stylometric_analyzer=None):
+        self.index = ProfileIndex(directory)
+        meta = self.index.meta
+        self.profiler = AuthorProfiler(stylometric_analyzer, meta['segment_size'], meta['ngram_dims'])
+        if (meta['feature_columns'] != list(FEATURE_COLUMNS)
+                or meta.get('feature_version') != self.profiler.stylometric_analyzer.feature_version
+                or meta['function_words'] != self.profiler.feature_extractor.function_word_order):
+            raise ValueError(f"Author profiles in {directory} use other features; rebuild them")
+        self.center = np.array(meta['center'])
+        self.scale = np.array(meta['scale'])
+    
+    def __len__(self):
+        return len(self.index)
+    
+    def match(self, document, k=5, author=None, n_probe=None):
+        """The ``k`` profiles closest to a tokenized document
+        
+        With ``author``, also compares the document with that author's
+        profile: their similarity and, per feature, how many of the
+        author's standard deviations the document's mean lies away.
+        """
+        profile = self.profiler.profile(self.profiler.totals(document))
+        vector = self.profiler.vectorize(profile, self.center, self.scale)[0]
+        
+        result = {
+            'matches': [{'author': self.index.ids[row], 'similarity': similarity}
+                        for row, similarity in self.index.search(vector, k, n_probe)]
+        }
+        if author is not None:
+            result['author'] = self.compare(profile, vector, author)
+        return result
+    
+    def compare(self, profile, vector, author):
+        row = self.index.row(author)
+        if row is None:
+            return None
+        
+        n_features = len(FEATURE_COLUMNS)
+        extra = np.asarray(self.index.extra[row], dtype=np.float64)
+        author_means, author_stds, author_segments = extra[:n_features], extra[n_features:2 * n_features], extra[-1]
+        # a single segment has no spread; fall back to the spread across authors
+        spread = np.where((author_segments > 1) & ~_negligible(author_stds, author_means),
+                          author_stds, self.scale[:n_features])
+        deviations = (profile[:n_features] - author_means) / spread
+        
+        return {
+            'author': author,
+            'similarity': float(np.dot(self.index.vectors[row], vector / np.linalg.norm(vector))),
+            'feature_deviations': {name: float(z) for name, z in zip(FEATURE_COLUMNS, deviations)}
+        }
+    
+    @classmethod
+    def build(cls, directory, author_totals, profiler=None, n_lists=None):
+        """Build the catalogue from ``{author: totals}`` into ``directory``"""
+        profiler = profiler or AuthorProfiler()
+        authors = sorted(author_totals)
+        if not authors:
+            raise ValueError("No author profiles to build")
+        totals = np.array([author_totals[author] for author in authors])
+        profiles = np.array([profiler.profile(t) for t in totals])
+        
+        center = profiles.mean(axis=0)
+        scale = profiles.std(axis=0)
+        # bigram buckets are only centered: rare buckets would dominate once scaled
+        scale[profiler.blocks['ngrams']] = 1
+        # constant features, such as approximate POS ratios, carry no information
+        scale[_negligible(scale, center)] = 1
+        
+        n_features = len(FEATURE_COLUMNS)
+        extra = np.hstack([profiles[:, :2 * n_features], totals[:, :1]])
+        meta = {
+            'segment_size': profiler.segment_size,
+            'ngram_dims': profiler.ngram_dims,
+            'feature_columns': list(FEATURE_COLUMNS),
+            'feature_version': profiler.stylometric_analyzer.feature_version,
+            'function_words': profiler.feature_extractor.function_word_order,
+            'block_weights': BLOCK_WEIGHTS,
+            'center': center.tolist(),
+            'scale': scale.tolist()
+        }
+        ProfileIndex.build(directory, authors, profiler.vectorize(profiles, center, scale), extra, meta, n_lists)
+        return cls(directory, profiler.stylometric_analyzer)
+
+def _negligible(spread, values):
+    """Spreads that are only rounding error relative to the values"""
+    return spread <= 1e-9 * np.maximum(np.abs(values), 1)
+
+# per-process profiler for building with a pool
+_profiler = None
+
+def _init_worker(segment_size, ngram_dims):
+    global _profiler
+    warm_up()
+    _profiler = AuthorProfiler(segment_size=segment_size, ngram_dims=ngram_dims)
+
+def _line_totals(line):
+    try:
+        record = json.loads(line)
+        author, text = str(record['author']), record['text']
+        if not isinstance(text, str):
+            raise ValueError("'text' must be a string")
+    except (ValueError, KeyError, TypeError) as e:
+        return None, f"Invalid input line: {e}"
+    return author, _profiler.totals(_profiler.stylometric_analyzer.tokenize(text))
+
+def build_from_jsonl(lines, directory, workers=1, segment_size=200, ngram_dims=NGRAM_DIMS, n_lists=None):
+    """Pool the texts of every author in JSONL ``lines`` and build the catalogue"""
+    author_totals = {}
+    lines = (line for line in lines if line.strip())
+    with Pool(workers, initializer=_init_worker, initargs=(segment_size, ngram_dims)) as pool:
+        for author, totals in pool.imap(_line_totals, lines, chunksize=8):
+            if author is None:
+                print(totals, file=sys.stderr)
+            elif author in author_totals:
+                author_totals[author] += totals
+            else:
+                author_totals[author] = totals
+    
+    profiler = AuthorProfiler(segment_size=segment_size, ngram_dims=ngram_dims)
+    return AuthorProfiles.build(directory, author_totals, profiler, n_lists)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build author reference profiles")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="build a profile catalogue from JSONL texts")
+    build.add_argument('input', help="JSONL file of {author, text} objects, or - for stdin")
+    build.add_argument('-o', '--output', required=True, help="catalogue directory, replaced if it exists")
+    build.add_argument('--workers', type=int, default=1, help="worker processes")
+    build.add_argument('--segment-size', type=int, default=200)
+    build.add_argument('--lists', type=int, default=None, help="index lists (default: about 2 * sqrt(authors))")
+    args = parser.parse_args(argv)
+    
+    infile = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    try:
+        profiles = build_from_jsonl(infile, args.output, args.workers, args.segment_size, n_lists=args.lists)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    print(f"{len(profiles)} author profiles in {args.output} "
+          f"({profiles.index.n_lists} lists, probing {profiles.index.default_n_probe})", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""Limits, weights and risk levels of ObfuscationScorer fitted to a labelled corpus
+
+    python -m models.calibration fit corpus.jsonl -o calibration.json --workers 4
+
+Input is JSONL with one ``{"text": ..., "label": 0 or 1}`` object per line:
+0 for a text written naturally by one author, 1 for an obfuscated or
+mixed-authorship text. Texts are featurized as /analyze does.
+
+Every limit is set where clean texts cross it at the target false positive
+rate. The coefficients of variation of word length and type-token ratio
+come from bootstrapping the segments of each clean text, all resamples of a
+text in one array operation, so a small corpus still yields thousands of
+values; jumps between adjacent segments, outlier distances and segment
+deviations are pooled over clean texts. The component weights are fitted
+by logistic regression of the label on the component scores, separately
+for short and long documents, and the risk levels placed where clean texts
+score higher 10%, 5% and 1% of the time. Whatever the corpus is too small
+to estimate keeps its default.
+
+The result is versioned JSON, loaded by ObfuscationScorer from
+SCORER_CALIBRATION at startup. It also holds the clean null distributions
+that give lexical_inconsistency and unnatural_variation their p-values,
+and how often clean texts crossed each default limit.
+"""
+import argparse
+import hashlib
+import json
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from models.features import SCHEMA_VERSION
+from models.obfuscation_scorer import (DEFAULT_LIMITS, DEFAULT_WEIGHTS, SUSPICIOUS_SEGMENT_SCORE, COLUMN_INDEX,
+                                       ObfuscationScorer, features_to_matrix, lexical_statistics)
+
+# bumped whenever the layout of a calibration changes
+CONFIG_VERSION = 1
+
+# bootstrap resamples of each clean text
+BOOTSTRAP_RESAMPLES = 200
+
+# points kept of each null distribution
+NULL_QUANTILES = 1001
+
+# how often clean texts may reach each risk level
+RISK_FALSE_POSITIVE_RATES = {'low_suspicion': 0.10, 'medium_suspicion': 0.05, 'high_suspicion': 0.01}
+
+# a fitted risk level below this keeps its default: when most clean texts score 0 the quantile
+# is 0 and any trace of inconsistency would otherwise reach the level
+MIN_RISK_LEVEL = 0.05
+
+# texts of each label a regime needs before its weights are fitted
+MIN_CLASS_TEXTS = 10
+
+def load(path):
+    """A calibration saved by save; raises ValueError for one this version cannot use"""
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    if config.get('version') != CONFIG_VERSION:
+        raise ValueError(f"{path}: calibration version {config.get('version')}, expected {CONFIG_VERSION}")
+    if config.get('schema_version') != SCHEMA_VERSION:
+        raise ValueError(f"{path}: fitted on feature schema {config.get('schema_version')}, "
+                         f"features are schema {SCHEMA_VERSION}")
+    return config
+
+def save(config, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=1)
+
+def fit(documents, segment_size, feature_version, false_positive_rate=0.05, resamples=BOOTSTRAP_RESAMPLES, seed=0):
+    """Calibration of the (label, segments x features matrix, n-gram matrix) of featurized texts"""
+    clean = [matrix for label, matrix, _ in documents if label == 0]
+    if not clean:
+        raise ValueError("The corpus has no clean (label 0) texts to calibrate against.")
+    rng = np.random.default_rng(seed)
+    quantile = 1 - false_positive_rate
+
+    # coefficients of variation of every bootstrap resample of every clean text
+    samples = [matrix[rng.integers(0, len(matrix), size=(resamples, len(matrix)))] for matrix in clean]
+    pooled = {
+        'word_length_cv': _cv(samples, 'avg_word_length'),
+        'type_token_ratio_cv': _cv(samples, 'type_token_ratio'),
+        'sentence_length_jump': np.concatenate([np.abs(np.diff(m[:, COLUMN_INDEX['avg_sentence_length']]))
+                                                for m in clean]),
+        'function_word_shift': np.concatenate([np.abs(np.diff(m[:, COLUMN_INDEX['function_word_ratio']]))
+                                               for m in clean]),
+    }
+    # fitted from the defaults, never from a calibration SCORER_CALIBRATION may name
+    scorer = ObfuscationScorer(calibration=False)
+    scorer.max_permutations = 0
+    pooled['outlier_distance'] = np.concatenate([scorer.detect_outliers(m)['distances'] for m in clean])
+    deviations = [scorer.segment_deviations(m) for m in clean]
+    pooled['segment_z_scale'] = np.concatenate([d[~np.isnan(d)] for d in deviations if d is not None])
+
+    limits, crossing_rates = {}, {}
+    for name, values in pooled.items():
+        values = values[np.isfinite(values)]
+        fitted = None
+        if len(values) * false_positive_rate >= 1:
+            fitted = float(np.quantile(values, quantile))
+            if name == 'segment_z_scale':
+                # a segment is suspicious from SUSPICIOUS_SEGMENT_SCORE of the scale on
+                fitted /= SUSPICIOUS_SEGMENT_SCORE
+        limits[name] = DEFAULT_LIMITS[name] if fitted is None or fitted <= 0 else fitted
+        crossing = values / SUSPICIOUS_SEGMENT_SCORE if name == 'segment_z_scale' else values
+        crossing_rates[name] = {
+            'default': float(np.mean(crossing > DEFAULT_LIMITS[name])) if len(values) else None,
+            'fitted': float(np.mean(crossing > limits[name])) if len(values) else None,
+            'samples': int(len(values)),
+        }
+    scorer.limits = limits
+
+    null_distributions = {
+        'lexical_inconsistency': _quantiles(np.concatenate([lexical_statistics(s, limits) for s in samples])),
+        'unnatural_variation': _quantiles(np.array([len(scorer.detect_outliers(m)['outliers']) / len(m)
+                                                    for m in clean])),
+    }
+
+    # component scores of every text under the fitted limits
+    scored = [(label, scorer.score_matrix(matrix, 1, ngram_matrix)['component_scores'])
+              for label, matrix, ngram_matrix in documents]
+    weights, drift_weights = {}, []
+    for regime, defaults in DEFAULT_WEIGHTS.items():
+        texts = [(label, scores) for label, scores in scored if set(defaults) <= set(scores)]
+        fitted = _fit_weights(texts, list(defaults))
+        weights[regime] = dict(defaults) if fitted is None else fitted[0]
+        if fitted is not None and fitted[1] is not None:
+            drift_weights.append(fitted[1])
+    scorer.weights = weights
+    scorer.cosine_drift_weight = float(np.mean(drift_weights)) if drift_weights else scorer.cosine_drift_weight
+
+    overall = np.array([scorer.score_matrix(matrix, 1, ngram_matrix)['overall_score']
+                        for label, matrix, ngram_matrix in documents if label == 0])
+    risk_levels = _risk_levels(overall, scorer.thresholds)
+
+    config = {
+        'version': CONFIG_VERSION,
+        'schema_version': SCHEMA_VERSION,
+        'feature_version': feature_version,
+        'segment_size': segment_size,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'false_positive_rate': false_positive_rate,
+        'corpus': {'clean': len(clean), 'obfuscated': len(documents) - len(clean)},
+        'limits': limits,
+        'weights': weights,
+        'cosine_drift_weight': scorer.cosine_drift_weight,
+        'risk_levels': risk_levels,
+        'null_distributions': {name: values.tolist() for name, values in null_distributions.items()},
+        'crossing_rates': crossing_rates,
+    }
+    # the same fit gets the same id whenever it was made, so caches keyed by it stay valid
+    content = {k: v for k, v in config.items() if k != 'created'}
+    config['id'] = hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return config
+
+def _cv(samples, column):
+    """Coefficient of variation of a feature column in every bootstrap resample"""
+    values = [s[:, :, COLUMN_INDEX[column]] for s in samples]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.concatenate([v.std(axis=1) / v.mean(axis=1) for v in values])
+
+def _quantiles(values):
+    """A null distribution cut down to at most NULL_QUANTILES points"""
+    values = np.sort(values[np.isfinite(values)])
+    if len(values) > NULL_QUANTILES:
+        values = np.quantile(values, np.linspace(0, 1, NULL_QUANTILES))
+    return values
+
+def _risk_levels(overall, defaults):
+    """Risk levels placed on the clean texts' overall scores, each kept at its default when they cannot place it"""
+    risk_levels = {}
+    for level, rate in RISK_FALSE_POSITIVE_RATES.items():
+        if len(overall) * rate >= 1:
+            # a score has to beat all but ``rate`` of the clean texts
+            risk_levels[level] = float(np.nextafter(np.quantile(overall, 1 - rate, method='higher'), np.inf))
+        if level not in risk_levels or risk_levels[level] < MIN_RISK_LEVEL:
+            risk_levels[level] = defaults[level]
+    ordered = np.maximum.accumulate([risk_levels[level] for level in ('low_suspicion', 'medium_suspicion',
+                                                                       'high_suspicion')])
+    return dict(zip(('low_suspicion', 'medium_suspicion', 'high_suspicion'), ordered.tolist()))
+
+def _fit_weights(texts, components):
+    """Weights of components, and cosine drift's share if scored, from a logistic regression of the labels
+
+    Negative coefficients get no weight. None when either label has fewer
+    than MIN_CLASS_TEXTS texts or no component predicts the label.
+    """
+    labels = np.array([label for label, _ in texts])
+    if np.count_nonzero(labels == 0) < MIN_CLASS_TEXTS or np.count_nonzero(labels == 1) < MIN_CLASS_TEXTS:
+        return None
+    with_drift = all('cosine_drift' in scores for _, scores in texts)
+    columns = components + ['cosine_drift'] * with_drift
+    x = np.array([[scores[name] for name in columns] for _, scores in texts])
+
+    from sklearn.linear_model import LogisticRegression
+
+    coefficients = np.clip(LogisticRegression().fit(x, labels).coef_[0], 0, None)
+    if coefficients[:len(components)].sum() <= 0:
+        return None
+    shares = coefficients / coefficients.sum()
+    weights = dict(zip(components, (coefficients[:len(components)] / coefficients[:len(components)].sum()).tolist()))
+    return weights, float(shares[-1]) if with_drift else None
+
+# per-process analyzer for featurizing with a pool
+_analyzer = None
+_segment_size = None
+
+def _init_worker(segment_size):
+    global _analyzer, _segment_size
+    from models.stylometry import StylometricAnalyzer
+    from utils.nlp_resources import warm_up
+
+    warm_up()
+    _analyzer = StylometricAnalyzer()
+    _segment_size = segment_size
+
+def _line_statistics(line):
+    from pipeline import AnalysisInputError, check_text, featurize
+
+    try:
+        record = json.loads(line)
+        text, label = record['text'], int(record['label'])
+        if not isinstance(text, str) or label not in (0, 1):
+            raise ValueError("'text' must be a string and 'label' 0 or 1")
+        check_text(text)
+        document = _analyzer.tokenize(text)
+        _, segment_features, _, ngram_matrix = featurize(_analyzer, document, _segment_size)
+    except (ValueError, KeyError, TypeError) as e:
+        kind = "Skipped text" if isinstance(e, AnalysisInputError) else "Invalid input line"
+        return None, f"{kind}: {e}"
+    return label, (features_to_matrix(segment_features), ngram_matrix, _analyzer.feature_version)
+
+def fit_from_jsonl(lines, workers=1, segment_size=200, false_positive_rate=0.05):
+    """Featurize the labelled texts of JSONL ``lines`` and fit a calibration"""
+    documents, feature_versions = [], set()
+    lines = (line for line in lines if line.strip())
+    with Pool(workers, initializer=_init_worker, initargs=(segment_size,)) as pool:
+        for label, result in pool.imap(_line_statistics, lines, chunksize=8):
+            if label is None:
+                print(result, file=sys.stderr)
+                continue
+            matrix, ngram_matrix, feature_version = result
+            documents.append((label, matrix, ngram_matrix))
+            feature_versions.add(feature_version)
+    if len(feature_versions) > 1:
+        raise ValueError(f"Workers computed different feature versions: {sorted(feature_versions)}")
+    return fit(documents, segment_size, feature_versions.pop() if feature_versions else None, false_positive_rate)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate the obfuscation scorer")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    fit_parser = subparsers.add_parser('fit', help="fit limits, weights and risk levels to labelled JSONL texts")
+    fit_parser.add_argument('input', help="JSONL file of {text, label} objects, or - for stdin")
+    fit_parser.add_argument('-o', '--output', required=True, help="calibration file to write")
+    fit_parser.add_argument('--workers', type=int, default=1, help="worker processes")
+    fit_parser.add_argument('--segment-size', type=int, default=200)
+    fit_parser.add_argument('--false-positive-rate', type=float, default=0.05,
+                            help="share of clean texts each limit may flag")
+    args = parser.parse_args(argv)
+
+    infile = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    try:
+        config = fit_from_jsonl(infile, args.workers, args.segment_size, args.false_positive_rate)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    save(config, args.output)
+
+    print(f"calibration {config['id']} from {config['corpus']['clean']} clean and "
+          f"{config['corpus']['obfuscated']} obfuscated texts in {args.output}", file=sys.stderr)
+    for name, rates in config['crossing_rates'].items():
+        if rates['default'] is not None:
+            print(f"  {name}: default {DEFAULT_LIMITS[name]:g} crossed by {rates['default']:.1%} of clean values, "
+                  f"fitted {config['limits'][name]:.4g} by {rates['fitted']:.1%}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+from array import array
+from collections.abc import Mapping
+
+import numpy as np
+
+# bumped whenever columns are added, removed, reordered or change meaning
+SCHEMA_VERSION = 2
+
+# column schema of the segments x features matrix, in extract_features order
+FEATURE_COLUMNS = (
+    'avg_word_length',
+    'type_token_ratio',
+    'hapax_legomena_ratio',
+    'avg_sentence_length',
+    'sentence_length_variance',
+    'avg_parse_tree_depth',
+    'noun_ratio',
+    'verb_ratio',
+    'adj_ratio',
+    'adv_ratio',
+    'function_word_ratio',
+    'comma_per_sentence',
+    'semicolon_per_sentence',
+    'flesch_reading_ease',
+)
+COLUMN_INDEX = {name: i for i, name in enumerate(FEATURE_COLUMNS)}
+
+class SegmentFeatures(Mapping):
+    """Features of one segment, one float per FEATURE_COLUMNS entry
+    
+    Reads like a feature dict (``features['noun_ratio']``, ``items()``,
+    equality with dicts) but holds a fixed-size array of doubles instead of
+    a dict of NumPy scalars.
+    """
+    
+    __slots__ = ('values',)
+    
+    def __init__(self, values):
+        self.values = array('d', values)
+        if len(self.values) != len(FEATURE_COLUMNS):
+            raise ValueError(f"Expected {len(FEATURE_COLUMNS)} feature values, got {len(self.values)}")
+    
+    @classmethod
+    def from_dict(cls, features):
+        return cls(features[name] for name in FEATURE_COLUMNS)
+    
+    def __getitem__(self, name):
+        return self.values[COLUMN_INDEX[name]]
+    
+    def __iter__(self):
+        return iter(FEATURE_COLUMNS)
+    
+    def __len__(self):
+        return len(FEATURE_COLUMNS)
+    
+    def __repr__(self):
+        return f"SegmentFeatures({self.to_dict()!r})"
+    
+    def __reduce__(self):
+        return (SegmentFeatures, (self.values,))
+    
+    def to_dict(self):
+        return dict(zip(FEATURE_COLUMNS, self.values))
+
+def features_to_matrix(segment_features):
+    """Stack per-segment features into a segments x FEATURE_COLUMNS float matrix"""
+    if all(isinstance(f, SegmentFeatures) for f in segment_features):
+        buffer = b''.join([f.values.tobytes() for f in segment_features])
+        return np.frombuffer(buffer, dtype=np.float64).reshape(len(segment_features), len(FEATURE_COLUMNS)).copy()
+    return np.array([[f[name] for name in FEATURE_COLUMNS] for f in segment_features],
+                    dtype=np.float64).reshape(len(segment_features), len(FEATURE_COLUMNS))
+
+def columnar(segment_features, dtype='<f8'):
+    """Segment features as one array per column, with column names sent once
+    
+    Columns holding the same value for every segment are listed in
+    ``constants`` instead. Arrays have the given NumPy dtype, little-endian
+    float64 by default; to_json writes them as lists.
+    """
+    matrix = segment_features if isinstance(segment_features, np.ndarray) else features_to_matrix(segment_features)
+    constant = (matrix == matrix[:1]).all(axis=0) if len(matrix) else np.zeros(len(FEATURE_COLUMNS), dtype=bool)
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'num_segments': len(matrix),
+        'dtype': dtype,
+        'columns': {name: np.ascontiguousarray(matrix[:, i], dtype=dtype)
+                    for i, name in enumerate(FEATURE_COLUMNS) if not constant[i]},
+        'constants': {name: float(matrix[0, i]) for i, name in enumerate(FEATURE_COLUMNS) if constant[i]}
+    }
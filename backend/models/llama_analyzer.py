@@ -1,21 +1,56 @@
 import os
-from groq import Groq
+import asyncio
+
+from utils.metrics import LLM_CALLS, record_llm_usage
+from utils.prompt_cache import PromptCache
+
+MODEL = "llama-3.1-8b-instant"
+DEFAULT_BASE_URL = "https://api.groq.com"
 
 class LlamaStyleAnalyzer:
     """Analyzer using Meta Llama via Groq API"""
     
     def __init__(self):
         api_key = os.environ.get("GROQ_API_KEY")
+        self.api_key = api_key
+        # GROQ_BASE_URL is also read by the Groq SDK; point it at a local stub server for testing
+        self.base_url = os.environ.get("GROQ_BASE_URL", DEFAULT_BASE_URL).rstrip('/')
+        # seconds an async call may spend waiting for a slot plus the round trip
+        self.timeout = float(os.environ.get("LLM_TIMEOUT", "10"))
+        # global cap on in-flight async LLM calls
+        self.max_concurrency = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+        # completions of identical prompts are reused for LLM_CACHE_TTL seconds
+        self.prompt_cache = PromptCache(
+            max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "1024")),
+            ttl=float(os.environ.get("LLM_CACHE_TTL", "3600"))
+        )
+        # round the explanation prompt's consistency score and segment count to these steps
+        # so similar results share a prompt; 0 keeps them exact
+        self.score_bucket = float(os.environ.get("LLM_SCORE_BUCKET", "0"))
+        self.segment_bucket = int(os.environ.get("LLM_SEGMENT_BUCKET", "0"))
+        
+        # created on first use so they bind to the running event loop
+        self._async_client = None
+        self._semaphore = None
+        # the Groq SDK is slow to import; the sync client is built on first use
+        self._client = None
+        self._client_failed = False
+        
         if not api_key:
             print("WARNING: GROQ_API_KEY not found in environment variables")
-            self.client = None
-        else:
+    
+    @property
+    def client(self):
+        """Synchronous Groq SDK client, or None without a usable API key"""
+        if self._client is None and self.api_key and not self._client_failed:
             try:
-                self.client = Groq(api_key=api_key)
+                from groq import Groq
+                self._client = Groq(api_key=self.api_key)
                 print("Llama analyzer initialized with Groq API")
             except Exception as e:
                 print(f"Failed to initialize Groq client: {e}")
-                self.client = None
+                self._client_failed = True
+        return self._client
     
     def analyze_stylistic_features(self, text):
         """Analyze stylistic features using Llama"""
@@ -23,32 +58,44 @@ class LlamaStyleAnalyzer:
             return self._fallback_analysis(text)
         
         try:
-            prompt = f"""Analyze the writing style of this text. Provide scores (1-10) for:
-1. Sentence complexity
-2. Lexical sophistication
-3. Formality level
-
-Text: {text[:500]}
-
-Respond in JSON format:
-{{"sentence_complexity": <score>, "lexical_sophistication": <score>, "formality_level": <score>}}"""
-
-            response = self.client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="llama-3.1-8b-instant",
-                temperature=0.3,
-                max_tokens=200
-            )
+            content = self._completion(self._style_prompt(text), temperature=0.3, max_tokens=200)
             
             # Parse response - handle potential JSON parsing issues
             import json
-            result = json.loads(response.choices[0].message.content)
+            result = json.loads(content)
             return result
             
         except Exception as e:
+            LLM_CALLS.inc(outcome='error')
             print(f"Llama API error: {e}")
             return self._fallback_analysis(text)
     
+    async def analyze_stylistic_features_async(self, text):
+        """Async variant of analyze_stylistic_features that does not block the event loop"""
+        if not self.api_key:
+            return self._fallback_analysis(text)
+        
+        try:
+            content = await self._chat_completion(self._style_prompt(text), temperature=0.3, max_tokens=200)
+            
+            import json
+            return json.loads(content)
+            
+        except Exception as e:
+            print(f"Llama API error: {e!r}")
+            return self._fallback_analysis(text)
+    
+    def _style_prompt(self, text):
+        return f"""Analyze the writing style of this text. Provide scores (1-10) for:
+1. Sentence complexity
+2. Lexical sophistication
+3. Formality level
+
+Text: {text[:500]}
+
+Respond in JSON format:
+{{"sentence_complexity": <score>, "lexical_sophistication": <score>, "formality_level": <score>}}"""
+    
     def _fallback_analysis(self, text):
         """Fallback analysis if API unavailable"""
         words = text.split()
@@ -66,32 +113,177 @@ Respond in JSON format:
         """Detect inconsistencies between segments using statistical analysis"""
         return self._fallback_inconsistencies(segments)
     
-    def _fallback_inconsistencies(self, segments):
-        """Fallback inconsistency detection"""
-        features = [self._fallback_analysis(seg) for seg in segments]
-        sophistications = [f['lexical_sophistication'] for f in features]
+    def lexical_sophistication(self, segment):
+        """What detect_inconsistencies compares segments by"""
+        return self._fallback_analysis(segment)['lexical_sophistication']
+    
+    def inconsistencies_from(self, sophistications):
+        """detect_inconsistencies from each segment's lexical_sophistication, for segments no longer held"""
         avg_soph = sum(sophistications) / len(sophistications)
         variance = sum((x - avg_soph)**2 for x in sophistications) / len(sophistications)
         
         return {
             'variance': variance,
             'consistency_score': 1.0 - min(variance / 10, 1.0),
-            'segments_analyzed': len(segments)
+            'segments_analyzed': len(sophistications)
         }
     
+    def _fallback_inconsistencies(self, segments):
+        """Fallback inconsistency detection"""
+        return self.inconsistencies_from([self.lexical_sophistication(seg) for seg in segments])
+    
     def generate_explanation(self, inconsistencies, text_segments):
         """Generate explanation using Llama"""
         if not self.client:
             return self._fallback_explanation(inconsistencies)
         
         try:
-            consistency = inconsistencies.get('consistency_score', 0.5)
-            sample_text = text_segments[0][:300] if text_segments else ""
+            content = self._completion(
+                self._explanation_prompt(inconsistencies, text_segments),
+                temperature=0.5,
+                max_tokens=300
+            )
+            return content.strip()
+            
+        except Exception as e:
+            LLM_CALLS.inc(outcome='error')
+            print(f"Llama explanation generation error: {e}")
+            return self._fallback_explanation(inconsistencies)
+    
+    async def generate_explanation_async(self, inconsistencies, text_segments, cache=None, cache_key=None):
+        """Async variant of generate_explanation
+        
+        Waits for a free slot under the global concurrency cap and for the
+        response within ``self.timeout`` seconds in total, and falls back to
+        the statistical explanation when that budget runs out. When a cache
+        layer is given, explanations from the LLM are looked up and stored
+        under ``cache_key``; fallbacks are never cached.
+        """
+        if not self.api_key:
+            return self._fallback_explanation(inconsistencies)
+        
+        if cache is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        try:
+            content = await self._chat_completion(
+                self._explanation_prompt(inconsistencies, text_segments),
+                temperature=0.5,
+                max_tokens=300
+            )
+            explanation = content.strip()
+            if cache is not None:
+                cache.put(cache_key, explanation)
+            return explanation
+            
+        except Exception as e:
+            print(f"Llama explanation generation error: {e!r}")
+            return self._fallback_explanation(inconsistencies)
+    
+    def _completion(self, prompt, temperature, max_tokens):
+        """Chat completion through the Groq SDK client, shared by identical prompts"""
+        def call():
+            response = self.client.chat.completions.create(
+                messages=[{"role": "user", "content": prompt}],
+                model=MODEL,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+            return response.choices[0].message.content, self._record_usage(response)
+        
+        return self.prompt_cache.complete(self._prompt_key(prompt, temperature, max_tokens), call)
+    
+    async def _chat_completion(self, prompt, temperature, max_tokens):
+        """Chat completion through the pooled async client, shared by identical prompts
+        
+        Answered from the prompt cache when the same prompt was completed
+        recently, or by joining an identical call still in flight.
+        """
+        return await self.prompt_cache.complete_async(
+            self._prompt_key(prompt, temperature, max_tokens),
+            lambda: self._request_completion(prompt, temperature, max_tokens)
+        )
+    
+    def _prompt_key(self, prompt, temperature, max_tokens):
+        return self.prompt_cache.key(MODEL, prompt, temperature=temperature, max_tokens=max_tokens)
+    
+    async def _request_completion(self, prompt, temperature, max_tokens):
+        """POST a chat completion, bounded by the timeout budget; returns its text and usage"""
+        client, semaphore = self._get_async_client()
+        
+        async def call():
+            async with semaphore:
+                response = await client.post("/openai/v1/chat/completions", json={
+                    "messages": [{"role": "user", "content": prompt}],
+                    "model": MODEL,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens
+                })
+                response.raise_for_status()
+                data = response.json()
+                record_llm_usage(data.get("usage"))
+                return data["choices"][0]["message"]["content"], data.get("usage")
+        
+        try:
+            completion = await asyncio.wait_for(call(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            LLM_CALLS.inc(outcome='timeout')
+            raise
+        except Exception:
+            LLM_CALLS.inc(outcome='error')
+            raise
+        LLM_CALLS.inc(outcome='ok')
+        return completion
+    
+    def _record_usage(self, response):
+        """Count the tokens of a Groq SDK completion; returns them as an API usage block"""
+        LLM_CALLS.inc(outcome='ok')
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return None
+        usage = {
+            'prompt_tokens': getattr(usage, 'prompt_tokens', None),
+            'completion_tokens': getattr(usage, 'completion_tokens', None)
+        }
+        record_llm_usage(usage)
+        return usage
+    
+    def _get_async_client(self):
+        if self._async_client is None:
+            import httpx
             
-            prompt = f"""You are analyzing text for signs of authorship obfuscation (deliberate attempts to disguise writing style).
+            self._async_client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._async_client, self._semaphore
+    
+    async def aclose(self):
+        """Close the pooled async client"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._semaphore = None
+    
+    def _explanation_prompt(self, inconsistencies, text_segments):
+        consistency = _bucketed(inconsistencies.get('consistency_score', 0.5), self.score_bucket)
+        num_segments = inconsistencies.get('segments_analyzed', 0)
+        if self.segment_bucket:
+            num_segments = max(self.segment_bucket, _bucketed(num_segments, self.segment_bucket))
+        sample_text = text_segments[0][:300] if text_segments else ""
+        
+        return f"""You are analyzing text for signs of authorship obfuscation (deliberate attempts to disguise writing style).
 
 Consistency Score: {consistency:.2f} (1.0 = consistent, 0.0 = highly inconsistent)
-Number of Segments: {inconsistencies.get('segments_analyzed', 0)}
+Number of Segments: {num_segments}
 
 Sample text: {sample_text}
 
@@ -101,19 +293,6 @@ Provide a 3-4 sentence analysis explaining:
 3. Key stylistic patterns observed
 
 Be specific and professional."""
-
-            response = self.client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="llama-3.1-8b-instant",
-                temperature=0.5,
-                max_tokens=300
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            print(f"Llama explanation generation error: {e}")
-            return self._fallback_explanation(inconsistencies)
     
     def _fallback_explanation(self, inconsistencies):
         """Fallback explanation generation"""
@@ -124,4 +303,10 @@ Be specific and professional."""
         elif consistency < 0.7:
             return """This text shows moderate stylistic variation across segments. While some inconsistencies are present, they may fall within the normal range for a single author. However, certain patterns merit closer examination."""
         else:
-            return """This text demonstrates relatively consistent stylistic patterns throughout. The lexical diversity and sentence complexity remain stable within expected ranges for authentic single-author writing. No significant indicators of manipulation were detected."""
\ No newline at end of file
+            return """This text demonstrates relatively consistent stylistic patterns throughout. The lexical diversity and sentence complexity remain stable within expected ranges for authentic single-author writing. No significant indicators of manipulation were detected."""
+
+def _bucketed(value, step):
+    """``value`` rounded to the nearest multiple of ``step``, or unchanged when step is 0"""
+    if not step:
+        return value
+    return round(value / step) * step
@@ -1,32 +1,157 @@
+import os
+import time
+
 import numpy as np
-from scipy import stats
+
+from models.features import FEATURE_COLUMNS, COLUMN_INDEX, features_to_matrix
+
+# features whose joint distribution the outlier stage models
+OUTLIER_COLUMNS = ('avg_word_length', 'type_token_ratio', 'avg_sentence_length', 'noun_ratio', 'verb_ratio')
+
+# cutoffs the component scores count crossings of; a calibration (models.calibration) replaces them
+DEFAULT_LIMITS = {
+    # coefficients of variation of avg_word_length and type_token_ratio across segments
+    'word_length_cv': 0.20,
+    'type_token_ratio_cv': 0.25,
+    # change of avg_sentence_length (in words) and of function_word_ratio between adjacent segments
+    'sentence_length_jump': 10.0,
+    'function_word_shift': 0.08,
+    # Mahalanobis distance beyond which a segment is an outlier
+    'outlier_distance': 3.0,
+    # mean leave-one-out z-score at which a segment's score reaches 1
+    'segment_z_scale': 3.0,
+}
+
+# component weights below change_point_min_segments segments ('short') and from there on ('long')
+DEFAULT_WEIGHTS = {
+    'short': {
+        'lexical_inconsistency': 0.25,
+        'syntactic_inconsistency': 0.30,
+        'stylistic_shift': 0.25,
+        'unnatural_variation': 0.20
+    },
+    'long': {
+        'lexical_inconsistency': 0.25,
+        'style_change_points': 0.55,
+        'unnatural_variation': 0.20
+    },
+}
+
+# segment score from which a segment is listed as suspicious
+SUSPICIOUS_SEGMENT_SCORE = 0.6
+
+# shuffled segment orders scored at a time for p-values, and shuffled Gram matrices for cosine drift
+PERMUTATION_BATCH = 64
+DRIFT_BATCH = 16
+
+# shuffle counts p-values are reported at past min_permutations: shuffles past the last count
+# reached within the budget are dropped, so a document gets one of a few reproducible p-values
+PERMUTATION_STEPS = (999, 4999)
 
 class ObfuscationScorer:
-    def __init__(self):
+    def __init__(self, calibration=None):
+        # calibration: path of a calibration to load, None for SCORER_CALIBRATION, False for the defaults
         self.thresholds = {
             'high_suspicion': 0.7,
             'medium_suspicion': 0.5,
             'low_suspicion': 0.3
         }
+        self.limits = dict(DEFAULT_LIMITS)
+        self.weights = {regime: dict(weights) for regime, weights in DEFAULT_WEIGHTS.items()}
+        # from this many segments on, change points replace the adjacent-jump heuristics
+        self.change_point_min_segments = 16
+        # share of the overall score given to n-gram drift when n-gram features are supplied
+        self.cosine_drift_weight = 0.20
+        # p-values of component scores: at least min_permutations shuffled segment orders, then more
+        # in PERMUTATION_STEPS until p_value_budget seconds have passed or max_permutations are scored;
+        # 0 turns them off
+        self.p_value_budget = float(os.environ.get("P_VALUE_BUDGET_SECONDS", "0.05"))
+        self.min_permutations = 99
+        self.max_permutations = int(os.environ.get("P_VALUE_MAX_PERMUTATIONS", "4999"))
+        # null distributions of the components segment order does not affect, from clean calibration texts
+        self.null_distributions = {}
+        # id, feature version and segment size of the calibration in use, None with the defaults
+        self.calibration = None
+        
+        path = os.environ.get("SCORER_CALIBRATION") if calibration is None else calibration
+        if path:
+            from models.calibration import load
+            
+            self.apply_calibration(load(path))
     
-    def calculate_obfuscation_score(self, segment_features):
+    def apply_calibration(self, config):
+        """Use the limits, weights, risk levels and null distributions fitted by models.calibration"""
+        self.limits.update(config['limits'])
+        self.weights = {regime: dict(weights) for regime, weights in config['weights'].items()}
+        self.cosine_drift_weight = config['cosine_drift_weight']
+        self.thresholds = dict(config['risk_levels'])
+        self.null_distributions = {name: np.asarray(values, dtype=np.float64)
+                                   for name, values in config['null_distributions'].items()}
+        self.calibration = {key: config[key] for key in ('id', 'feature_version', 'segment_size')}
+    
+    @property
+    def calibration_id(self):
+        """Identifies the scoring parameters, for caches"""
+        return None if self.calibration is None else self.calibration['id']
+    
+    def calculate_obfuscation_score(self, segment_features, window_step=1, ngram_matrix=None, p_values=True):
         """
         Calculate overall obfuscation likelihood
         Returns score 0-1 and detailed breakdown
         """
-        scores = {
-            'lexical_inconsistency': self._lexical_inconsistency(segment_features),
-            'syntactic_inconsistency': self._syntactic_inconsistency(segment_features),
-            'stylistic_shift': self._stylistic_shift(segment_features),
-            'unnatural_variation': self._unnatural_variation(segment_features)
-        }
+        results = self.score_matrix(features_to_matrix(segment_features), window_step, ngram_matrix, p_values)
         
-        weights = {
-            'lexical_inconsistency': 0.25,
-            'syntactic_inconsistency': 0.30,
-            'stylistic_shift': 0.25,
-            'unnatural_variation': 0.20
-        }
+        for entry in results['suspicious_segments']:
+            entry['features'] = segment_features[entry['segment_index']]
+        
+        return results
+    
+    def score_matrix(self, matrix, window_step=1, ngram_matrix=None, p_values=True):
+        """
+        Batch entry point over a segments x FEATURE_COLUMNS matrix
+        Same result as calculate_obfuscation_score, without the per-segment
+        feature dicts in suspicious_segments
+        
+        For overlapping windows, window_step is how many rows apart windows
+        stop overlapping. Change points are searched on those rows only,
+        since the test assumes independent segments.
+        
+        ngram_matrix, sparse n-gram counts of the rows matrix[::window_step]
+        as HashedNgramFeaturizer returns them, adds a cosine_drift component
+        that takes cosine_drift_weight of the overall score.
+        
+        component_p_values holds each component's p-value, see
+        component_p_values; with p_values False they are all None and
+        cost nothing.
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        outliers = self.detect_outliers(matrix)
+        change_points = self.detect_change_points(matrix[::window_step])
+        for point in change_points:
+            point['segment_index'] *= window_step
+        
+        if len(matrix[::window_step]) >= self.change_point_min_segments:
+            scores = {
+                'lexical_inconsistency': self._lexical_inconsistency(matrix),
+                'style_change_points': self._style_change_points(change_points),
+                'unnatural_variation': self._unnatural_variation(outliers)
+            }
+            weights = self.weights['long']
+        else:
+            scores = {
+                'lexical_inconsistency': self._lexical_inconsistency(matrix),
+                'syntactic_inconsistency': self._syntactic_inconsistency(matrix),
+                'stylistic_shift': self._stylistic_shift(matrix),
+                'unnatural_variation': self._unnatural_variation(outliers)
+            }
+            weights = self.weights['short']
+        
+        drift = None
+        if ngram_matrix is not None:
+            weights = {k: w * (1 - self.cosine_drift_weight) for k, w in weights.items()}
+            weights['cosine_drift'] = self.cosine_drift_weight
+            drift = self.cosine_drift(ngram_matrix)
+            scores['cosine_drift'] = self._cosine_drift_score(drift)
         
         overall_score = sum(scores[k] * weights[k] for k in scores)
         
@@ -34,82 +159,333 @@ class ObfuscationScorer:
             'overall_score': overall_score,
             'risk_level': self._get_risk_level(overall_score),
             'component_scores': scores,
-            'suspicious_segments': self._identify_suspicious_segments(segment_features, scores)
+            'component_p_values': (self.component_p_values(matrix, scores, outliers, drift, window_step)
+                                   if p_values else dict.fromkeys(scores)),
+            'suspicious_segments': self._identify_suspicious_segments(matrix),
+            'outlier_segments': outliers['outliers'],
+            'change_points': change_points
         }
     
-    def _lexical_inconsistency(self, segment_features):
+    def _lexical_inconsistency(self, matrix):
         """Detect unusual variation in lexical sophistication"""
-        word_lengths = [f['avg_word_length'] for f in segment_features]
-        ttr = [f['type_token_ratio'] for f in segment_features]
+        word_lengths = matrix[:, COLUMN_INDEX['avg_word_length']]
+        ttr = matrix[:, COLUMN_INDEX['type_token_ratio']]
         
         word_length_cv = np.std(word_lengths) / np.mean(word_lengths) #variation coefficient
         ttr_cv = np.std(ttr) / np.mean(ttr)
 
         score = 0
-        if word_length_cv > 0.20:
+        if word_length_cv > self.limits['word_length_cv']:
             score += 0.5
-        if ttr_cv > 0.25:
+        if ttr_cv > self.limits['type_token_ratio_cv']:
             score += 0.5
         
         return min(score, 1.0)
     
-    def _syntactic_inconsistency(self, segment_features):
+    def _syntactic_inconsistency(self, matrix):
         """Detect inconsistent sentence structure patterns"""
-        sentence_lengths = [f['avg_sentence_length'] for f in segment_features]
-        sentence_variances = [f['sentence_length_variance'] for f in segment_features]
-        
-        length_jumps = [abs(sentence_lengths[i] - sentence_lengths[i-1]) 
-                       for i in range(1, len(sentence_lengths))]
+        if len(matrix) < 2:
+            return 0.0
         
-        abnormal_jumps = sum(1 for jump in length_jumps if jump > 10) / len(length_jumps)
+        abnormal_jumps = _jump_share(matrix[:, COLUMN_INDEX['avg_sentence_length']], self.limits['sentence_length_jump'])
         
         return min(abnormal_jumps * 2, 1.0)
     
-    def _stylistic_shift(self, segment_features):
+    def _stylistic_shift(self, matrix):
         """Detect shifts in formality and style"""
-        function_word_ratios = [f['function_word_ratio'] for f in segment_features]
-        
-        shifts = [abs(function_word_ratios[i] - function_word_ratios[i-1])
-                 for i in range(1, len(function_word_ratios))]
+        if len(matrix) < 2:
+            return 0.0
         
-        significant_shifts = sum(1 for s in shifts if s > 0.08) / len(shifts)
+        significant_shifts = _jump_share(matrix[:, COLUMN_INDEX['function_word_ratio']],
+                                         self.limits['function_word_shift'])
         
         return min(significant_shifts * 1.5, 1.0)
     
-    def _unnatural_variation(self, segment_features):
+    def _unnatural_variation(self, outliers):
         """Detect statistically improbable variation patterns"""
-        #collect all feature vectors
-        all_features = []
-        for f in segment_features:
-            feature_vector = [
-                f['avg_word_length'],
-                f['type_token_ratio'],
-                f['avg_sentence_length'],
-                f['noun_ratio'],
-                f['verb_ratio']
-            ]
-            all_features.append(feature_vector)
-        
-        all_features = np.array(all_features)
-        
-        # calculate Mahalanobis distance for each segment
-        # outliers suggest manipulation
-        mean = np.mean(all_features, axis=0)
-        cov = np.cov(all_features.T)
-        
-        try:
-            inv_cov = np.linalg.inv(cov)
-            distances = [self._mahalanobis(x, mean, inv_cov) for x in all_features]
-            
-            outliers = sum(1 for d in distances if d > 3.0) / len(distances)
-            return min(outliers * 2, 1.0)
-        except:
+        distances = outliers['distances']
+        if len(distances) == 0:
+            return 0.0
+        
+        outlier_ratio = len(outliers['outliers']) / len(distances)
+        return min(outlier_ratio * 2, 1.0)
+    
+    def _style_change_points(self, change_points):
+        """Confidence that the style changes somewhere in the document"""
+        return max((point['confidence'] for point in change_points), default=0.0)
+    
+    def _cosine_drift_score(self, drift, significance=0.05):
+        """Confidence that a run of segments uses n-grams unlike the rest"""
+        if drift is None or drift['p_value'] > significance:
             return 0.0
+        return 1 - drift['p_value']
+    
+    def component_p_values(self, matrix, scores, outliers, drift=None, window_step=1):
+        """
+        p-value of each component score, None where there is nothing to compare it with
+        Components that depend on segment order are tested against the same
+        statistic over shuffled segment orders: the share of adjacent jumps
+        past the limit for syntactic_inconsistency and stylistic_shift, and
+        for style_change_points how much more alike adjacent segments are
+        than segments in general (a von Neumann ratio of the normal scores),
+        which any arrangement into regimes raises, an insert included.
+        Shuffles are scored a batch at a time in one array operation, at
+        least min_permutations of them, then up to each of PERMUTATION_STEPS
+        completed within p_value_budget. Which step is reached depends on
+        the load, so p-values can differ between runs of the same document.
+        Overlapping windows are tested on the rows matrix[::window_step]
+        only, which do not overlap. cosine_drift has its own permutation test.
+        
+        lexical_inconsistency and unnatural_variation do not depend on
+        segment order; they are compared with clean texts when a
+        calibration provides their null distributions.
+        """
+        if self.max_permutations <= 0:
+            return dict.fromkeys(scores)
+        
+        rows = matrix[::window_step]
+        tests = {}
+        for name, column in (('syntactic_inconsistency', 'avg_sentence_length'),
+                             ('stylistic_shift', 'function_word_ratio')):
+            if name in scores and len(rows) >= 2:
+                limit = self.limits['sentence_length_jump' if column == 'avg_sentence_length' else 'function_word_shift']
+                values = rows[:, COLUMN_INDEX[column]]
+                tests[name] = (_jump_share(values, limit), lambda orders, values=values, limit=limit:
+                               _jump_share(values[orders], limit))
+        if 'style_change_points' in scores:
+            # normal scores do not depend on the order, unlike their whitening
+            z = self._normal_scores(rows)
+            if z is not None:
+                tests['style_change_points'] = (_serial_statistic(z), lambda orders: _serial_statistic(z[orders]))
+        
+        p_values = dict.fromkeys(scores, 1.0)
+        p_values.update(self._permutation_p_values(tests, len(rows)))
+        
+        if 'lexical_inconsistency' in self.null_distributions:
+            p_values['lexical_inconsistency'] = _upper_tail(self.null_distributions['lexical_inconsistency'],
+                                                            self.lexical_statistic(matrix))
+        else:
+            p_values['lexical_inconsistency'] = None
+        if 'unnatural_variation' in self.null_distributions:
+            p_values['unnatural_variation'] = _upper_tail(self.null_distributions['unnatural_variation'],
+                                                          len(outliers['outliers']) / max(len(matrix), 1))
+        else:
+            p_values['unnatural_variation'] = None
+        if 'cosine_drift' in scores:
+            p_values['cosine_drift'] = None if drift is None else drift['p_value']
+        return p_values
     
-    def _mahalanobis(self, x, mean, inv_cov):
-        """Calculate Mahalanobis distance"""
-        diff = x - mean
-        return np.sqrt(diff @ inv_cov @ diff.T)
+    def _permutation_p_values(self, tests, n):
+        """(1 + shuffles scoring at least as high) / (1 + shuffles) of each (observed, statistic of orders) test
+
+        The shuffles counted are the most of min_permutations,
+        PERMUTATION_STEPS and max_permutations completed within the budget.
+        """
+        if not tests:
+            return {}
+        first = min(self.min_permutations, self.max_permutations)
+        steps = sorted({first, self.max_permutations} | {step for step in PERMUTATION_STEPS
+                                                           if first < step < self.max_permutations})
+        # fixed seed: with the same number of shuffles a document always gets the same p-values
+        rng = np.random.default_rng(0)
+        exceed = dict.fromkeys(tests, 0)
+        p_values = None
+        done = 0
+        deadline = time.perf_counter() + self.p_value_budget
+        for step in steps:
+            while done < step:
+                if p_values is not None and time.perf_counter() >= deadline:
+                    return p_values
+                batch = min(PERMUTATION_BATCH, step - done)
+                orders = rng.permuted(np.tile(np.arange(n), (batch, 1)), axis=1)
+                for name, (observed, statistic) in tests.items():
+                    exceed[name] += np.count_nonzero(statistic(orders) >= observed)
+                done += batch
+            p_values = {name: (1 + count) / (1 + done) for name, count in exceed.items()}
+        return p_values
+    
+    def lexical_statistic(self, matrix):
+        """How far past its limit the more variable of word length and type-token ratio is, as a multiple"""
+        return float(lexical_statistics(matrix[None], self.limits)[0])
+    
+    def cosine_drift(self, ngram_matrix, min_size=2, permutations=99, max_rows=128):
+        """
+        Run of consecutive segments whose n-gram usage differs most from the rest
+        Rows become sublinear term frequencies of unit length, so inner
+        products are cosine similarities. Every run [start, end) is scored by
+        the unbiased squared distance between its mean vector and that of the
+        other segments (a linear-kernel MMD), weighted by m(n-m)/n so runs of
+        any length m compare; all runs are scored at once from prefix sums of
+        the Gram matrix. The best score is compared with the best scores of
+        shuffled segment orders, so the document's own n-gram overlap is the
+        baseline; the p-value is the share of shuffles scoring as high.
+        
+        Longer documents are pooled into max_rows runs of consecutive
+        segments. Returns None with fewer than 2 * min_size segments.
+        """
+        from scipy import sparse
+        
+        counts = sparse.csr_matrix(ngram_matrix, dtype=np.float64)
+        n_segments = counts.shape[0]
+        if n_segments < 2 * min_size:
+            return None
+        
+        group_size = -(-n_segments // max_rows)
+        if group_size > 1:
+            groups = np.arange(n_segments) // group_size
+            pooling = sparse.csr_matrix((np.ones(n_segments), (groups, np.arange(n_segments))))
+            counts = (pooling @ counts).tocsr()
+        
+        counts.data = np.log1p(counts.data)
+        norms = np.sqrt(np.asarray(counts.multiply(counts).sum(axis=1)).ravel())
+        unit = sparse.diags(1 / np.where(norms > 0, norms, 1)) @ counts
+        gram = (unit @ unit.T).toarray()
+        
+        n = len(gram)
+        runs = _DriftRuns(n, min_size)
+        statistics, (starts, ends) = runs.best(gram[None])
+        statistic, start, end = statistics[0], starts[0], ends[0]
+        # fixed seed: the same document always gets the same p-value
+        rng = np.random.default_rng(0)
+        orders = np.array([rng.permutation(n) for _ in range(permutations)]).reshape(permutations, n)
+        exceed = 0
+        for first in range(0, permutations, DRIFT_BATCH):
+            batch = orders[first:first + DRIFT_BATCH]
+            shuffled = gram[batch[:, :, None], batch[:, None, :]]
+            exceed += np.count_nonzero(runs.best(shuffled)[0] >= statistic)
+        
+        return {
+            'start': int(start * group_size),
+            'end': int(min(end * group_size, n_segments)),
+            'statistic': float(statistic),
+            'p_value': (1 + exceed) / (1 + permutations)
+        }
+    
+    def detect_change_points(self, matrix, significance=0.01, min_size=2):
+        """
+        Boundaries where the segment feature sequence shifts to a new regime
+        Each column is mapped to normal scores by rank, which tames heavy
+        tails, and whitened with the Ledoit-Wolf precision of the noise, so
+        the statistic of a fixed split is chi-squared with one degree of
+        freedom per feature. The noise is estimated from differences of
+        adjacent segments: a shift between regimes shows in a single
+        difference but in every segment's distance from the document mean,
+        where it would pass for noise.
+        
+        Boundaries are placed by PELT, the exact minimum of the squared
+        error within regimes plus a penalty per boundary, so an inserted
+        passage is found with both its edges even where no single split of
+        the document stands out. The penalty is the chi-squared quantile of
+        significance / n. Then, while some boundary is not significant
+        against the regimes on either side of it, the least significant one
+        is dropped.
+        
+        Each boundary is the index of the first segment of a new regime. Its
+        confidence is one minus the p-value of splitting the regime pair
+        around it at that boundary, Bonferroni-corrected for every position
+        the split could take.
+        """
+        n = len(matrix)
+        w = self._whitened(matrix) if n >= 2 * min_size else None
+        if w is None:
+            return []
+        
+        from scipy import stats
+        
+        d = w.shape[1]
+        sums = np.vstack([np.zeros(d), np.cumsum(w, axis=0)])
+        boundaries = _pelt(sums, min_size, stats.chi2.isf(significance / n, d))
+        
+        def p_value(edges, k):
+            # split of the regime pair edges[k]:edges[k + 2] at edges[k + 1], corrected for its positions
+            start, split, end = edges[k], edges[k + 1], edges[k + 2]
+            diff = (sums[split] - sums[start]) / (split - start) - (sums[end] - sums[split]) / (end - split)
+            statistic = (split - start) * (end - split) / (end - start) * (diff ** 2).sum()
+            return min(1.0, (end - start - 2 * min_size + 1) * stats.chi2.sf(statistic, d))
+        
+        while True:
+            edges = [0] + boundaries + [n]
+            p_values = [p_value(edges, k) for k in range(len(boundaries))]
+            if not p_values or max(p_values) < significance:
+                break
+            del boundaries[int(np.argmax(p_values))]
+        
+        return [{'segment_index': boundary, 'confidence': float(1 - p)} for boundary, p in zip(boundaries, p_values)]
+    
+    def _normal_scores(self, matrix):
+        """Normal scores of the varying columns by rank, centered; None when no column varies"""
+        n = len(matrix)
+        std = matrix.std(axis=0)
+        varying = std > 1e-12 * np.maximum(np.abs(matrix.mean(axis=0)), 1)
+        if n < 2 or not varying.any():
+            return None
+        
+        # scipy takes a second to import; only pay for it when scoring
+        from scipy import stats
+        
+        z = stats.norm.ppf((stats.rankdata(matrix[:, varying], axis=0) - 0.5) / n)
+        return z - z.mean(axis=0)
+    
+    def _whitened(self, matrix):
+        """
+        _normal_scores whitened with the Ledoit-Wolf precision of
+        differences of adjacent rows; None when no column varies
+        """
+        z = self._normal_scores(matrix)
+        if z is None:
+            return None
+        
+        from sklearn.covariance import LedoitWolf
+        
+        # the difference of two segments of one regime has twice the noise variance
+        differences = np.diff(z, axis=0) / np.sqrt(2)
+        precision = LedoitWolf(assume_centered=True).fit(differences).precision_
+        return z @ np.linalg.cholesky(precision)
+    
+    def detect_outliers(self, matrix, threshold=None):
+        """
+        Mahalanobis distance of every segment from the document's joint
+        distribution of OUTLIER_COLUMNS; segments beyond threshold
+        (limits['outlier_distance'] by default) are outliers
+        
+        Constant columns carry no information and make the covariance
+        singular, so they are dropped. The rest are standardized and the
+        covariance is estimated with Ledoit-Wolf shrinkage, which stays
+        invertible even with few segments. Each outlier lists the features
+        driving it with their share of the squared distance.
+        """
+        if threshold is None:
+            threshold = self.limits['outlier_distance']
+        n = len(matrix)
+        x = matrix[:, [COLUMN_INDEX[name] for name in OUTLIER_COLUMNS]]
+        std = x.std(axis=0)
+        varying = std > 1e-12 * np.maximum(np.abs(x.mean(axis=0)), 1)
+        
+        if n < 3 or not varying.any():
+            return {'distances': np.zeros(n), 'outliers': []}
+        
+        from sklearn.covariance import LedoitWolf
+        
+        names = [name for name, keep in zip(OUTLIER_COLUMNS, varying) if keep]
+        z = (x[:, varying] - x[:, varying].mean(axis=0)) / std[varying]
+        precision = LedoitWolf(assume_centered=True).fit(z).precision_
+        
+        # per-feature terms of the quadratic form, summing to the squared distance
+        contributions = z * (z @ precision)
+        distances = np.sqrt(np.clip(contributions.sum(axis=1), 0, None))
+        
+        outliers = []
+        for i in np.flatnonzero(distances > threshold):
+            shares = contributions[i] / distances[i] ** 2
+            order = np.argsort(shares)[::-1]
+            outliers.append({
+                'segment_index': int(i),
+                'distance': float(distances[i]),
+                'drivers': [{'feature': names[j], 'share': float(shares[j])}
+                            for j in order if shares[j] > 0]
+            })
+        
+        return {'distances': distances, 'outliers': outliers}
     
     def _get_risk_level(self, score):
         """Convert score to risk level"""
@@ -122,36 +498,155 @@ class ObfuscationScorer:
         else:
             return 'MINIMAL'
     
-    def _identify_suspicious_segments(self, segment_features, scores):
+    def _identify_suspicious_segments(self, matrix):
         """Identify which specific segments are most suspicious"""
-        suspicious = []
+        segment_scores = self.segment_scores(matrix)
         
-        for i, features in enumerate(segment_features):
-            segment_score = self._calculate_segment_score(features, segment_features)
-            if segment_score > 0.6:
-                suspicious.append({
-                    'segment_index': i,
-                    'score': segment_score,
-                    'features': features
-                })
+        suspicious = [
+            {'segment_index': int(i), 'score': float(segment_scores[i])}
+            for i in np.flatnonzero(segment_scores > SUSPICIOUS_SEGMENT_SCORE)
+        ]
         
         return sorted(suspicious, key=lambda x: x['score'], reverse=True)
     
-    def _calculate_segment_score(self, segment, all_segments):
-        """Score individual segment against the corpus"""
-        others = [s for s in all_segments if s != segment]
+    def segment_scores(self, matrix):
+        """
+        Score every segment against all the others
+        segment_deviations divided by limits['segment_z_scale'] (3 by
+        default) and capped at 1
+        """
+        deviation = self.segment_deviations(matrix)
+        if deviation is None:
+            return np.zeros(len(matrix))
+        return np.where(np.isnan(deviation), 0.0, np.minimum(deviation / self.limits['segment_z_scale'], 1.0))
+    
+    def segment_deviations(self, matrix):
+        """
+        Mean absolute z-score of avg_word_length, avg_sentence_length and
+        type_token_ratio of every segment under leave-one-out mean and std;
+        NaN for a segment none of whose columns vary among the others, None
+        with fewer than two segments
+        """
+        n = len(matrix)
+        if n < 2:
+            return None
         
-        if not others:
-            return 0.0
+        columns = [COLUMN_INDEX[name] for name in ('avg_word_length', 'avg_sentence_length', 'type_token_ratio')]
+        x = matrix[:, columns]
         
-        deviations = []
-        for key in ['avg_word_length', 'avg_sentence_length', 'type_token_ratio']:
-            segment_val = segment[key]
-            others_mean = np.mean([s[key] for s in others])
-            others_std = np.std([s[key] for s in others])
-            
-            if others_std > 0:
-                z_score = abs((segment_val - others_mean) / others_std)
-                deviations.append(z_score)
+        # closed-form leave-one-out statistics from the full-sample sums
+        mean = x.mean(axis=0)
+        centered = x - mean
+        sum_sq = (centered ** 2).sum(axis=0)
+        others_mean = mean - centered / (n - 1)
+        others_var = (sum_sq - centered ** 2 * n / (n - 1)) / (n - 1)
+        others_std = np.sqrt(np.clip(others_var, 0, None))
+        
+        # columns that do not vary among the others are left out of the mean
+        valid = others_std > 1e-12 * np.maximum(np.abs(others_mean), 1)
+        z_scores = np.abs(x - others_mean) / np.where(valid, others_std, 1)
+        counts = valid.sum(axis=1)
+        deviation = np.where(valid, z_scores, 0).sum(axis=1) / np.maximum(counts, 1)
+        
+        return np.where(counts > 0, deviation, np.nan)
+
+def _jump_share(values, limit):
+    """Share of steps between adjacent values larger than limit, along the last axis"""
+    return np.count_nonzero(np.abs(np.diff(values, axis=-1)) > limit, axis=-1) / (values.shape[-1] - 1)
+
+def lexical_statistics(matrices, limits):
+    """ObfuscationScorer.lexical_statistic under the given limits of each segments x features matrix of a stack"""
+    word_lengths = matrices[..., COLUMN_INDEX['avg_word_length']]
+    ttr = matrices[..., COLUMN_INDEX['type_token_ratio']]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        word_length_cv = word_lengths.std(axis=-1) / word_lengths.mean(axis=-1)
+        ttr_cv = ttr.std(axis=-1) / ttr.mean(axis=-1)
+    return np.nan_to_num(np.maximum(word_length_cv / limits['word_length_cv'], ttr_cv / limits['type_token_ratio_cv']))
+
+def _pelt(sums, min_size, penalty):
+    """Boundaries minimizing the squared error of whitened rows about their regime means plus penalty per boundary
+
+    ``sums`` are the cumulative row sums with a leading row of zeros. The
+    error of a regime is its rows' squared norms, which add up to the same
+    total whatever the boundaries, less the squared norm of its sum over
+    its length; only that second term is minimized. Regimes have at least
+    min_size rows. Starts that can no longer end an optimal regime are
+    pruned, so the search takes about linear time.
+    """
+    n = len(sums) - 1
+    cost = np.full(n + 1, np.inf)
+    cost[0] = -penalty
+    previous = np.zeros(n + 1, dtype=np.int64)
+    starts = np.array([0])
+    for end in range(min_size, n + 1):
+        if end - min_size >= min_size:
+            starts = np.append(starts, end - min_size)
+        gain = ((sums[end] - sums[starts]) ** 2).sum(axis=1) / (end - starts)
+        candidates = cost[starts] - gain
+        best = int(np.argmin(candidates))
+        cost[end] = candidates[best] + penalty
+        previous[end] = starts[best]
+        starts = starts[candidates <= cost[end]]
+    
+    boundaries = []
+    end = previous[n]
+    while end > 0:
+        boundaries.append(int(end))
+        end = previous[end]
+    return boundaries[::-1]
+
+def _serial_statistic(w):
+    """Squared norm of centered rows over half the squared norm of their successive differences,
+    along the second to last axis; larger when neighbouring rows resemble each other, as within regimes"""
+    differences = np.diff(w, axis=-2)
+    return (w ** 2).sum(axis=(-2, -1)) / np.maximum((differences ** 2).sum(axis=(-2, -1)) / 2, 1e-300)
+
+def _upper_tail(null, value):
+    """Share of a null distribution at least as high as value, counting value itself"""
+    return float((1 + np.count_nonzero(null >= value)) / (1 + len(null)))
+
+class _DriftRuns:
+    """
+    Runs [start, end) of n rows that cosine_drift compares with the rest,
+    and the coefficients of their statistic
+    Written out, the weighted MMD of a run is a linear combination of the
+    Gram sum of the run with itself, its sum with all rows and the trace of
+    the run, with coefficients that only depend on the run length. Only
+    the first needs a 2D prefix sum of the Gram matrix; the others are
+    differences of 1D prefix sums.
+    """
+    
+    def __init__(self, n, min_size):
+        self.n = n
+        self.starts, self.ends = np.nonzero(np.arange(n + 1)[None, :] - np.arange(n + 1)[:, None] >= min_size)
+        keep = n - (self.ends - self.starts) >= min_size
+        self.starts, self.ends = self.starts[keep], self.ends[keep]
+        m = (self.ends - self.starts).astype(np.float64)
+        within_run = 1 / (m * (m - 1))
+        within_rest = 1 / ((n - m) * (n - m - 1))
+        between = 2 / (m * (n - m))
+        weight = m * (n - m) / n
+        self.inside = weight * (within_run + within_rest + between)
+        self.trace = weight * (within_rest - within_run)
+        self.with_all = weight * (2 * within_rest + between)
+        self.rest = weight * within_rest
+    
+    def best(self, grams):
+        """Highest statistic of any run in each Gram matrix of a stack, and the runs"""
+        n = self.n
+        sums = np.zeros((len(grams), n + 1, n + 1))
+        np.cumsum(grams, axis=1, out=sums[:, 1:, 1:])
+        np.cumsum(sums[:, 1:, 1:], axis=2, out=sums[:, 1:, 1:])
+        corner = np.diagonal(sums, axis1=1, axis2=2)
+        rows = sums[:, :, n]
+        diagonal = np.zeros((len(grams), n + 1))
+        np.cumsum(np.diagonal(grams, axis1=1, axis2=2), axis=1, out=diagonal[:, 1:])
         
-        return min(np.mean(deviations) / 3, 1.0)  
\ No newline at end of file
+        starts, ends = self.starts, self.ends
+        inside = corner[:, starts] + corner[:, ends] - 2 * sums[:, starts, ends]
+        statistic = (self.inside * inside
+                     + self.trace * (diagonal[:, ends] - diagonal[:, starts])
+                     - self.with_all * (rows[:, ends] - rows[:, starts])
+                     + self.rest * (sums[:, n, n] - diagonal[:, n])[:, None])
+        best = np.argmax(statistic, axis=1)
+        return statistic[np.arange(len(grams)), best], (starts[best], ends[best])
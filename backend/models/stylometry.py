@@ -1,129 +1,244 @@
-import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize, RegexpTokenizer
-from nltk.corpus import stopwords
 from collections import Counter
 import numpy as np
 import re
 
+from models.features import FEATURE_COLUMNS, SCHEMA_VERSION, SegmentFeatures
+from utils.feature_index import range_counts
+from utils.lexicon import lexical_counts, word_properties
+from utils.nlp_resources import load_stopwords, load_tagger, pos_tagging_enabled
+from utils.pos_tagging import POSTagger
+from utils.tokenization import TokenizedDocument, SegmentView
+
+# segments with fewer tokens are too short to analyze
+MIN_SEGMENT_TOKENS = 50
+
 class StylometricAnalyzer:
-    def __init__(self):
-        # Download NLTK data if not already present
-        try:
-            nltk.data.find('tokenizers/punkt')
-        except LookupError:
-            nltk.download('punkt', quiet=True)
-        
-        try:
-            nltk.data.find('corpora/stopwords')
-        except LookupError:
-            nltk.download('stopwords', quiet=True)
+    def __init__(self, pos_tagging=None):
+        # NLTK resources are loaded on first use, never downloaded; see utils.nlp_resources
+        self._stop_words = None
+        # POS ratios from the tagger; None uses it when POS_TAGGING allows and the model is installed
+        self._pos_tagging = None if pos_tagging is None and pos_tagging_enabled() else bool(pos_tagging)
+        self.pos_tagger = POSTagger()
+    
+    @property
+    def stop_words(self):
+        if self._stop_words is None:
+            self._stop_words = load_stopwords('english')
+        return self._stop_words
         
-        self.stop_words = set(stopwords.words('english'))
+    @property
+    def pos_tagging(self):
+        """Whether POS ratios come from the tagger rather than approximations"""
+        if self._pos_tagging is None:
+            try:
+                load_tagger()
+                self._pos_tagging = True
+            except LookupError as e:
+                print(f"POS tagger unavailable, using approximate POS features: {e}")
+                self._pos_tagging = False
+        return self._pos_tagging
+    
+    @property
+    def feature_version(self):
+        """Identifies what the features mean, for caches and stored profiles"""
+        return f"{SCHEMA_VERSION}+pos" if self.pos_tagging else str(SCHEMA_VERSION)
+    
+    def tag(self, document, base=None, edit=None):
+        """Tag a tokenized document's sentences ahead of extracting features, if POS tagging is on
         
+        For a document revised from ``base`` by a TokenEdit, only the
+        sentences the edit touched are tagged.
+        """
+        if self.pos_tagging:
+            if base is None:
+                self.pos_tagger.document_counts(document)
+            else:
+                self.pos_tagger.revised_counts(document, base, edit)
+    
+    def tokenize(self, text):
+        """Run sentence and word tokenization over the whole text once"""
+        return TokenizedDocument(text)
+    
     def extract_features(self, text):
-        """Extract traditional stylometric features using NLTK only"""
-        sentences = sent_tokenize(text)
-        words = word_tokenize(text)
-        words_alpha = [w for w in words if w.isalpha()]
-        words_lower = [w.lower() for w in words_alpha]
+        """Extract traditional stylometric features using NLTK only
         
-        if not words_alpha or not sentences:
-            return self._empty_features()
+        Accepts either a raw string or a SegmentView produced by segment_text;
+        views are featurized from their tokens without tokenizing again.
+        """
+        segment = text if isinstance(text, SegmentView) else self.tokenize(text).view()
+        counts = lexical_counts(segment.words())
+        return self._features_from_counts(counts, segment.sentence_lengths(), self._pos_counts(segment))
+    
+    def extract_window_features(self, segments):
+        """Yield the features of each segment, sliding counts along the document
+        
+        Segments must be joined views of one document in order, as
+        segment_text returns them. Only the words that leave and enter the
+        window are counted at each step, so a step costs in proportion to the
+        stride rather than the window size. Features equal
+        extract_features(segment).
+        """
+        counts = _LexicalCounts()
+        words = {}
+        start = end = 0
         
-        # Basic lexical features
-        word_lengths = [len(w) for w in words_alpha]
-        unique_words = set(words_lower)
+        for segment in segments:
+            document = segment.document
+            if segment.start >= segment.end:
+                yield self._empty_features()
+                continue
+            
+            # every token before the final word is counted as a sentence-internal word;
+            # the closing brackets and quotes after it are never words
+            new_start, new_end = segment.start, document.final_word(segment.start, segment.end)
+            if new_start < start or new_end < end or new_start >= end:
+                counts = _LexicalCounts()
+                words.clear()
+                start = end = new_start
+            for i in range(start, new_start):
+                counts.update(words.pop(i), -1)
+            for i in range(end, new_end):
+                words[i] = word_properties(document.joined_word(i))
+                counts.update(words[i], 1)
+            start, end = new_start, new_end
+            
+            last = word_properties(document.joined_word(new_end, last=True))
+            counts.update(last, 1)
+            yield self._features_from_counts(counts, segment.sentence_lengths(), self._pos_counts(segment))
+            counts.update(last, -1)
+    
+    def extract_range_features(self, document, bounds):
+        """Features of the segments tokens[start:end] of a tokenized document, for each (start, end)
+    
+        Lexical counts come from the document's FeatureIndex, built once
+        and kept with it, so a segment costs in proportion to its sentences
+        rather than its tokens, and the same document can be featurized at
+        any other segment size or stride almost for free. Features equal
+        extract_features(document.segment(start, end)).
+        """
+        features = []
+        for (start, end), counts in zip(bounds, range_counts(document, bounds)):
+            segment = document.segment(start, end)
+            features.append(self._features_from_counts(counts, segment.sentence_lengths(), self._pos_counts(segment)))
+        return features
+    
+    def _pos_counts(self, segment):
+        if not self.pos_tagging:
+            return None
+        return self.pos_tagger.segment_counts(segment)
+    
+    def _features_from_counts(self, counts, sentence_lengths, pos_counts=None):
+        """Features of a segment from its lexical counts, sentence lengths and tagged POS counts"""
+        if not counts.words or not sentence_lengths:
+            return self._empty_features()
         
-        # POS approximation using simple rules (without spaCy)
-        nouns = sum(1 for w in words_lower if w.endswith(('tion', 'ness', 'ment', 'ship', 'ity')))
+        num_sentences = len(sentence_lengths)
+        num_words = counts.words
+        if pos_counts is None:
+            # POS approximation using simple rules
+            noun_ratio = counts.nouns / num_words
+            verb_ratio, adj_ratio, adv_ratio = 0.15, 0.10, 0.05  # Placeholders
+        else:
+            noun_ratio, verb_ratio, adj_ratio, adv_ratio = (int(c) / num_words for c in pos_counts)
         
         features = {
             # Lexical features
-            'avg_word_length': np.mean(word_lengths),
-            'type_token_ratio': len(unique_words) / len(words_lower),
-            'hapax_legomena_ratio': sum(1 for count in Counter(words_lower).values() if count == 1) / len(words_lower),
+            'avg_word_length': counts.length / num_words,
+            'type_token_ratio': counts.num_types / num_words,
+            'hapax_legomena_ratio': counts.hapax / num_words,
             
             # Syntactic features
-            'avg_sentence_length': len(words_alpha) / len(sentences),
-            'sentence_length_variance': np.var([len(word_tokenize(s)) for s in sentences]),
+            'avg_sentence_length': num_words / num_sentences,
+            'sentence_length_variance': np.var(sentence_lengths),
             'avg_parse_tree_depth': 3.5,  # Placeholder - not needed for obfuscation detection
             
-            # POS patterns (approximated)
-            'noun_ratio': nouns / len(words_lower),
-            'verb_ratio': 0.15,  # Placeholder
-            'adj_ratio': 0.10,   # Placeholder
-            'adv_ratio': 0.05,   # Placeholder
+            # POS patterns
+            'noun_ratio': noun_ratio,
+            'verb_ratio': verb_ratio,
+            'adj_ratio': adj_ratio,
+            'adv_ratio': adv_ratio,
             
             # Function words
-            'function_word_ratio': sum(1 for w in words_lower if w in self.stop_words) / len(words_lower),
+            'function_word_ratio': counts.stopwords / num_words,
             
             # Punctuation
-            'comma_per_sentence': text.count(',') / len(sentences),
-            'semicolon_per_sentence': text.count(';') / len(sentences),
+            'comma_per_sentence': counts.commas / num_sentences,
+            'semicolon_per_sentence': counts.semicolons / num_sentences,
             
             # Complexity
-            'flesch_reading_ease': self._flesch_score(text, sentences, words_alpha),
+            'flesch_reading_ease': self._flesch_score(num_sentences, num_words, counts.syllables),
         }
         
-        return features
+        return SegmentFeatures.from_dict(features)
     
     def _empty_features(self):
-        """Return empty feature dict"""
-        return {
-            'avg_word_length': 0,
-            'type_token_ratio': 0,
-            'hapax_legomena_ratio': 0,
-            'avg_sentence_length': 0,
-            'sentence_length_variance': 0,
-            'avg_parse_tree_depth': 0,
-            'noun_ratio': 0,
-            'verb_ratio': 0,
-            'adj_ratio': 0,
-            'adv_ratio': 0,
-            'function_word_ratio': 0,
-            'comma_per_sentence': 0,
-            'semicolon_per_sentence': 0,
-            'flesch_reading_ease': 0,
-        }
+        """Return empty features"""
+        return SegmentFeatures([0.0] * len(FEATURE_COLUMNS))
     
-    def segment_text(self, text, segment_size=200):
-        """Split text into segments for analysis"""
-        words = word_tokenize(text)
-        segments = []
+    def segment_text(self, text, segment_size=200, stride=None):
+        """Split text into segments for analysis
         
-        for i in range(0, len(words), segment_size):
-            segment = ' '.join(words[i:i+segment_size])
-            if len(segment.split()) >= 50:  # Minimum viable segment
-                segments.append(segment)
+        Takes a raw string or an already tokenized document and returns
+        SegmentViews over it; use ``segment.text`` for the joined string.
+        With a stride, windows of ``segment_size`` tokens overlap and start
+        every ``stride`` tokens.
+        """
+        document = text if isinstance(text, TokenizedDocument) else self.tokenize(text)
         
-        return segments
+        # Minimum viable segment
+        return [seg for seg in document.windows(segment_size, stride) if len(seg) >= MIN_SEGMENT_TOKENS]
     
-    def _flesch_score(self, text, sentences, words):
+    def _flesch_score(self, num_sentences, num_words, syllables):
         """Calculate Flesch Reading Ease score"""
-        syllables = sum(self._count_syllables(word) for word in words)
-        
-        if len(sentences) == 0 or len(words) == 0:
+        if num_sentences == 0 or num_words == 0:
             return 0
         
-        score = 206.835 - 1.015 * (len(words) / len(sentences)) - 84.6 * (syllables / len(words))
+        score = 206.835 - 1.015 * (num_words / num_sentences) - 84.6 * (syllables / num_words)
         return score
+
+
+class _LexicalCounts:
+    """Running word counts of a segment, updated one word at a time"""
     
-    def _count_syllables(self, word):
-        """Simple syllable counter"""
-        word = word.lower()
-        count = 0
-        vowels = "aeiouy"
-        previous_was_vowel = False
-        
-        for char in word:
-            is_vowel = char in vowels
-            if is_vowel and not previous_was_vowel:
-                count += 1
-            previous_was_vowel = is_vowel
+    __slots__ = ('words', 'length', 'syllables', 'stopwords', 'nouns',
+                 'commas', 'semicolons', 'types', 'hapax')
+    
+    def __init__(self):
+        self.words = 0
+        self.length = 0
+        self.syllables = 0
+        self.stopwords = 0
+        self.nouns = 0
+        self.commas = 0
+        self.semicolons = 0
+        self.types = Counter()
+        self.hapax = 0
+    
+    @property
+    def num_types(self):
+        return len(self.types)
+    
+    def update(self, word, sign):
+        """Add (sign 1) or remove (sign -1) a word's WordProperties"""
+        lower = word.lower
+        if lower is None:
+            self.commas += sign * word.commas
+            self.semicolons += sign * word.semicolons
+            return
         
-        if word.endswith("e"):
-            count -= 1
-        if count == 0:
-            count = 1
+        self.words += sign
+        self.length += sign * word.length
+        self.syllables += sign * word.syllables
+        self.stopwords += sign * word.stopword
+        self.nouns += sign * word.noun
         
-        return count
\ No newline at end of file
+        count = self.types[lower]
+        if sign > 0:
+            self.hapax += 1 if count == 0 else -1 if count == 1 else 0
+            self.types[lower] = count + 1
+        else:
+            self.hapax += -1 if count == 1 else 1 if count == 2 else 0
+            if count == 1:
+                del self.types[lower]
+            else:
+                self.types[lower] = count - 1
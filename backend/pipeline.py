@@ -0,0 +1,297 @@
+"""Statistical analysis steps shared by /analyze and batch analysis"""
+import importlib
+import json
+
+import numpy as np
+
+from models.features import SegmentFeatures, columnar, features_to_matrix
+from models.stylometry import MIN_SEGMENT_TOKENS
+from utils.feature_extractors import HashedNgramFeaturizer
+from utils.metrics import timed
+from utils.text_preprocessing import TextPreprocessor
+
+MIN_WORDS = 100
+MIN_SEGMENTS = 2
+
+# segment sizes /analyze/ladder scores a document at by default
+LADDER_SIZES = (100, 200, 400, 800)
+
+# segments featurized from the FeatureIndex at a time, between progress reports
+FEATURE_CHUNK = 256
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+# media types results can be encoded in, by the names clients ask for them
+ENCODINGS = {JSON: JSON, MSGPACK: MSGPACK, 'application/x-msgpack': MSGPACK, ARROW: ARROW}
+# optional packages the binary encodings need
+ENCODING_PACKAGES = {MSGPACK: 'msgpack', ARROW: 'pyarrow'}
+
+ngram_featurizer = HashedNgramFeaturizer()
+preprocessor = TextPreprocessor()
+
+class AnalysisInputError(ValueError):
+    """Text that cannot be analyzed reliably"""
+
+class EncodingUnavailableError(Exception):
+    """A binary encoding whose library is not installed"""
+
+def check_text(text):
+    if len(text.split()) < MIN_WORDS:
+        raise AnalysisInputError("Text too short. Need at least 100 words.")
+
+def segment_document(stylometric_analyzer, document, segment_size, stride=None):
+    """Segments of a tokenized document, overlapping windows when a stride is given"""
+    if stride is not None and stride < 1:
+        raise AnalysisInputError("Stride must be at least 1 token.")
+
+    segments = stylometric_analyzer.segment_text(document, segment_size, stride)
+
+    if len(segments) < MIN_SEGMENTS:
+        raise AnalysisInputError("Text too short for reliable analysis. Need at least 2 segments.")
+    return segments
+
+def iter_features(stylometric_analyzer, segments, stride=None):
+    """Features of each segment in order; overlapping windows are slid incrementally"""
+    if stride is None:
+        return (stylometric_analyzer.extract_features(seg) for seg in segments)
+    return stylometric_analyzer.extract_window_features(segments)
+
+def range_features(stylometric_analyzer, document, segments):
+    """Features of segments of one tokenized document in order, from its FeatureIndex
+    a chunk of segments at a time; equal to iter_features"""
+    for first in range(0, len(segments), FEATURE_CHUNK):
+        bounds = [(seg.start, seg.end) for seg in segments[first:first + FEATURE_CHUNK]]
+        yield from stylometric_analyzer.extract_range_features(document, bounds)
+
+def window_step(segment_size, stride=None):
+    """How many windows apart windows stop overlapping"""
+    if stride is None:
+        return 1
+    return max(1, segment_size // stride)
+
+def llm_segments(segments, segment_size, stride=None):
+    """Segments handed to the LLM stage: overlapping windows are thinned to
+    about one per ``segment_size`` tokens so its cost does not grow with the stride"""
+    return segments[::window_step(segment_size, stride)]
+
+def ngram_features(segments, segment_size, stride=None):
+    """Sparse n-gram counts of the LLM segments, the rows change points and drift are scored on"""
+    with timed('extract_ngram_features'):
+        return ngram_featurizer.transform([seg.tokens for seg in llm_segments(segments, segment_size, stride)])
+
+def featurize(stylometric_analyzer, document, segment_size, stride=None, progress=None):
+    """Segment a tokenized document and extract features of every segment
+
+    Returns the LLM segment texts, the features, for overlapping windows
+    the character span of every window (None otherwise), and the n-gram
+    matrix of the LLM segments. ``progress(done, total)`` is called before
+    the first segment and after each one.
+    """
+    with timed('segment_text'):
+        segments = segment_document(stylometric_analyzer, document, segment_size, stride)
+
+    stylometric_analyzer.tag(document)
+    segment_texts = [seg.text for seg in llm_segments(segments, segment_size, stride)]
+    ngram_matrix = ngram_features(segments, segment_size, stride)
+    # the document keeps its FeatureIndex, so another segment size or stride reuses it
+    features = range_features(stylometric_analyzer, document, segments)
+    if progress is not None:
+        features = _reporting(features, len(segments), progress)
+    with timed('extract_features'):
+        segment_features = list(features)
+    segment_spans = None if stride is None else [seg.char_span for seg in segments]
+    return segment_texts, segment_features, segment_spans, ngram_matrix
+
+def _reporting(items, total, progress):
+    progress(0, total)
+    for done, item in enumerate(items, 1):
+        yield item
+        progress(done, total)
+
+def paragraph_bounds(document):
+    """Token ranges of the paragraphs of a tokenized document, as TextPreprocessor.split_paragraphs finds them
+
+    A paragraph shorter than MIN_SEGMENT_TOKENS is merged with the
+    paragraphs after it, or at the end of the text with the one before.
+    """
+    starts = document.offsets[:, 0] if len(document) else np.zeros(0, dtype=np.int64)
+    bounds = []
+    position = 0
+    for paragraph in preprocessor.split_paragraphs(document.text):
+        position = document.text.find(paragraph, position)
+        start, end = np.searchsorted(starts, [position, position + len(paragraph)]).tolist()
+        position += len(paragraph)
+        if bounds and bounds[-1][1] - bounds[-1][0] < MIN_SEGMENT_TOKENS:
+            bounds[-1] = (bounds[-1][0], end)
+        elif end > start:
+            bounds.append((start, end))
+    if len(bounds) > 1 and bounds[-1][1] - bounds[-1][0] < MIN_SEGMENT_TOKENS:
+        bounds[-2:] = [(bounds[-2][0], bounds[-1][1])]
+    return [(start, end) for start, end in bounds if end - start >= MIN_SEGMENT_TOKENS]
+
+def ladder(stylometric_analyzer, obfuscation_scorer, document, segment_sizes=LADDER_SIZES, paragraphs=True):
+    """Scores of a tokenized document at several segment sizes, and over its paragraphs
+
+    Every level is segmented and scored as /analyze would (consecutive
+    segments, no stride), but the document is tagged once, its FeatureIndex
+    built once and the n-gram rows of all levels counted in one pass, so
+    the whole ladder costs little more than one level. A level with fewer
+    than MIN_SEGMENTS segments carries an ``error`` instead of scores.
+    """
+    stylometric_analyzer.tag(document)
+    levels = [('segment_size', size, [(seg.start, seg.end) for seg in stylometric_analyzer.segment_text(document, size)])
+              for size in segment_sizes]
+    if paragraphs:
+        with timed('segment_text'):
+            levels.append(('segmentation', 'paragraphs', paragraph_bounds(document)))
+    with timed('extract_ngram_features'):
+        ngram_matrices = ngram_featurizer.transform_ranges(document.tokens, [bounds for _, _, bounds in levels])
+
+    results = []
+    for (key, value, bounds), ngram_matrix in zip(levels, ngram_matrices):
+        if len(bounds) < MIN_SEGMENTS:
+            results.append({key: value, 'num_segments': len(bounds),
+                            'error': "Text too short for reliable analysis. Need at least 2 segments."})
+            continue
+        with timed('extract_features'):
+            features = features_to_matrix(stylometric_analyzer.extract_range_features(document, bounds))
+        with timed('calculate_obfuscation_score'):
+            obfuscation_results = obfuscation_scorer.score_matrix(features, 1, ngram_matrix)
+        results.append({
+            key: value,
+            'overall_score': obfuscation_results['overall_score'],
+            'risk_level': obfuscation_results['risk_level'],
+            'component_scores': obfuscation_results['component_scores'],
+            'component_p_values': obfuscation_results['component_p_values'],
+            'suspicious_segments': obfuscation_results['suspicious_segments'],
+            'outlier_segments': obfuscation_results['outlier_segments'],
+            'change_points': obfuscation_results['change_points'],
+            'num_segments': len(bounds),
+            'segment_spans': [document.segment(start, end).char_span for start, end in bounds],
+        })
+    return results
+
+def build_response(obfuscation_results, llama_inconsistencies, segment_texts, segment_features,
+                   explanation=None, segment_spans=None, compact=False, feature_dtype='<f8'):
+    """Shape analysis results the way /analyze returns them
+
+    The compact layout sends segment features as columns of
+    ``feature_dtype`` (see models.features.columnar) and suspicious
+    segments without a copy of their features, to be looked up by index.
+    """
+    num_segments = len(segment_features)
+    suspicious_segments = obfuscation_results['suspicious_segments']
+    if compact:
+        suspicious_segments = [{k: v for k, v in entry.items() if k != 'features'} for entry in suspicious_segments]
+        segment_features = columnar(segment_features, feature_dtype)
+    response = {
+        'overall_score': obfuscation_results['overall_score'],
+        'risk_level': obfuscation_results['risk_level'],
+        'component_scores': obfuscation_results['component_scores'],
+        'component_p_values': obfuscation_results['component_p_values'],
+        'suspicious_segments': suspicious_segments,
+        'outlier_segments': obfuscation_results['outlier_segments'],
+        'change_points': obfuscation_results['change_points'],
+        'explanation': explanation,
+        'llama_analysis': llama_inconsistencies,
+        'num_segments': num_segments,
+        'segment_features': segment_features
+    }
+    if explanation is None:
+        del response['explanation']
+    if segment_spans is not None:
+        response['segment_spans'] = segment_spans
+    return response
+
+def analyze_statistics(text, segment_size, stylometric_analyzer, obfuscation_scorer, llama_analyzer, stride=None,
+                       compact=False):
+    """Full statistical analysis of one text, everything /analyze returns but the LLM explanation"""
+    check_text(text)
+
+    with timed('tokenize'):
+        document = stylometric_analyzer.tokenize(text)
+    segment_texts, segment_features, segment_spans, ngram_matrix = featurize(
+        stylometric_analyzer, document, segment_size, stride
+    )
+    with timed('calculate_obfuscation_score'):
+        obfuscation_results = obfuscation_scorer.calculate_obfuscation_score(
+            segment_features, window_step(segment_size, stride), ngram_matrix
+        )
+    with timed('detect_inconsistencies'):
+        llama_inconsistencies = llama_analyzer.detect_inconsistencies(segment_texts)
+
+    return build_response(obfuscation_results, llama_inconsistencies, segment_texts, segment_features,
+                          segment_spans=segment_spans, compact=compact)
+
+def encoding_for(accept):
+    """The first media type in an Accept header that results can be encoded in, JSON by default
+
+    Raises EncodingUnavailableError when that is a binary encoding whose
+    library is not installed.
+    """
+    for part in (accept or '').split(','):
+        media_type = ENCODINGS.get(part.split(';')[0].strip().lower())
+        if media_type is None:
+            continue
+        package = ENCODING_PACKAGES.get(media_type)
+        if package is not None:
+            try:
+                importlib.import_module(package)
+            except ImportError:
+                raise EncodingUnavailableError(
+                    f"{media_type} responses need the {package} package installed on the server"
+                ) from None
+        return media_type
+    return JSON
+
+def encode(response, media_type):
+    """Encode results as ``media_type`` bytes; binary encodings expect the compact layout"""
+    if media_type == MSGPACK:
+        return to_msgpack(response)
+    if media_type == ARROW:
+        return to_arrow(response)
+    return to_json(response).encode('utf-8')
+
+def to_json(value):
+    """JSON-encode analysis results, which may hold NumPy scalars and arrays"""
+    return json.dumps(value, default=_json_default)
+
+def to_msgpack(value):
+    """MessagePack-encode analysis results; NumPy arrays become their raw bytes"""
+    import msgpack
+
+    return msgpack.packb(value, default=_msgpack_default)
+
+def to_arrow(response):
+    """Arrow IPC stream of a compact response
+
+    The varying feature columns form the record batch; everything else,
+    constant columns included, is JSON in the schema metadata under
+    ``response``.
+    """
+    import pyarrow as pa
+
+    features = response['segment_features']
+    table = pa.table({name: pa.array(values) for name, values in features['columns'].items()})
+    rest = {**response, 'segment_features': {k: v for k, v in features.items() if k != 'columns'}}
+    table = table.replace_schema_metadata({'response': to_json(rest)})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, SegmentFeatures):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _msgpack_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tobytes()
+    return _json_default(value)
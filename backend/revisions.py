@@ -0,0 +1,205 @@
+"""Incremental re-analysis of a document as it is edited
+
+A Revision keeps everything an analysis of one version of a text computed:
+its tokenization, segments, their features, n-gram rows and texts, the
+scores and the explanation. Revising it with an edited text tokenizes
+again only around the edit (TokenizedDocument.revise), tags only the
+sentences it touched, and featurizes only the segments that overlap it.
+
+Segments clear of the edit keep their tokens, and so their features: they
+move with the text around them instead of staying at fixed token offsets,
+so inserting a word does not shift every later segment by a word. The
+tokens between the nearest untouched segments are cut again into segments
+of about ``segment_size`` tokens (windows every ``stride`` tokens with a
+stride). A revised document can therefore be segmented differently from
+the same text analyzed from scratch, but only where it was edited.
+"""
+import itertools
+import uuid
+
+from models.stylometry import MIN_SEGMENT_TOKENS
+from pipeline import (AnalysisInputError, MIN_SEGMENTS, check_text, iter_features, llm_segments,
+                      ngram_featurizer, segment_document, window_step)
+from utils.metrics import REVISION_SEGMENTS, timed
+
+# the most suspicious segments an explanation is written about
+TOP_SUSPICIOUS = 3
+
+# ids that follow a segment from one revision to the next
+_segment_ids = itertools.count()
+
+class Revision:
+    """One analyzed version of a document
+
+    ``segment_ids`` identify segments across revisions: a segment the edit
+    left alone keeps its id. ``segment_texts`` and ``ngram_matrix`` hold the
+    LLM segments, every ``window_step``-th segment.
+    """
+
+    def __init__(self, document, segment_size, stride, segments, segment_ids, segment_features,
+                 segment_texts, ngram_matrix, base=None, segments_reused=0):
+        self.id = uuid.uuid4().hex
+        self.base = base
+        self.document = document
+        self.segment_size = segment_size
+        self.stride = stride
+        self.segments = segments
+        self.segment_ids = segment_ids
+        self.segment_features = segment_features
+        self.segment_texts = segment_texts
+        self.ngram_matrix = ngram_matrix
+        self.segments_reused = segments_reused
+        # filled in by score()
+        self.obfuscation_results = None
+        self.llama_inconsistencies = None
+        # the explanation, and the subject() it was written for
+        self.explanation = None
+        self.explained = None
+
+    @property
+    def window_step(self):
+        return window_step(self.segment_size, self.stride)
+
+    @property
+    def llm_ids(self):
+        return self.segment_ids[::self.window_step]
+
+    def matches(self, segment_size, stride):
+        """Whether an edit analyzed with these parameters can start from this revision"""
+        return self.segment_size == segment_size and self.stride == stride
+
+    def subject(self):
+        """What an explanation of this revision is about: its risk level and most suspicious segments"""
+        suspicious = self.obfuscation_results['suspicious_segments'][:TOP_SUSPICIOUS]
+        return (self.obfuscation_results['risk_level'],
+                frozenset(self.segment_ids[entry['segment_index']] for entry in suspicious))
+
+def analyze(stylometric_analyzer, text, segment_size, stride=None):
+    """First revision of a document, analyzed in full"""
+    check_text(text)
+
+    with timed('tokenize'):
+        document = stylometric_analyzer.tokenize(text)
+    with timed('segment_text'):
+        segments = segment_document(stylometric_analyzer, document, segment_size, stride)
+    stylometric_analyzer.tag(document)
+    with timed('extract_features'):
+        segment_features = list(iter_features(stylometric_analyzer, segments, stride))
+
+    llm = llm_segments(segments, segment_size, stride)
+    with timed('extract_ngram_features'):
+        ngram_matrix = ngram_featurizer.transform([seg.tokens for seg in llm])
+    return Revision(document, segment_size, stride, segments, [next(_segment_ids) for _ in segments],
+                    segment_features, [seg.text for seg in llm], ngram_matrix)
+
+def revise(stylometric_analyzer, base, text):
+    """Revision of ``base`` with its text replaced, featurizing only the segments the edit touched"""
+    check_text(text)
+
+    with timed('tokenize_edit'):
+        document, edit = base.document.revise(text)
+    stylometric_analyzer.tag(document, base.document, edit)
+
+    # segments end and start in order, so those clear of the edit are a prefix and a suffix
+    segments = base.segments
+    before = 0
+    while before < len(segments) and segments[before].end <= edit.start:
+        before += 1
+    after = len(segments)
+    while after > before and segments[after - 1].start >= edit.old_end:
+        after -= 1
+
+    if base.stride is None:
+        before, after, middle = _recut_segments(document, segments, before, after, edit.shift, base.segment_size)
+    else:
+        middle = _recut_windows(document, segments, before, after, edit.shift, base.segment_size, base.stride)
+
+    new_segments = ([document.segment(seg.start, seg.end) for seg in segments[:before]] + middle
+                    + [document.segment(seg.start + edit.shift, seg.end + edit.shift) for seg in segments[after:]])
+    if len(new_segments) < MIN_SEGMENTS:
+        raise AnalysisInputError("Text too short for reliable analysis. Need at least 2 segments.")
+
+    with timed('extract_features'):
+        middle_features = list(iter_features(stylometric_analyzer, middle, base.stride))
+    segment_ids = base.segment_ids[:before] + [next(_segment_ids) for _ in middle] + base.segment_ids[after:]
+    segment_features = base.segment_features[:before] + middle_features + base.segment_features[after:]
+
+    # LLM segments the base already had keep their text and n-gram row
+    step = base.window_step
+    llm = new_segments[::step]
+    old_rows = {segment_id: row for row, segment_id in enumerate(base.llm_ids)}
+    rows = [old_rows.get(segment_id) for segment_id in segment_ids[::step]]
+    segment_texts = [seg.text if row is None else base.segment_texts[row] for seg, row in zip(llm, rows)]
+    ngram_matrix = base.ngram_matrix
+    added = [i for i, row in enumerate(rows) if row is None]
+    if added:
+        from scipy import sparse
+
+        with timed('extract_ngram_features'):
+            added_matrix = ngram_featurizer.transform([llm[i].tokens for i in added])
+        for j, i in enumerate(added):
+            rows[i] = ngram_matrix.shape[0] + j
+        ngram_matrix = sparse.vstack([ngram_matrix, added_matrix], format='csr')
+    ngram_matrix = ngram_matrix[rows]
+
+    REVISION_SEGMENTS.inc(len(new_segments) - len(middle), outcome='reused')
+    REVISION_SEGMENTS.inc(len(middle), outcome='analyzed')
+    return Revision(document, base.segment_size, base.stride, new_segments, segment_ids, segment_features,
+                    segment_texts, ngram_matrix, base=base.id, segments_reused=len(new_segments) - len(middle))
+
+def score(revision, obfuscation_scorer, llama_analyzer):
+    """Score a revision's features as /analyze does"""
+    with timed('calculate_obfuscation_score'):
+        revision.obfuscation_results = obfuscation_scorer.calculate_obfuscation_score(
+            revision.segment_features, revision.window_step, revision.ngram_matrix
+        )
+    with timed('detect_inconsistencies'):
+        revision.llama_inconsistencies = llama_analyzer.detect_inconsistencies(revision.segment_texts)
+
+def _recut_segments(document, segments, before, after, shift, segment_size):
+    """Consecutive segments over the tokens between the untouched ones
+
+    Returns the numbers of untouched segments kept before and after and the
+    new segments. Between two untouched segments the tokens are cut into
+    segments of about ``segment_size`` tokens and at least MIN_SEGMENT_TOKENS,
+    absorbing a neighbour when fewer are left; up to the end of the document
+    they are cut as segment_text does.
+    """
+    def span():
+        start = segments[before - 1].end if before else 0
+        end = segments[after].start + shift if after < len(segments) else len(document)
+        return start, end
+
+    shortest = max(segment_size // 2, MIN_SEGMENT_TOKENS)
+    start, end = span()
+    while after < len(segments) and end - start < shortest:
+        if before:
+            before -= 1
+        else:
+            after += 1
+        start, end = span()
+
+    if after == len(segments):
+        bounds = [(i, min(i + segment_size, end)) for i in range(start, end, segment_size)]
+    else:
+        count = max(1, min(round((end - start) / segment_size), (end - start) // MIN_SEGMENT_TOKENS))
+        cuts = [start + (end - start) * i // count for i in range(count + 1)]
+        bounds = list(zip(cuts, cuts[1:]))
+    return before, after, [document.segment(a, b) for a, b in bounds if b - a >= MIN_SEGMENT_TOKENS]
+
+def _recut_windows(document, segments, before, after, shift, segment_size, stride):
+    """Overlapping windows starting every ``stride`` tokens between the untouched ones
+
+    Up to the end of the document the last window is aligned to it, as
+    TokenizedDocument.windows does.
+    """
+    start = segments[before - 1].start + stride if before else 0
+    if after < len(segments):
+        starts = range(start, segments[after].start + shift, stride)
+    else:
+        last = max(len(document) - segment_size, 0)
+        starts = list(range(start, last + 1, stride))
+        if (not starts or starts[-1] != last) and (not before or last > segments[before - 1].start):
+            starts.append(last)
+    windows = [document.segment(i, i + segment_size) for i in starts]
+    return [window for window in windows if len(window) >= MIN_SEGMENT_TOKENS]
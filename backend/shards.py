@@ -0,0 +1,105 @@
+"""Analysis of one large document across a process pool
+
+Tokenizing, tagging and featurizing a document of 100k words takes seconds
+of CPU in a single process. Sharded, the text is cut into one stretch per
+shard, each tokenized by a worker, and the stretches joined again
+(TokenizedDocument.join splits the sentences across every seam again). The
+segments are then cut into as many runs of consecutive segments, each
+tagged and featurized by a worker from an excerpt of the document holding
+just its sentences. Results are gathered in order and equal those of
+pipeline.featurize.
+
+The executor is a pool created by batch.create_executor, whose workers
+have NLTK loaded already.
+"""
+import re
+from concurrent.futures import as_completed
+
+from pipeline import iter_features, llm_segments, ngram_featurizer, segment_document, window_step
+from utils.metrics import timed
+from utils.tokenization import TokenizedDocument
+
+_WORD_START = re.compile(r'\s\S')
+
+# per-process analyzers by whether they tag POS, created on first use in a worker
+_analyzers = {}
+
+def split_text(text, shards):
+    """Offsets cutting text into ``shards`` stretches of about equal length, each starting a word"""
+    offsets = [0]
+    for i in range(1, shards):
+        match = _WORD_START.search(text, max(len(text) * i // shards, offsets[-1] + 1))
+        if match is None:
+            break
+        offsets.append(match.start() + 1)
+    return offsets
+
+def tokenize(executor, text, shards, language='english'):
+    """TokenizedDocument of ``text``, its stretches tokenized on the executor"""
+    offsets = split_text(text, shards)
+    futures = [executor.submit(TokenizedDocument, text[start:end], language)
+               for start, end in zip(offsets, offsets[1:] + [len(text)])]
+    parts = [(offset, future.result()) for offset, future in zip(offsets, futures)]
+    with timed('join_tokenization'):
+        return TokenizedDocument.join(text, parts)
+
+def featurize(executor, stylometric_analyzer, document, segment_size, stride=None, shards=2, progress=None):
+    """pipeline.featurize with the segments featurized on the executor, in ``shards`` runs
+
+    ``progress(done, total)`` is called before the first run is sent and
+    as each run completes; if it raises, runs not yet started are cancelled.
+    """
+    with timed('segment_text'):
+        segments = segment_document(stylometric_analyzer, document, segment_size, stride)
+    step = window_step(segment_size, stride)
+    pos_tagging = stylometric_analyzer.pos_tagging
+
+    cuts = [len(segments) * i // shards for i in range(shards + 1)]
+    runs, sizes = [], {}
+    for first, last in zip(cuts, cuts[1:]):
+        if first == last:
+            continue
+        run = segments[first:last]
+        offset, excerpt = document.excerpt(run[0].start, max(seg.end for seg in run))
+        bounds = [(seg.start - offset, seg.end - offset) for seg in run]
+        llm = [i % step == 0 for i in range(first, last)]
+        runs.append(executor.submit(_featurize_run, excerpt, bounds, stride, llm, pos_tagging))
+        sizes[runs[-1]] = len(run)
+
+    with timed('extract_features'):
+        try:
+            if progress is not None:
+                done = 0
+                progress(done, len(segments))
+                for future in as_completed(runs):
+                    done += sizes[future]
+                    progress(done, len(segments))
+            results = [future.result() for future in runs]
+        except BaseException:
+            for future in runs:
+                future.cancel()
+            raise
+
+    from scipy import sparse
+
+    segment_features = [features for run_features, _ in results for features in run_features]
+    ngram_matrix = sparse.vstack([matrix for _, matrix in results if matrix is not None], format='csr')
+    segment_texts = [seg.text for seg in llm_segments(segments, segment_size, stride)]
+    segment_spans = None if stride is None else [seg.char_span for seg in segments]
+    return segment_texts, segment_features, segment_spans, ngram_matrix
+
+def _featurize_run(excerpt, bounds, stride, llm, pos_tagging):
+    """Features of the segments ``bounds`` of an excerpt, and n-gram rows of those marked in ``llm``"""
+    stylometric_analyzer = _analyzer(pos_tagging)
+    segments = [excerpt.segment(start, end) for start, end in bounds]
+    stylometric_analyzer.tag(excerpt)
+    features = list(iter_features(stylometric_analyzer, segments, stride))
+    tokens = [seg.tokens for seg, flag in zip(segments, llm) if flag]
+    return features, ngram_featurizer.transform(tokens) if tokens else None
+
+def _analyzer(pos_tagging):
+    if pos_tagging not in _analyzers:
+        from models.stylometry import StylometricAnalyzer
+
+        _analyzers[pos_tagging] = StylometricAnalyzer(pos_tagging=pos_tagging)
+    return _analyzers[pos_tagging]
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# modules are imported from backend/, as the app runs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def nlp():
+    """NLTK data the tokenizer needs; tests using it are skipped without it"""
+    from utils import nlp_resources
+
+    try:
+        nlp_resources.warm_up()
+    except LookupError as e:
+        pytest.skip(f"NLTK data not installed: {e}")
+
+
+@pytest.fixture(scope='session')
+def corpus():
+    from benchmarks.corpus import SyntheticCorpus
+
+    return SyntheticCorpus()
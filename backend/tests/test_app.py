@@ -0,0 +1,210 @@
+import asyncio
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+
+os.environ.setdefault('JOBS_DB', ':memory:')
+os.environ.pop('GROQ_API_KEY', None)
+
+from httpx import AsyncClient  # noqa: E402
+
+import batch  # noqa: E402
+from app import analysis_admission, app, result_cache  # noqa: E402
+from models.features import FEATURE_COLUMNS  # noqa: E402
+
+
+def post_all(requests):
+    """Responses to (path, json) requests, in order, from one client"""
+    async def run():
+        await app.router.startup()
+        try:
+            async with AsyncClient(app=app, base_url='http://test', timeout=120) as client:
+                return [await client.post(path, json=body) for path, body in requests]
+        finally:
+            await app.router.shutdown()
+    return asyncio.run(run())
+
+
+def paragraphs(corpus, seed, n_words):
+    """A text of several paragraphs and the same words as one paragraph"""
+    text = corpus.document(seed, n_words)
+    return text, ' '.join(text.split())
+
+
+def test_ladder_paragraphs_follow_the_exact_text(nlp, corpus):
+    text, flattened = paragraphs(corpus, 31, 3000)
+    request = {'segment_sizes': [200], 'paragraphs': True}
+    first, second = post_all([('/analyze/ladder', {'text': text, **request}),
+                              ('/analyze/ladder', {'text': flattened, **request})])
+    first, second = first.json()['levels'], second.json()['levels']
+    assert first[-1]['num_segments'] > 1
+    assert 'error' in second[-1]
+    assert first[0]['segment_spans'] != second[0]['segment_spans']
+
+
+def test_window_spans_follow_the_exact_text(nlp, corpus):
+    text, flattened = paragraphs(corpus, 32, 3000)
+    request = {'segment_size': 200, 'stride': 100}
+    first, second = post_all([('/analyze', {'text': text, **request}),
+                              ('/analyze', {'text': flattened, **request})])
+    first, second = first.json(), second.json()
+    assert first['num_segments'] == second['num_segments']
+    assert first['segment_spans'] != second['segment_spans']
+    assert second['segment_spans'][-1][1] <= len(flattened)
+
+
+def get_all(paths):
+    async def run():
+        await app.router.startup()
+        try:
+            async with AsyncClient(app=app, base_url='http://test') as client:
+                return [await client.get(path) for path in paths]
+        finally:
+            await app.router.shutdown()
+    return asyncio.run(run())
+
+
+def test_request_metrics_are_labelled_by_route():
+    *jobs, missing, metrics = get_all(['/jobs/first-id', '/jobs/second-id', '/no/such/path', '/metrics'])
+    assert [response.status_code for response in jobs] == [404, 404]
+    assert missing.status_code == 404
+    assert 'path="/jobs/{job_id}"' in metrics.text
+    assert 'first-id' not in metrics.text and 'second-id' not in metrics.text
+    assert 'path="unmatched"' in metrics.text
+
+
+def test_cache_hits_do_not_count_as_analysis_time(nlp, corpus, monkeypatch):
+    observed = []
+    monkeypatch.setattr(analysis_admission, 'record_analysis', lambda words, seconds: observed.append(words))
+    text = corpus.document(33, 2000)
+    responses = post_all([('/analyze', {'text': text, 'segment_size': 200})] * 2)
+    assert [response.status_code for response in responses] == [200, 200]
+    assert len(observed) == 1
+
+
+def test_job_of_a_cached_text_reports_every_segment_done(nlp, corpus):
+    text = corpus.document(34, 2000)
+
+    async def run():
+        await app.router.startup()
+        try:
+            async with AsyncClient(app=app, base_url='http://test', timeout=120) as client:
+                analyzed = await client.post('/analyze', json={'text': text, 'segment_size': 200})
+                job = (await client.post('/jobs', json={'text': text, 'segment_size': 200})).json()
+                while job['status'] not in ('done', 'failed'):
+                    await asyncio.sleep(0.05)
+                    job = (await client.get(f"/jobs/{job['job_id']}")).json()
+                return analyzed.json(), job
+        finally:
+            await app.router.shutdown()
+
+    analyzed, job = asyncio.run(run())
+    assert job['status'] == 'done'
+    total = analyzed['num_segments']
+    assert job['progress'] == {'segments_done': total, 'segments_total': total}
+
+
+def test_batch_isolates_bad_lines_and_matches_analyze(nlp, corpus):
+    texts = {'plain': corpus.document(61, 1200), 'windows': corpus.document(62, 1200, styles=('ornate',))}
+    lines = [json.dumps({'id': 'plain', 'text': texts['plain']}),
+             '{"text": "never closed',
+             json.dumps({'id': 'short', 'text': 'Far too short to analyze.'}),
+             json.dumps({'id': 'windows', 'text': texts['windows'], 'stride': 100})]
+    output = io.StringIO()
+    batch.run(lines, output, max_workers=2)
+    results = {result['id']: result for result in map(json.loads, output.getvalue().splitlines())}
+
+    assert len(results) == 4
+    assert results[1]['error'].startswith('Invalid input line')
+    assert 'too short' in results['short']['error']
+    plain, windows = post_all([('/analyze', {'text': texts['plain'], 'segment_size': 200}),
+                               ('/analyze', {'text': texts['windows'], 'segment_size': 200, 'stride': 100})])
+    for result, response in ((results['plain'], plain.json()), (results['windows'], windows.json())):
+        assert 'error' not in result
+        # p-values may count another number of shuffles, see ObfuscationScorer.component_p_values
+        assert result['component_p_values'].keys() == response['component_p_values'].keys()
+        for key in result.keys() - {'id', 'component_p_values'}:
+            assert result[key] == response[key], key
+
+
+def test_cache_keys_tell_segment_sizes_and_strides_apart(nlp, corpus):
+    text = corpus.document(63, 1500)
+    hits = result_cache.features.hits
+    requests = [{'segment_size': 200}, {'segment_size': 100}, {'segment_size': 200, 'stride': 100},
+                {'segment_size': 200}]
+    responses = [response.json() for response in post_all([('/analyze', {'text': text, **request})
+                                                            for request in requests])]
+    by_size, smaller, windows, again = responses
+    assert result_cache.features.hits - hits == 1
+    assert again == by_size
+    assert smaller['num_segments'] > by_size['num_segments']
+    assert windows['num_segments'] == 2 * by_size['num_segments'] - 1
+    # the last window is aligned to the end of the text, the last segment is not
+    assert windows['segment_features'][:-1:2] == by_size['segment_features'][:-1]
+    assert windows['segment_features'][1::2] != smaller['segment_features'][1::2]
+
+
+def expanded(response):
+    """A compact response in the default layout, segment features repeated by name"""
+    layout = response['segment_features']
+    columns = {name: list(values) for name, values in layout['columns'].items()}
+    columns.update({name: [value] * layout['num_segments'] for name, value in layout['constants'].items()})
+    features = [{name: float(columns[name][i]) for name in FEATURE_COLUMNS} for i in range(layout['num_segments'])]
+    suspicious = [{**entry, 'features': features[entry['segment_index']]} for entry in response['suspicious_segments']]
+    return {**response, 'segment_features': features, 'suspicious_segments': suspicious}
+
+
+def decoded(response):
+    """Response body as the client reads it, columns as arrays of their dtype"""
+    media_type = response.headers['content-type'].split(';')[0]
+    if media_type == 'application/msgpack':
+        import msgpack
+
+        body = msgpack.unpackb(response.content)
+        layout = body['segment_features']
+        layout['columns'] = {name: np.frombuffer(values, dtype=layout['dtype'])
+                             for name, values in layout['columns'].items()}
+        return body
+    if media_type == 'application/vnd.apache.arrow.stream':
+        import pyarrow as pa
+
+        table = pa.ipc.open_stream(response.content).read_all()
+        body = json.loads(table.schema.metadata[b'response'])
+        body['segment_features']['columns'] = {name: table.column(name).to_numpy() for name in table.column_names}
+        return body
+    return response.json()
+
+
+def test_compact_and_binary_layouts_expand_to_the_json_one(nlp, corpus):
+    pytest.importorskip('msgpack')
+    pytest.importorskip('pyarrow')
+    text = corpus.document(64, 1500, styles=('plain', 'ornate'), block_words=600)
+
+    async def run():
+        await app.router.startup()
+        try:
+            async with AsyncClient(app=app, base_url='http://test', timeout=120) as client:
+                body = {'text': text, 'segment_size': 100}
+                return [await client.post('/analyze', json=body),
+                        await client.post('/analyze', json={**body, 'compact': True}),
+                        await client.post('/analyze', json=body, headers={'Accept': 'application/msgpack'}),
+                        await client.post('/analyze', json=body,
+                                          headers={'Accept': 'application/vnd.apache.arrow.stream'})]
+        finally:
+            await app.router.shutdown()
+    default, compact, packed, arrow = (decoded(response) for response in asyncio.run(run()))
+
+    assert default['suspicious_segments']
+    assert expanded(compact) == default
+    for body in (packed, arrow):
+        assert body['segment_features']['dtype'] == '<f4'
+        body = expanded(body)
+        # float32 columns
+        assert body['segment_features'] == [pytest.approx(features, rel=1e-6) for features in default['segment_features']]
+        assert body['suspicious_segments'] == [{**entry, 'features': pytest.approx(entry['features'], rel=1e-6)}
+                                               for entry in default['suspicious_segments']]
+        rest = {key for key in default if key not in ('segment_features', 'suspicious_segments')}
+        assert {key: body[key] for key in rest} == {key: default[key] for key in rest}
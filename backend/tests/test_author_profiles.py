@@ -0,0 +1,131 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from models import author_profiles
+from models.author_profiles import AuthorProfiler, AuthorProfiles
+from utils import profile_index
+from utils.profile_index import MIN_ROWS_FOR_LISTS, ProfileIndex
+
+
+def clustered_vectors(n, dims=64, clusters=256, spread=1.0, seed=0):
+    """Rows scattered around random centers, as profiles of related authors are"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dims))
+    return centers[rng.integers(0, clusters, n)] + spread * rng.normal(size=(n, dims)), rng
+
+
+def brute_force(vectors, query, k):
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    similarities = vectors @ (query / np.linalg.norm(query))
+    return np.argsort(-similarities, kind='stable')[:k], similarities
+
+
+def test_probing_every_list_is_exact(tmp_path):
+    vectors, rng = clustered_vectors(2000)
+    ids = [f'author-{i}' for i in range(len(vectors))]
+    index = ProfileIndex.build(str(tmp_path / 'index'), ids, vectors, n_lists=16)
+    assert index.n_lists == 16
+
+    for query in rng.normal(size=(20, vectors.shape[1])):
+        found = index.search(query, 10, n_probe=index.n_lists)
+        rows, similarities = brute_force(vectors, query, 10)
+        assert [index.ids[row] for row, _ in found] == [ids[row] for row in rows]
+        assert [similarity for _, similarity in found] == pytest.approx(similarities[rows], abs=1e-5)
+
+
+def test_recall_at_the_default_probe_count(tmp_path):
+    vectors, rng = clustered_vectors(MIN_ROWS_FOR_LISTS)
+    index = ProfileIndex.build(str(tmp_path / 'index'), [str(i) for i in range(len(vectors))], vectors)
+    assert 1 < index.default_n_probe < index.n_lists
+
+    queries = vectors[rng.choice(len(vectors), 200, replace=False)] + 0.3 * rng.normal(size=(200, vectors.shape[1]))
+    found = exact = 0
+    for query in queries:
+        expected = {row for row, _ in index.search(query, 10, n_probe=index.n_lists)}
+        found += len(expected & {row for row, _ in index.search(query, 10)})
+        exact += len(expected)
+    assert found / exact >= 0.85
+
+
+def test_rebuilding_replaces_the_index_atomically(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'index')
+    vectors, _ = clustered_vectors(50)
+    ProfileIndex.build(directory, [f'old-{i}' for i in range(50)], vectors)
+
+    # a build that fails part way leaves the old index in place and nothing else behind
+    save = np.save
+    def failing_save(path, array):
+        if path.endswith('centroids.npy'):
+            raise OSError("disk full")
+        save(path, array)
+    monkeypatch.setattr(profile_index.np, 'save', failing_save)
+    with pytest.raises(OSError):
+        ProfileIndex.build(directory, [f'new-{i}' for i in range(30)], vectors[:30])
+    monkeypatch.undo()
+    assert ProfileIndex(directory).ids[0].startswith('old-')
+    assert os.listdir(tmp_path) == ['index']
+
+    rebuilt = ProfileIndex.build(directory, [f'new-{i}' for i in range(30)], vectors[:30])
+    assert len(rebuilt) == 30 and all(id.startswith('new-') for id in ProfileIndex(directory).ids)
+    assert os.listdir(tmp_path) == ['index']
+
+
+def author_texts(corpus):
+    return {f'author-{seed}': corpus.document(seed, 600, styles=(style,))
+            for seed, style in enumerate(('plain', 'ornate', 'terse', 'plain'))}
+
+
+def test_catalogue_with_other_features_is_rejected(nlp, corpus, tmp_path):
+    profiler = AuthorProfiler(segment_size=100)
+    totals = {author: profiler.totals(profiler.stylometric_analyzer.tokenize(text))
+              for author, text in author_texts(corpus).items()}
+    directory = str(tmp_path / 'profiles')
+    AuthorProfiles.build(directory, totals, profiler)
+    assert len(AuthorProfiles(directory, profiler.stylometric_analyzer)) == 4
+
+    with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    for key, value in [('feature_columns', meta['feature_columns'][::-1]), ('feature_version', 'other'),
+                       ('function_words', meta['function_words'][1:])]:
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({**meta, key: value}, f)
+        with pytest.raises(ValueError, match='other features'):
+            AuthorProfiles(directory, profiler.stylometric_analyzer)
+
+
+def test_totals_add_up_to_those_of_the_concatenation(nlp, corpus):
+    profiler = AuthorProfiler(segment_size=50)
+    analyzer = profiler.stylometric_analyzer
+    first, second = corpus.document(1, 1500), corpus.document(2, 1500)
+    # cut the first text at a sentence that starts a segment
+    document = analyzer.tokenize(first)
+    cut = next(i for i, start in enumerate(document.sentence_starts) if start and start % 50 == 0)
+    first = first[:document.sentence_offsets[cut]]
+
+    pooled = profiler.totals(analyzer.tokenize(first)) + profiler.totals(analyzer.tokenize(second))
+    whole = profiler.totals(analyzer.tokenize(first + second))
+    # all but the word bigram across the seam
+    bigrams_at = 2 + 2 * len(author_profiles.FEATURE_COLUMNS) + len(profiler.feature_extractor.function_word_order)
+    difference = whole - pooled
+    assert difference[:bigrams_at] == pytest.approx(0, abs=1e-6)
+    assert difference[bigrams_at] == 1
+    assert difference[bigrams_at + 1:].sum() == 1 and difference[bigrams_at + 1:].min() == 0
+
+
+def test_pooled_build_matches_in_process_totals(nlp, corpus, tmp_path):
+    texts = author_texts(corpus)
+    lines = [json.dumps({'author': author, 'text': text}) for author, text in texts.items()]
+    lines.append('{"author": "broken"')
+    # an author's texts are pooled across lines
+    lines.append(json.dumps({'author': 'author-0', 'text': texts['author-1']}))
+    built = author_profiles.build_from_jsonl(lines, str(tmp_path / 'pooled'), workers=2, segment_size=100)
+
+    profiler = AuthorProfiler(segment_size=100)
+    totals = {author: profiler.totals(profiler.stylometric_analyzer.tokenize(text)) for author, text in texts.items()}
+    totals['author-0'] = totals['author-0'] + totals['author-1']
+    expected = AuthorProfiles.build(str(tmp_path / 'direct'), totals, profiler)
+    assert built.index.ids == expected.index.ids
+    assert np.asarray(built.index.vectors) == pytest.approx(np.asarray(expected.index.vectors), abs=1e-6)
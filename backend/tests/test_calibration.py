@@ -0,0 +1,51 @@
+import numpy as np
+
+from models import calibration
+from models.features import COLUMN_INDEX, FEATURE_COLUMNS
+from models.obfuscation_scorer import ObfuscationScorer
+
+
+def labelled_corpus(seed=0, clean=40, mixed=20, segments=12):
+    """(label, matrix, None) of clean texts with steady features and of texts whose second half shifts"""
+    rng = np.random.default_rng(seed)
+    base = np.full(len(FEATURE_COLUMNS), 10.0)
+    base[COLUMN_INDEX['avg_word_length']] = 4.5
+    base[COLUMN_INDEX['type_token_ratio']] = 0.6
+    base[COLUMN_INDEX['function_word_ratio']] = 0.45
+    documents = []
+    for i in range(clean + mixed):
+        # each text keeps its own style throughout
+        matrix = np.tile(base * (1 + 0.05 * rng.normal(size=len(FEATURE_COLUMNS))), (segments, 1))
+        if i >= clean:
+            matrix[segments // 2:, COLUMN_INDEX['avg_word_length']] *= 1.8
+            matrix[segments // 2:, COLUMN_INDEX['avg_sentence_length']] += 15
+        documents.append((int(i >= clean), matrix, None))
+    return documents
+
+
+def test_fit_ignores_the_configured_calibration(tmp_path, monkeypatch):
+    documents = labelled_corpus()
+    config = calibration.fit(documents, 200, '2')
+    # a calibration with other risk levels and drift weight, as a configured server would load
+    previous = dict(config, risk_levels={'low_suspicion': 0.9, 'medium_suspicion': 0.95, 'high_suspicion': 0.99},
+                    cosine_drift_weight=0.9)
+    calibration.save(previous, tmp_path / 'previous.json')
+    monkeypatch.setenv('SCORER_CALIBRATION', str(tmp_path / 'previous.json'))
+    assert ObfuscationScorer().thresholds['low_suspicion'] == 0.9
+
+    refitted = calibration.fit(documents, 200, '2')
+    assert refitted['id'] == config['id']
+    assert refitted['cosine_drift_weight'] == config['cosine_drift_weight']
+
+
+def test_risk_levels_are_not_degenerate_when_clean_texts_score_zero():
+    defaults = ObfuscationScorer(calibration=False).thresholds
+    # over nine in ten clean texts score 0, so the 90% quantile is 0 and nextafter would make it 5e-324
+    overall = np.concatenate([np.zeros(92), np.linspace(0.2, 0.8, 8)])
+    risk_levels = calibration._risk_levels(overall, defaults)
+    assert risk_levels['low_suspicion'] == defaults['low_suspicion']
+    assert risk_levels['low_suspicion'] <= risk_levels['medium_suspicion'] <= risk_levels['high_suspicion']
+    assert risk_levels['high_suspicion'] > 0.7
+
+    risk_levels = calibration._risk_levels(np.zeros(100), defaults)
+    assert risk_levels == defaults
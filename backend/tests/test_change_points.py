@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import pipeline
+from models.features import features_to_matrix
+from models.obfuscation_scorer import ObfuscationScorer
+from models.stylometry import StylometricAnalyzer
+
+
+def segment_matrix(text, segment_size):
+    analyzer = StylometricAnalyzer()
+    _, features, _, _ = pipeline.featurize(analyzer, analyzer.tokenize(text), segment_size)
+    return features_to_matrix(features)
+
+
+@pytest.mark.parametrize('segment_size', [200, 400])
+def test_inserted_passage_is_found_with_both_edges(nlp, corpus, segment_size):
+    # plain, then an ornate insert, then plain again
+    text = corpus.document(10000, 10000, styles=('plain', 'ornate', 'plain'), block_words=3334)
+    matrix = segment_matrix(text, segment_size)
+    change_points = ObfuscationScorer().detect_change_points(matrix)
+
+    boundaries = [point['segment_index'] for point in change_points]
+    n = len(matrix)
+    assert any(abs(b - n / 3) <= 2 for b in boundaries)
+    assert any(abs(b - 2 * n / 3) <= 2 for b in boundaries)
+    assert max(point['confidence'] for point in change_points) > 0.99
+
+
+def test_clean_text_has_no_change_points(nlp, corpus):
+    for seed, style in ((10001, 'plain'), (10002, 'ornate'), (10003, 'terse')):
+        matrix = segment_matrix(corpus.document(seed, 10000, styles=(style,)), 200)
+        assert ObfuscationScorer().detect_change_points(matrix) == []
+
+
+def test_change_points_false_positive_rate():
+    scorer = ObfuscationScorer()
+    rng = np.random.default_rng(1)
+    found = sum(bool(scorer.detect_change_points(rng.normal(size=(40, 14)))) for _ in range(200))
+    assert found <= 4
+
+
+def test_insert_found_in_noise():
+    rng = np.random.default_rng(2)
+    matrix = rng.normal(size=(60, 14))
+    matrix[25:35] += 1.5
+    boundaries = [point['segment_index'] for point in ObfuscationScorer().detect_change_points(matrix)]
+    assert boundaries == [25, 35]
@@ -0,0 +1,22 @@
+import random
+
+from utils.feature_extractors import HashedNgramFeaturizer
+
+
+def test_transform_ranges_equals_transform_of_the_slices(nlp):
+    rng = random.Random(0)
+    vocabulary = ['The', 'the', 'of', 'and', 'Dr.', 'river', 'rivers', 'ran', ',', '.', "n't", 'a', 'A', 'quiet']
+    tokens = [rng.choice(vocabulary) for _ in range(500)]
+    featurizer = HashedNgramFeaturizer(n_features=2 ** 12)
+    ranges = [
+        [(i, min(i + 60, len(tokens))) for i in range(0, len(tokens), 60)],  # consecutive segments
+        [(i, i + 100) for i in range(0, 401, 40)],  # overlapping windows
+        [(7, 8), (8, 9), (300, 301)],  # single tokens, a bigram apart
+        [(250, 250), (0, len(tokens))],  # an empty range and the whole sequence
+        [],
+    ]
+
+    for bounds, matrix in zip(ranges, featurizer.transform_ranges(tokens, ranges)):
+        expected = featurizer.transform([tokens[start:end] for start, end in bounds])
+        assert matrix.shape == expected.shape == (len(bounds), featurizer.n_columns)
+        assert (matrix != expected).nnz == 0
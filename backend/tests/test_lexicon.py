@@ -0,0 +1,46 @@
+from collections import Counter
+
+from models.stylometry import StylometricAnalyzer
+from utils import lexicon
+from utils.lexicon import lexical_counts
+from utils.nlp_resources import load_stopwords
+
+
+def per_token_counts(words):
+    """The counts as the per-token loops of extract_features took them"""
+    alpha = [w for w in words if w.isalpha()]
+    lower = [w.lower() for w in alpha]
+    types = Counter(lower)
+    stop_words = load_stopwords('english')
+    return (len(alpha), sum(len(w) for w in alpha), sum(_syllables(w) for w in lower),
+            sum(1 for w in lower if w in stop_words), sum(1 for w in lower if w.endswith(lexicon.NOUN_SUFFIXES)),
+            sum(w.count(',') for w in words), sum(w.count(';') for w in words), dict(types),
+            sum(1 for count in types.values() if count == 1))
+
+
+def _syllables(word):
+    count = 0
+    previous_was_vowel = False
+    for char in word:
+        is_vowel = char in 'aeiouy'
+        if is_vowel and not previous_was_vowel:
+            count += 1
+        previous_was_vowel = is_vowel
+    if word.endswith('e'):
+        count -= 1
+    return max(count, 1)
+
+
+def test_memoized_counts_equal_the_per_token_loops(nlp, corpus):
+    text = corpus.document(70, 3000, styles=('plain', 'ornate', 'terse'), block_words=500)
+    text += " The THE the, x, ; ;; Dr. don't rhythm E e Nation nation nations a,b"
+    document = StylometricAnalyzer(pos_tagging=False).tokenize(text)
+    segments = [segment.words() for segment in document.windows(100)]
+    for words in segments:
+        assert tuple(lexical_counts(words)) == per_token_counts(words)
+
+    # still equal once the memo has evicted every type it held
+    lexical_counts(f'word{i}' for i in range(lexicon.MAX_TYPES + 1))
+    assert lexicon.word_properties.cache_info().currsize == lexicon.MAX_TYPES
+    for words in segments:
+        assert tuple(lexical_counts(words)) == per_token_counts(words)
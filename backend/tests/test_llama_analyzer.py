@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+from benchmarks.fake_groq import COMPLETION, FakeGroqServer
+from models.llama_analyzer import LlamaStyleAnalyzer
+
+INCONSISTENCIES = {'consistency_score': 0.9, 'segments_analyzed': 4}
+
+
+def analyzer_for(server, monkeypatch, timeout=10, max_concurrency=8):
+    monkeypatch.setenv('GROQ_API_KEY', 'test-key')
+    monkeypatch.setenv('GROQ_BASE_URL', server.url)
+    monkeypatch.setenv('LLM_TIMEOUT', str(timeout))
+    monkeypatch.setenv('LLM_MAX_CONCURRENCY', str(max_concurrency))
+    return LlamaStyleAnalyzer()
+
+
+def explain(analyzer, segment_texts):
+    """Explanations of one segment each, requested at once; distinct texts keep the prompts from being shared"""
+    async def run():
+        try:
+            return await asyncio.gather(*(analyzer.generate_explanation_async(INCONSISTENCIES, [text])
+                                          for text in segment_texts))
+        finally:
+            await analyzer.aclose()
+    return asyncio.run(run())
+
+
+def test_explanation_is_parsed_from_the_response(monkeypatch):
+    with FakeGroqServer(latency=0.0) as server:
+        explanation, = explain(analyzer_for(server, monkeypatch), ['A single segment.'])
+    assert explanation == COMPLETION.strip()
+    assert server.requests == 1
+
+
+def test_concurrent_calls_stay_within_the_cap(monkeypatch):
+    with FakeGroqServer(latency=0.1) as server:
+        explanations = explain(analyzer_for(server, monkeypatch, max_concurrency=3),
+                               [f'Segment number {i}.' for i in range(12)])
+    assert explanations == [COMPLETION.strip()] * 12
+    assert server.requests == 12
+    assert server.max_in_flight == 3
+
+
+def test_slow_response_falls_back_to_the_statistical_explanation(monkeypatch):
+    with FakeGroqServer(latency=2.0) as server:
+        analyzer = analyzer_for(server, monkeypatch, timeout=0.2)
+        started = time.monotonic()
+        explanation, = explain(analyzer, ['A slow segment.'])
+        elapsed = time.monotonic() - started
+    assert explanation == analyzer._fallback_explanation(INCONSISTENCIES)
+    assert elapsed < 1.5
@@ -0,0 +1,34 @@
+import itertools
+import types
+
+import numpy as np
+import pytest
+
+from models import obfuscation_scorer
+from models.obfuscation_scorer import ObfuscationScorer
+
+
+def p_values(matrix, budget=0.05, max_permutations=4999):
+    scorer = ObfuscationScorer(calibration=False)
+    scorer.p_value_budget = budget
+    scorer.max_permutations = max_permutations
+    return scorer.score_matrix(matrix)['component_p_values']
+
+
+@pytest.mark.parametrize('ticks', [1, 2, 5, 17, 40, 90, 10000])
+def test_p_values_are_those_of_a_fixed_shuffle_count_whatever_the_clock(monkeypatch, ticks):
+    matrix = np.random.default_rng(3).normal(size=(40, 14))
+    reached = [p_values(matrix, budget=1e9, max_permutations=permutations) for permutations in (99, 999, 4999)]
+
+    # a clock that runs out of budget after ``ticks`` readings, as a loaded machine would
+    clock = itertools.count()
+    monkeypatch.setattr(obfuscation_scorer, 'time', types.SimpleNamespace(perf_counter=lambda: next(clock)))
+    got = p_values(matrix, budget=ticks)
+    assert got in reached
+    assert got['lexical_inconsistency'] is None and got['unnatural_variation'] is None
+
+
+def test_a_shuffle_count_reproduces_its_p_values():
+    matrix = np.random.default_rng(4).normal(size=(12, 14))
+    assert p_values(matrix, budget=0) == p_values(matrix, budget=0)
+    assert p_values(matrix, budget=0, max_permutations=50) == p_values(matrix, budget=1e9, max_permutations=50)
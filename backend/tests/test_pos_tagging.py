@@ -0,0 +1,31 @@
+import nltk
+import pytest
+
+from models.stylometry import StylometricAnalyzer
+from utils.nlp_resources import load_tagger
+from utils.pos_tagging import BatchTagger
+
+
+@pytest.fixture(scope='module')
+def tagger(nlp):
+    try:
+        return load_tagger()
+    except LookupError as e:
+        pytest.skip(f"POS tagger not installed: {e}")
+
+
+def test_batch_tags_equal_nltk_pos_tag(tagger, corpus):
+    text = corpus.document(80, 2000, styles=('plain', 'ornate', 'terse'), block_words=400)
+    document = StylometricAnalyzer(pos_tagging=False).tokenize(text)
+    sentences = [document.tokens[start:end] for start, end in
+                 zip(document.sentence_starts, document.sentence_starts[1:] + [len(document)])]
+    # known, unknown, capitalized and numeric words, and sentences of one token or none
+    sentences += [['The', 'quick', 'brown', 'fox', 'jumps', 'over', 'the', 'lazy', 'dog', '.'],
+                  ['Running', 'RUNNING', 'running', '1999', '3.14', "n't", 'Xyzzyq', 'glorped', '!'],
+                  ['Hello'], []]
+
+    expected = [[tag for _, tag in nltk.pos_tag(sentence)] for sentence in sentences]
+    batch_tagger = BatchTagger(tagger)
+    # one batch, and batches cutting the sentences into many
+    assert batch_tagger.tag_sents(sentences) == expected
+    assert batch_tagger.tag_sents(sentences, batch_tokens=7) == expected
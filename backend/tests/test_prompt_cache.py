@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+import types
+
+from utils import cache
+from utils.prompt_cache import PromptCache
+
+
+def counted_call(calls, content='An explanation.', delay=0.05):
+    async def call():
+        calls.append(content)
+        await asyncio.sleep(delay)
+        return content, {'prompt_tokens': 120, 'completion_tokens': 40}
+    return call
+
+
+def test_concurrent_identical_prompts_make_one_call():
+    prompt_cache = PromptCache()
+    key = PromptCache.key('model', 'Explain this.', temperature=0.3)
+    calls = []
+
+    async def run():
+        # a caller that gives up does not cancel the call for the others
+        impatient = asyncio.ensure_future(prompt_cache.complete_async(key, counted_call(calls)))
+        waiting = [prompt_cache.complete_async(key, counted_call(calls)) for _ in range(9)]
+        await asyncio.sleep(0)
+        impatient.cancel()
+        return await asyncio.gather(*waiting)
+
+    assert asyncio.run(run()) == ['An explanation.'] * 9
+    assert len(calls) == 1
+    assert PromptCache.key('model', 'Explain this.', temperature=0.7) != key
+
+
+def test_threads_share_one_call():
+    prompt_cache = PromptCache()
+    calls = []
+    started = threading.Barrier(6)
+
+    def call():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'An explanation.', None
+
+    def complete():
+        started.wait()
+        return prompt_cache.complete('key', call)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(complete())) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['An explanation.'] * 6
+    assert len(calls) == 1
+
+
+def test_completions_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    prompt_cache = PromptCache(ttl=60)
+    calls = []
+
+    async def complete(content):
+        return await prompt_cache.complete_async('key', counted_call(calls, content, delay=0))
+
+    assert asyncio.run(complete('first')) == 'first'
+    now[0] += 59
+    assert asyncio.run(complete('second')) == 'first'
+    now[0] += 2
+    assert asyncio.run(complete('third')) == 'third'
+    assert calls == ['first', 'third']
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import revisions
+from models.stylometry import MIN_SEGMENT_TOKENS, StylometricAnalyzer
+from pipeline import featurize, llm_segments
+
+
+@pytest.fixture(scope='module')
+def analyzer(nlp):
+    return StylometricAnalyzer(pos_tagging=True)
+
+
+def edits(revision):
+    """(name, edit(text) -> text) at segment boundaries, inside a segment and at either end of the text"""
+    text = revision.document.text
+    boundary = revision.segments[len(revision.segments) // 2].char_span[0]
+    inner = revision.segments[1].char_span[0] + 40
+    return [
+        ('insert at a boundary', lambda t: t[:boundary] + 'An inserted sentence of plain words. ' + t[boundary:]),
+        ('delete across a boundary', lambda t: t[:boundary - 60] + t[boundary + 60:]),
+        ('replace inside a segment', lambda t: t[:inner] + 'quite different wording' + t[inner + 12:]),
+        ('insert at the start', lambda t: 'It began with a preface. ' + t),
+        ('delete at the start', lambda t: t[len(text) // 20:]),
+        ('append at the end', lambda t: t + ' And then a closing remark was added. It ended.'),
+        ('replace at the end', lambda t: t[:-80] + 'a new ending, written later.'),
+    ]
+
+
+def assert_as_fresh(analyzer, revision):
+    """The revision equals tokenizing, tagging and featurizing its text from scratch, segment for segment"""
+    document = revision.document
+    fresh = analyzer.tokenize(document.text)
+    analyzer.tag(fresh)
+    assert document.tokens == fresh.tokens
+    assert np.array_equal(document.offsets, fresh.offsets)
+    assert document.sentence_starts == fresh.sentence_starts
+    assert document.sentence_offsets == fresh.sentence_offsets
+    assert document.segment_breaks == fresh.segment_breaks
+    if fresh.pos_counts is not None:
+        assert np.array_equal(document.pos_counts, fresh.pos_counts)
+
+    # segments still cover the text, as segment_text cuts it
+    bounds = [(seg.start, seg.end) for seg in revision.segments]
+    assert bounds[0][0] == 0 and len(document) - bounds[-1][1] < MIN_SEGMENT_TOKENS
+    for (start, end), (next_start, _) in zip(bounds, bounds[1:]):
+        if revision.stride is None:
+            assert next_start == end
+        else:
+            assert 0 < next_start - start <= revision.stride
+
+    segments = [fresh.segment(start, end) for start, end in bounds]
+    assert [seg.char_span for seg in revision.segments] == [seg.char_span for seg in segments]
+    for features, segment in zip(revision.segment_features, segments):
+        assert features == pytest.approx(analyzer.extract_features(segment))
+    llm = llm_segments(segments, revision.segment_size, revision.stride)
+    assert revision.segment_texts == [seg.text for seg in llm]
+    assert revision.ngram_matrix.shape[0] == len(llm)
+
+
+@pytest.mark.parametrize('segment_size, stride', [(60, None), (60, 25)])
+def test_revisions_equal_a_fresh_analysis(analyzer, corpus, segment_size, stride):
+    base = revisions.analyze(analyzer, corpus.document(41, 1500), segment_size, stride)
+    for name, edit in edits(base):
+        revision = revisions.revise(analyzer, base, edit(base.document.text))
+        assert_as_fresh(analyzer, revision)
+        assert revision.segments_reused > 0, name
+
+    # edits applied one after another
+    revision = base
+    for name, edit in edits(base):
+        revision = revisions.revise(analyzer, revision, edit(revision.document.text))
+        assert_as_fresh(analyzer, revision)
+
+
+def test_replacement_keeping_the_token_count_segments_as_fresh(analyzer, corpus):
+    base = revisions.analyze(analyzer, corpus.document(42, 1500), 60)
+    start, end = base.segments[3].char_span
+    text = base.document.text
+    word = text[start:end].split()[5]
+    edited = text[:start] + text[start:end].replace(word, 'x' * len(word), 1) + text[end:]
+    revision = revisions.revise(analyzer, base, edited)
+
+    fresh = analyzer.tokenize(edited)
+    segment_texts, segment_features, _, _ = featurize(analyzer, fresh, 60)
+    assert revision.segment_texts == segment_texts
+    assert revision.segment_features == [pytest.approx(features) for features in segment_features]
+    # the edited sentence may straddle two segments
+    assert revision.segments_reused >= len(segment_features) - 2
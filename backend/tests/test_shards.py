@@ -0,0 +1,61 @@
+import re
+
+import numpy as np
+import pytest
+
+import shards
+from batch import create_executor
+from models.stylometry import StylometricAnalyzer
+from pipeline import featurize
+from utils.tokenization import TokenizedDocument
+
+
+@pytest.fixture(scope='module')
+def executor(nlp):
+    with create_executor(2) as executor:
+        yield executor
+
+
+def seams(text):
+    """Offsets of words in the middle of a sentence, at a sentence start inside a paragraph, and after a paragraph"""
+    paragraph = text.index('\n\n', len(text) // 4) + 2
+    sentence = re.compile(r'[.?!] (?=\w)').search(text, paragraph).end()
+    middle = re.compile(r'[a-z]+ (?=\w)').search(text, sentence + 30).end()
+    return [0, paragraph, sentence, middle, re.compile(r'\s\S').search(text, len(text) * 3 // 4).end() - 1]
+
+
+def assert_same_document(joined, whole):
+    assert joined.tokens == whole.tokens
+    assert np.array_equal(joined.offsets, whole.offsets)
+    assert joined.sentence_starts == whole.sentence_starts
+    assert joined.sentence_offsets == whole.sentence_offsets
+    assert joined.segment_breaks == whole.segment_breaks
+
+
+def test_stretches_cut_anywhere_join_to_the_whole(nlp, corpus):
+    text = corpus.document(7, 3000)
+    offsets = seams(text)
+    parts = [(start, TokenizedDocument(text[start:end])) for start, end in zip(offsets, offsets[1:] + [len(text)])]
+    assert_same_document(TokenizedDocument.join(text, parts), TokenizedDocument(text))
+
+
+@pytest.mark.parametrize('segment_size, stride', [(100, None), (100, 40)])
+def test_sharded_analysis_equals_the_unsharded_one(executor, corpus, segment_size, stride):
+    text = corpus.document(8, 4000)
+    # seven shards over this text cut sentences and paragraphs alike
+    offsets = shards.split_text(text, 7)
+    assert len(offsets) == 7 and any(text[offset - 2] not in '.?!\n' for offset in offsets[1:])
+
+    analyzer = StylometricAnalyzer(pos_tagging=True)
+    whole = analyzer.tokenize(text)
+    sharded = shards.tokenize(executor, text, 7)
+    assert_same_document(sharded, whole)
+
+    texts, features, spans, matrix = shards.featurize(executor, analyzer, sharded, segment_size, stride, shards=3)
+    want_texts, want_features, want_spans, want_matrix = featurize(analyzer, whole, segment_size, stride)
+    assert texts == want_texts
+    assert spans == want_spans
+    assert len(features) == len(want_features)
+    for got, want in zip(features, want_features):
+        assert got == pytest.approx(want)
+    assert (matrix != want_matrix).nnz == 0
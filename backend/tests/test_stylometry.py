@@ -0,0 +1,91 @@
+import os
+from collections import Counter
+
+import numpy as np
+import pytest
+from nltk.tokenize import sent_tokenize, word_tokenize
+
+from models.stylometry import StylometricAnalyzer
+from pipeline import iter_features, range_features
+from utils.nlp_resources import load_stopwords
+
+README = os.path.join(os.path.dirname(__file__), '..', '..', 'README.md')
+
+# hard-wrapped prose, where quotes and contractions end lines
+WRAPPED = """The keeper said the dogs'
+bowls were empty again. "We can't
+say who filled them," he wrote, "and I don't
+know whether the neighbours' children did it. It's
+not the first time." Nobody answered him; the letter
+was filed with the others.
+"""
+
+# periods followed by closing brackets, and paired quotes, which the joined segment tokenizes anew
+BRACKETED = """The ruling is cited at length (see p. 3. ) and again in the brief. It was read at the end. )
+Then the clerk said "we adjourn," and the judge replied "not yet." Counsel cited Dr. ) Smith, U.S. ) law,
+and "the usual authorities" e.g. ) the "older cases" besides. Nobody objected (etc. ) so they went on.
+"""
+
+
+def baseline_features(segment):
+    """Features of a segment string as extract_features computed them from its sentences and words"""
+    sentences = sent_tokenize(segment)
+    words = [w.lower() for w in word_tokenize(segment) if w.isalpha()]
+    syllables = sum(_baseline_syllables(w) for w in words)
+    return {
+        'avg_word_length': np.mean([len(w) for w in words]),
+        'type_token_ratio': len(set(words)) / len(words),
+        'hapax_legomena_ratio': sum(1 for count in Counter(words).values() if count == 1) / len(words),
+        'avg_sentence_length': len(words) / len(sentences),
+        'sentence_length_variance': np.var([len(word_tokenize(s)) for s in sentences]),
+        'function_word_ratio': sum(1 for w in words if w in load_stopwords('english')) / len(words),
+        'comma_per_sentence': segment.count(',') / len(sentences),
+        'semicolon_per_sentence': segment.count(';') / len(sentences),
+        'flesch_reading_ease': 206.835 - 1.015 * (len(words) / len(sentences)) - 84.6 * (syllables / len(words)),
+    }
+
+
+def _baseline_syllables(word):
+    count = 0
+    previous_was_vowel = False
+    for char in word:
+        is_vowel = char in 'aeiouy'
+        if is_vowel and not previous_was_vowel:
+            count += 1
+        previous_was_vowel = is_vowel
+    if word.endswith('e'):
+        count -= 1
+    return max(count, 1)
+
+
+def source_text(source):
+    if source == 'readme':
+        return open(README, encoding='utf-8').read()
+    return {'wrapped': WRAPPED, 'bracketed': BRACKETED}[source] * 8
+
+
+@pytest.mark.parametrize('source, segment_size, stride', [('readme', 200, None), ('readme', 75, None),
+                                                          ('readme', 200, 60), ('wrapped', 12, None),
+                                                          ('bracketed', 7, None), ('bracketed', 11, 3)])
+def test_segment_features_match_the_segment_strings(nlp, source, segment_size, stride):
+    text = source_text(source)
+    analyzer = StylometricAnalyzer(pos_tagging=False)
+    document = analyzer.tokenize(text)
+    segments = [seg for seg in document.windows(segment_size, stride) if len(seg) >= min(segment_size, 50)]
+    expected = [baseline_features(seg.text) for seg in segments]
+
+    for features in (list(range_features(analyzer, document, segments)),
+                     list(iter_features(analyzer, segments, stride)),
+                     [analyzer.extract_features(seg) for seg in segments]):
+        for i, (got, want) in enumerate(zip(features, expected)):
+            for name, value in want.items():
+                assert got[name] == pytest.approx(value), (i, name)
+
+
+@pytest.mark.parametrize('source', ['bracketed', 'wrapped'])
+def test_segment_words_match_the_segment_strings(nlp, source):
+    document = StylometricAnalyzer(pos_tagging=False).tokenize(source_text(source))
+    for size in (5, 7, 11):
+        for segment in document.windows(size):
+            assert segment.words() == word_tokenize(segment.text)
+            assert segment.sentence_lengths() == [len(word_tokenize(s)) for s in sent_tokenize(segment.text)]
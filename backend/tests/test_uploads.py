@@ -0,0 +1,56 @@
+import io
+
+import pytest
+
+import uploads
+from models.llama_analyzer import LlamaStyleAnalyzer
+from models.stylometry import StylometricAnalyzer
+from pipeline import featurize
+from utils.text_preprocessing import TextPreprocessor
+
+
+@pytest.fixture(scope='module')
+def analyzers(nlp):
+    return StylometricAnalyzer(pos_tagging=False), LlamaStyleAnalyzer()
+
+
+def upload_features(analyzers, text, segment_size, stride, normalize, chunk_bytes):
+    analysis = uploads.UploadAnalysis(*analyzers, io.BytesIO(text.encode('utf-8')), segment_size, stride,
+                                      normalize, chunk_bytes)
+    results = []
+    while True:
+        more = analysis.next_segments()
+        if not more:
+            return results
+        results.extend(more)
+
+
+@pytest.mark.parametrize('chunk_bytes', [1, 7, 60, 200, uploads.CHUNK_BYTES])
+@pytest.mark.parametrize('stride', [None, 40])
+def test_chunked_upload_finds_the_segments_of_analyze(analyzers, corpus, chunk_bytes, stride):
+    # ornate sentences run past 200 bytes; some are quoted, and abbreviations end words mid-sentence
+    text = corpus.document(10, 2500, styles=('ornate', 'terse', 'plain'), block_words=300)
+    text += ' (see p. 3. ) and "the end." ) And it went on.'
+    for normalize in (False, True):
+        whole = TextPreprocessor().preprocess(text) if normalize else text
+        analyzer = analyzers[0]
+        _, features, _, _ = featurize(analyzer, analyzer.tokenize(whole), 100, stride)
+        spans = [seg.char_span for seg in analyzer.segment_text(analyzer.tokenize(whole), 100, stride)]
+
+        results = upload_features(analyzers, text, 100, stride, normalize, chunk_bytes)
+        assert [span for _, _, span in results] == spans
+        for (_, got, _), want in zip(results, features):
+            assert got == pytest.approx(want)
+
+
+def test_sentences_longer_than_the_carry_are_cut_between_words(analyzers, corpus, monkeypatch):
+    monkeypatch.setattr(uploads, 'MAX_CARRY', 150)
+    text = corpus.document(12, 1500, styles=('ornate',))
+    pieces = list(uploads.read_text(io.BytesIO(text.encode('utf-8')), 50))
+    assert ''.join(pieces) == text
+    assert all(len(piece) <= 200 for piece in pieces)
+
+    analyzer = analyzers[0]
+    _, features, _, _ = featurize(analyzer, analyzer.tokenize(text), 100)
+    results = upload_features(analyzers, text, 100, None, False, 50)
+    assert [got for _, got, _ in results] == [pytest.approx(want) for want in features]
@@ -0,0 +1,226 @@
+"""Analysis of an uploaded text file in bounded memory
+
+A file is read CHUNK_BYTES at a time, cut after the last sentence that
+ended in it, optionally normalized with TextPreprocessor, and tokenized as
+it arrives (StreamingTokenizer). Each segment is featurized as soon as its
+tokens are final, and its tokens are then forgotten: what is kept per
+segment is its feature row, and for segments handed to the LLM stage a
+lexical sophistication score and n-gram counts pooled into at most
+2 * POOLED_ROWS rows. Peak memory follows the chunk, sentence and segment
+sizes rather than the size of the file.
+
+Segments and their features are those /analyze finds for the same text.
+Past 2 * POOLED_ROWS LLM segments, cosine drift compares runs of segments
+pooled as they arrived, so its p-value can differ slightly from /analyze's.
+"""
+import codecs
+import hashlib
+import itertools
+import re
+
+from models.features import features_to_matrix
+from models.stylometry import MIN_SEGMENT_TOKENS
+from pipeline import AnalysisInputError, MIN_SEGMENTS, MIN_WORDS, ngram_featurizer, window_step
+from utils.metrics import timed
+from utils.text_preprocessing import TextPreprocessor
+from utils.tokenization import StreamingTokenizer
+
+# bytes read from the file at a time
+CHUNK_BYTES = 64 * 1024
+
+# characters of an unfinished sentence carried into the next piece, past which it is cut between words
+MAX_CARRY = 64 * 1024
+
+# LLM segments whose n-gram rows are kept apart before pooling
+POOLED_ROWS = 128
+
+_LAST_SPACE = re.compile(r'\s\S*$')
+# brackets and quotes that may close a sentence after its punctuation
+_CLOSERS = ']})\'"\u00bb\u201d\u2019'
+_SENTENCE_END = re.compile(rf'[.!?][{re.escape(_CLOSERS)}]*\s')
+
+preprocessor = TextPreprocessor()
+
+def read_text(file, chunk_bytes=CHUNK_BYTES, encoding='utf-8'):
+    """Yield the text of a binary file in pieces that end after a sentence
+
+    The unfinished sentence at the end of a chunk is carried into the next
+    piece, up to MAX_CARRY characters; a longer one is cut after a
+    whitespace. Undecodable bytes are replaced. Words are never split
+    across pieces.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    carry = ''
+    while True:
+        data = file.read(chunk_bytes)
+        # the carry ends no sentence yet, unless the whitespace read next follows its punctuation
+        searched = len(carry.rstrip('.!?' + _CLOSERS))
+        text = carry + decoder.decode(data, final=not data)
+        if not data:
+            break
+        cut = None
+        for match in _SENTENCE_END.finditer(text, searched):
+            cut = match.end()
+        if cut is None and len(text) > MAX_CARRY:
+            match = _LAST_SPACE.search(text)
+            cut = match and match.start() + 1
+        if cut is None:
+            carry = text
+        else:
+            carry = text[cut:]
+            yield text[:cut]
+    if text:
+        yield text
+
+def iter_segments(stream, pieces, segment_size, stride=None):
+    """Segments of a text fed to a StreamingTokenizer in pieces, as segment_text cuts them
+
+    Each segment is yielded once its tokens are final and is only valid
+    until the next one is requested; tokens no later segment needs are
+    released.
+    """
+    step = segment_size if stride is None else stride
+    start = 0
+    for piece in pieces:
+        stream.feed(piece)
+        settled = stream.settled()
+        while start + segment_size <= settled:
+            if segment_size >= MIN_SEGMENT_TOKENS:
+                yield stream.segment(start, start + segment_size)
+            start += step
+        # a stride aligns the last window to the end of the text, which may still be held
+        stream.release(start if stride is None else min(start, len(stream) - segment_size))
+
+    # the text is complete: cut the rest as TokenizedDocument.windows does
+    total = len(stream)
+    if stride is None:
+        bounds = [(i, min(i + segment_size, total)) for i in range(start, total, segment_size)]
+    else:
+        last = max(total - segment_size, 0)
+        bounds = [(i, min(i + segment_size, total)) for i in range(start, last + 1, stride)]
+        if last % stride:
+            bounds.append((last, min(last + segment_size, total)))
+    for first, end in bounds:
+        if end - first >= MIN_SEGMENT_TOKENS:
+            yield stream.segment(first, end)
+
+class PooledRows:
+    """Sparse rows summed in runs of consecutive rows as they arrive
+
+    Rows are kept apart until there are ``2 * limit`` of them; then
+    neighbours are summed in pairs, and every later run holds twice as many
+    rows.
+    """
+
+    def __init__(self, limit=POOLED_ROWS):
+        self.limit = limit
+        self.run_size = 1
+        self.runs = []
+        self._pending = None
+        self._pending_rows = 0
+
+    def add(self, matrix):
+        for i in range(matrix.shape[0]):
+            row = matrix[i]
+            self._pending = row if self._pending is None else self._pending + row
+            self._pending_rows += 1
+            if self._pending_rows == self.run_size:
+                self.runs.append(self._pending)
+                self._pending, self._pending_rows = None, 0
+                if len(self.runs) == 2 * self.limit:
+                    self.runs = [a + b for a, b in zip(self.runs[::2], self.runs[1::2])]
+                    self.run_size *= 2
+
+    def matrix(self):
+        from scipy import sparse
+
+        runs = self.runs if self._pending is None else self.runs + [self._pending]
+        return sparse.vstack(runs, format='csr')
+
+class UploadAnalysis:
+    """Statistics of a text read in pieces, kept per segment as /analyze/upload needs them"""
+
+    def __init__(self, stylometric_analyzer, llama_analyzer, file, segment_size, stride=None, normalize=True,
+                 chunk_bytes=CHUNK_BYTES):
+        if stride is not None and stride < 1:
+            raise AnalysisInputError("Stride must be at least 1 token.")
+        self.stylometric_analyzer = stylometric_analyzer
+        self.llama_analyzer = llama_analyzer
+        self.segment_size = segment_size
+        self.stride = stride
+        self.words = 0
+        self.segment_features = []
+        self.sophistications = []
+        self.ngram_rows = PooledRows()
+        # the explanation prompt quotes the start of the first segment
+        self.sample_text = None
+        self._hash = hashlib.sha256()
+
+        pieces = read_text(file, chunk_bytes)
+        if normalize:
+            pieces = preprocessor.preprocess_chunks(pieces)
+        self._stream = StreamingTokenizer()
+        self._segments = iter_segments(self._stream, self._counted(pieces), segment_size, stride)
+
+    @property
+    def window_step(self):
+        return window_step(self.segment_size, self.stride)
+
+    @property
+    def text_key(self):
+        """ResultCache.text_key of the text read so far"""
+        return self._hash.hexdigest()
+
+    def _counted(self, pieces):
+        for piece in pieces:
+            words = piece.split()
+            if words:
+                self._hash.update((' ' * bool(self.words) + ' '.join(words)).encode('utf-8'))
+            self.words += len(words)
+            yield piece
+
+    def next_segments(self, count=64):
+        """Featurize up to ``count`` more segments; returns their index, features and
+        character span in the (normalized) text, none once the text is exhausted"""
+        results, llm = [], []
+        with timed('extract_features'):
+            for segment in itertools.islice(self._segments, count):
+                index = len(self.segment_features)
+                features = self.stylometric_analyzer.extract_features(segment)
+                self.segment_features.append(features)
+                results.append((index, features, self._stream.char_span(segment)))
+                if index % self.window_step == 0:
+                    text = segment.text
+                    if self.sample_text is None:
+                        self.sample_text = text[:300]
+                    self.sophistications.append(self.llama_analyzer.lexical_sophistication(text))
+                    llm.append(segment.tokens)
+        if llm:
+            with timed('extract_ngram_features'):
+                self.ngram_rows.add(ngram_featurizer.transform(llm))
+        return results
+
+    def first_segments(self):
+        """next_segments until the text is known to be long enough to analyze
+
+        Raises AnalysisInputError for a text /analyze would refuse.
+        """
+        results = []
+        while len(results) < MIN_SEGMENTS or self.words < MIN_WORDS:
+            more = self.next_segments()
+            if not more:
+                if self.words < MIN_WORDS:
+                    raise AnalysisInputError("Text too short. Need at least 100 words.")
+                raise AnalysisInputError("Text too short for reliable analysis. Need at least 2 segments.")
+            results.extend(more)
+        return results
+
+    def scores(self, obfuscation_scorer):
+        """Obfuscation results and inconsistencies of the whole text, once every segment is featurized"""
+        with timed('calculate_obfuscation_score'):
+            obfuscation_results = obfuscation_scorer.score_matrix(
+                features_to_matrix(self.segment_features), self.window_step, self.ngram_rows.matrix()
+            )
+        with timed('detect_inconsistencies'):
+            llama_inconsistencies = self.llama_analyzer.inconsistencies_from(self.sophistications)
+        return obfuscation_results, llama_inconsistencies
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class CacheLayer:
+    """Size-bounded LRU cache with an optional on-disk tier
+
+    Entries evicted from memory stay on disk when a directory is given, so a
+    miss in memory falls through to disk before counting as a miss. With a
+    ``ttl``, entries older than that many seconds are dropped when looked up,
+    in either tier.
+    """
+
+    def __init__(self, name: str, max_entries: int = 256, disk_dir: Optional[str] = None,
+                 ttl: Optional[float] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.disk_dir = os.path.join(disk_dir, name) if disk_dir else None
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # time each entry was stored, when entries expire
+        self._stored_at = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, key: str) -> Any:
+        """Return the cached value or None"""
+        with self._lock:
+            if key in self._entries:
+                if not self._expired(self._stored_at.get(key)):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]
+                del self._entries[key]
+                del self._stored_at[key]
+                self.expirations += 1
+
+        value, stored_at = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, value, stored_at)
+        return value
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._store(key, value, time.time())
+        self._write_disk(key, value)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _store(self, key, value, stored_at):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if self.ttl is not None:
+            self._stored_at[key] = stored_at
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._stored_at.pop(evicted, None)
+            self.evictions += 1
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f'{key}.pkl')
+
+    def _read_disk(self, key):
+        """The value stored on disk and when it was written, or None and None"""
+        if not self.disk_dir:
+            return None, None
+        path = self._path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if self._expired(stored_at):
+                with self._lock:
+                    self.expirations += 1
+                return None, None
+            with open(path, 'rb') as f:
+                return pickle.load(f), stored_at
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None, None
+
+    def _write_disk(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Cache write error ({self.name}): {e}")
+
+
+class ResultCache:
+    """Content-addressed cache for /analyze, one layer per pipeline stage
+
+    - documents: tokenized text, keyed by the exact text, memory only
+    - features: segment texts and features, keyed by text and segment size
+      (the exact text for overlapping windows, which carry character spans)
+    - scores: scorer and statistical inconsistency output, same key
+    - explanations: LLM explanations, keyed by text and scorer output
+    """
+
+    def __init__(self, max_entries: int = 256, disk_dir: Optional[str] = None):
+        # tokenized documents are large and cheap to rebuild after a restart
+        self.documents = CacheLayer('documents', max(1, max_entries // 8))
+        self.features = CacheLayer('features', max_entries, disk_dir)
+        self.scores = CacheLayer('scores', max_entries, disk_dir)
+        self.explanations = CacheLayer('explanations', max_entries, disk_dir)
+
+    @staticmethod
+    def text_key(text: str) -> str:
+        """Hash of the text with whitespace runs collapsed, which tokens and features ignore
+
+        Only for results without character offsets or paragraphs, which
+        depend on the exact whitespace; those are keyed by document_key.
+        """
+        normalized = ' '.join(text.split())
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def document_key(text: str) -> str:
+        """Hash of the exact text"""
+        return hashlib.sha256(f'document:{text}'.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def params_key(text_key: str, **params) -> str:
+        """Key for a text analyzed with the given parameters"""
+        payload = json.dumps(params, sort_keys=True, default=float)
+        return hashlib.sha256(f'{text_key}:{payload}'.encode('utf-8')).hexdigest()
+
+    def stats(self) -> Dict:
+        return {layer.name: layer.stats()
+                for layer in (self.documents, self.features, self.scores, self.explanations)}
@@ -1,8 +1,21 @@
 import numpy as np
+import zlib
 from collections import Counter
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 import re
 
+PUNCTUATION_FEATURES = tuple((mark, f'{name}_frequency') for mark, name in (
+    (',', 'comma'),
+    ('.', 'period'),
+    ('!', 'exclamation'),
+    ('?', 'question'),
+    (';', 'semicolon'),
+    (':', 'colon'),
+    ('-', 'dash'),
+    ('(', 'parenthesis'),
+    ('"', 'quote')
+))
+
 class FeatureExtractor:
     """Additional feature extraction utilities"""
     
@@ -17,44 +30,37 @@ class FeatureExtractor:
             'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just',
             'don', 'should', 'now'
         }
+        # fixed order for function word vectors
+        self.function_word_order = sorted(self.common_function_words)
     
     def extract_ngram_features(self, words: List[str], n: int = 2) -> Dict:
         """Extract n-gram features"""
-        ngrams = []
-        for i in range(len(words) - n + 1):
-            ngram = ' '.join(words[i:i+n])
-            ngrams.append(ngram)
-        
-        ngram_counts = Counter(ngrams)
-        total_ngrams = len(ngrams)
+        ngram_counts = Counter(' '.join(gram) for gram in zip(*(words[i:] for i in range(n))))
+        total_ngrams = max(len(words) - n + 1, 0)
         
         return {
             f'{n}gram_diversity': len(ngram_counts) / total_ngrams if total_ngrams > 0 else 0,
             f'most_common_{n}grams': ngram_counts.most_common(10)
         }
     
+    def hashed_ngram_vector(self, words: List[str], n: int = 2, dims: int = 256) -> np.ndarray:
+        """Counts of lowercased word n-grams hashed into ``dims`` buckets
+
+        The hash is stable across processes, so vectors built on different
+        machines are comparable.
+        """
+        vector = np.zeros(dims)
+        words_lower = [w.lower() for w in words]
+        for i in range(len(words_lower) - n + 1):
+            ngram = ' '.join(words_lower[i:i+n])
+            vector[zlib.crc32(ngram.encode('utf-8')) % dims] += 1
+        return vector
+    
     def extract_punctuation_features(self, text: str) -> Dict:
         """Extract punctuation usage patterns"""
-        punctuation_marks = {
-            ',': 'comma',
-            '.': 'period',
-            '!': 'exclamation',
-            '?': 'question',
-            ';': 'semicolon',
-            ':': 'colon',
-            '-': 'dash',
-            '(': 'parenthesis',
-            '"': 'quote'
-        }
-        
-        features = {}
         total_chars = len(text)
-        
-        for mark, name in punctuation_marks.items():
-            count = text.count(mark)
-            features[f'{name}_frequency'] = count / total_chars if total_chars > 0 else 0
-        
-        return features
+        return {feature: text.count(mark) / total_chars if total_chars > 0 else 0
+                for mark, feature in PUNCTUATION_FEATURES}
     
     def extract_readability_features(self, text: str, sentences: List, words: List) -> Dict:
         """Extract various readability metrics"""
@@ -76,13 +82,12 @@ class FeatureExtractor:
     
     def extract_function_word_profile(self, words: List[str]) -> Dict:
         """Detailed function word analysis"""
-        words_lower = [w.lower() for w in words]
-        total_words = len(words_lower)
+        counts = Counter(w.lower() for w in words)
+        total_words = len(words)
         
         function_word_counts = {}
         for fw in self.common_function_words:
-            count = words_lower.count(fw)
-            function_word_counts[fw] = count / total_words if total_words > 0 else 0
+            function_word_counts[fw] = counts[fw] / total_words if total_words > 0 else 0
         
         # Get top 10 most used function words
         sorted_fw = sorted(function_word_counts.items(), key=lambda x: x[1], reverse=True)
@@ -92,6 +97,11 @@ class FeatureExtractor:
             'function_word_diversity': len([fw for fw, freq in function_word_counts.items() if freq > 0]) / len(self.common_function_words)
         }
     
+    def function_word_vector(self, words: List[str]) -> np.ndarray:
+        """Counts of every function word, in function_word_order"""
+        counts = Counter(w.lower() for w in words)
+        return np.array([counts[fw] for fw in self.function_word_order], dtype=float)
+    
     def extract_lexical_richness(self, words: List[str]) -> Dict:
         """Calculate various lexical richness metrics"""
         words_lower = [w.lower() for w in words]
@@ -136,4 +146,134 @@ class FeatureExtractor:
             'length_coefficient_variation': std_length / mean_length if mean_length > 0 else 0,
             'min_sentence_length': min(lengths),
             'max_sentence_length': max(lengths)
-        }
\ No newline at end of file
+        }
+
+
+class HashedNgramFeaturizer:
+    """Sparse counts of word and character n-grams and function words per segment
+
+    The first columns count each function word exactly. The remaining
+    ``n_features`` columns are hashed buckets shared by lowercased word
+    unigrams and bigrams and the character n-grams of each word, padded
+    with spaces. No vocabulary is kept, so the columns of any two documents
+    line up. Within a call every word type is hashed once, and all segments
+    are counted in one pass into a scipy CSR matrix.
+    """
+
+    def __init__(self, n_features: int = 2 ** 18, char_n: int = 3, function_words: Optional[Iterable[str]] = None):
+        self.n_features = n_features
+        self.char_n = char_n
+        if function_words is None:
+            function_words = FeatureExtractor().common_function_words
+        self.function_words = sorted(function_words)
+        self._function_columns = {fw: i for i, fw in enumerate(self.function_words)}
+
+    @property
+    def n_columns(self) -> int:
+        return len(self.function_words) + self.n_features
+
+    def transform(self, segments: Sequence[Sequence[str]]):
+        """Segments x n_columns float32 CSR matrix of counts, one row per token sequence"""
+        # ids of the word types seen in this call, in order of appearance
+        type_ids = {}
+        token_ids = []
+        lengths = []
+        for tokens in segments:
+            for token in tokens:
+                token = token.lower()
+                type_id = type_ids.get(token)
+                if type_id is None:
+                    type_id = type_ids[token] = len(type_ids)
+                token_ids.append(type_id)
+            lengths.append(len(tokens))
+
+        token_ids = np.array(token_ids, dtype=np.int64)
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        word_hashes, type_columns = self._type_matrix(type_ids)
+        return self._counts(token_ids, rows, len(lengths), word_hashes, type_columns)
+
+    def transform_ranges(self, tokens: Sequence[str], ranges: Sequence[Sequence[Tuple[int, int]]]) -> List:
+        """transform of token ranges of one sequence, one matrix per list of (start, end) ranges
+
+        Each matrix equals ``transform([tokens[start:end] for start, end in
+        bounds])``. Every token is looked up and every type hashed once for
+        all the lists, so segmenting a document several ways costs little
+        more than segmenting it once.
+        """
+        type_ids = {}
+        token_ids = np.fromiter((type_ids.setdefault(token.lower(), len(type_ids)) for token in tokens),
+                                dtype=np.int64, count=len(tokens))
+        word_hashes, type_columns = self._type_matrix(type_ids)
+
+        matrices = []
+        for bounds in ranges:
+            starts = np.array([start for start, _ in bounds], dtype=np.int64).reshape(len(bounds))
+            lengths = np.array([end for _, end in bounds], dtype=np.int64).reshape(len(bounds)) - starts
+            rows = np.repeat(np.arange(len(bounds)), lengths)
+            positions = np.arange(len(rows)) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            matrices.append(self._counts(token_ids[positions], rows, len(bounds), word_hashes, type_columns))
+        return matrices
+
+    def _type_matrix(self, type_ids):
+        """Hashes of the word types and their types x n_columns CSR matrix of columns"""
+        from scipy import sparse
+
+        word_hashes = np.fromiter((zlib.crc32(t.encode('utf-8')) for t in type_ids), dtype=np.uint64,
+                                  count=len(type_ids))
+        columns = self._type_columns(type_ids, word_hashes)
+        type_columns = sparse.csr_matrix(
+            (np.ones(sum(len(c) for c in columns), dtype=np.float32),
+             np.fromiter((i for c in columns for i in c), dtype=np.int64),
+             np.concatenate([[0], np.cumsum([len(c) for c in columns], dtype=np.int64)])),
+            shape=(len(type_ids), self.n_columns)
+        )
+        return word_hashes, type_columns
+
+    def _counts(self, token_ids, rows, num_rows, word_hashes, type_columns):
+        """Counts of the tokens of each row; consecutive tokens of a row form its bigrams"""
+        from scipy import sparse
+
+        shape = (num_rows, self.n_columns)
+        offset = len(self.function_words)
+
+        # segments x types, then types x columns
+        type_counts = sparse.csr_matrix(
+            (np.ones(len(token_ids), dtype=np.float32), (rows, token_ids)), shape=(num_rows, len(word_hashes))
+        )
+
+        # bigrams within a segment, hashed by mixing the hashes of their words
+        within = rows[:-1] == rows[1:]
+        first, second = word_hashes[token_ids[:-1][within]], word_hashes[token_ids[1:][within]]
+        with np.errstate(over='ignore'):
+            mixed = (first * np.uint64(0x9E3779B97F4A7C15)) ^ (second + np.uint64(0x632BE59BD9B4E019))
+            mixed ^= mixed >> np.uint64(29)
+        bigrams = sparse.csr_matrix(
+            (np.ones(len(mixed), dtype=np.float32),
+             (rows[:-1][within], offset + (mixed % np.uint64(self.n_features)).astype(np.int64))),
+            shape=shape
+        )
+
+        matrix = (type_counts @ type_columns + bigrams).tocsr()
+        matrix.sum_duplicates()
+        return matrix
+
+    def _type_columns(self, types, word_hashes):
+        """Columns of each type's unigram, character n-grams and function word"""
+        offset = len(self.function_words)
+        n = self.char_n
+        # character n-grams repeat across words; hash each once
+        gram_columns = {}
+        columns = []
+        for word, word_hash in zip(types, (word_hashes % np.uint64(self.n_features)).tolist()):
+            word_columns = [offset + word_hash]
+            padded = f' {word} '
+            for i in range(len(padded) - n + 1):
+                gram = padded[i:i + n]
+                column = gram_columns.get(gram)
+                if column is None:
+                    column = gram_columns[gram] = offset + zlib.crc32(f'c:{gram}'.encode('utf-8')) % self.n_features
+                word_columns.append(column)
+            if word in self._function_columns:
+                word_columns.append(self._function_columns[word])
+            columns.append(word_columns)
+        return columns
@@ -0,0 +1,145 @@
+"""Cumulative lexical counts of a tokenized document, for any token range
+
+The lexical features of a segment are sums over its words (length,
+syllables, stopwords, nouns, commas, semicolons), its number of distinct
+word types and its hapax legomena. A FeatureIndex looks up each joined
+word's properties once per document and keeps running sums of them, so the
+sums of any token range are the difference of two rows. For types, each
+word records where the previous and next word of its type are: a word is
+the first of its type in a range when the previous one lies before the
+range, and a hapax when the next one also lies after it. Those comparisons
+are made for many ranges at once with NumPy, so a document can be counted
+at several segment sizes, or as overlapping windows, for little more than
+the cost of looking up its words once.
+
+Ranges are counted as joined segments: every token before the final word
+as TokenizedDocument.joined_word reads it, and the final word as the end of
+a sentence, exactly as lexical_counts(document.segment(start, end).words()).
+The closing brackets and quotes after the final word are never words.
+"""
+from typing import List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from utils.lexicon import word_properties
+from utils.tokenization import TokenizedDocument
+
+# token positions compared at a time when counting types over many ranges
+_CHUNK_TOKENS = 1 << 22
+
+
+class RangeCounts(NamedTuple):
+    """lexical_counts of a token range, with the number of distinct types instead of the types"""
+    words: int
+    length: int
+    syllables: int
+    stopwords: int
+    nouns: int
+    commas: int
+    semicolons: int
+    num_types: int
+    hapax: int
+
+
+class FeatureIndex:
+    """Running lexical sums and same-type neighbours of every token of a document"""
+
+    def __init__(self, document: TokenizedDocument):
+        n = len(document)
+        # only a token ending in a period or holding a quote can read differently as a joined word
+        words = [document.joined_word(i) if token.endswith('.') or "'" in token else token
+                 for i, token in enumerate(document.tokens)]
+        word_ids = {word: i for i, word in enumerate(dict.fromkeys(words))}
+        token_words = np.fromiter(map(word_ids.__getitem__, words), dtype=np.int64, count=n)
+        properties = [word_properties(word) for word in word_ids]
+
+        # words, length, syllables, stopwords, nouns, commas, semicolons of each distinct word
+        table = np.array([(p.lower is not None, p.length, p.syllables, p.stopword, p.noun, p.commas, p.semicolons)
+                          for p in properties], dtype=np.int64).reshape(len(properties), 7)
+        self.sums = np.zeros((n + 1, 7), dtype=np.int64)
+        np.cumsum(table[token_words], axis=0, out=self.sums[1:])
+
+        self.type_ids = {}
+        word_types = np.array([-1 if p.lower is None else self.type_ids.setdefault(p.lower, len(self.type_ids))
+                               for p in properties], dtype=np.int64)
+        types = word_types[token_words]
+
+        # tokens grouped by type, in document order within each type
+        alpha = np.flatnonzero(types >= 0)
+        self.by_type = alpha[np.argsort(types[alpha], kind='stable')].astype(np.int32)
+        self.type_starts = np.searchsorted(types[self.by_type], np.arange(len(self.type_ids) + 1))
+
+        # tokens that are not words are never the first of a type, nor a hapax
+        self.previous = np.full(n, n, dtype=np.int32)
+        self.previous[alpha] = -1
+        self.next = np.full(n, n, dtype=np.int32)
+        same = types[self.by_type[1:]] == types[self.by_type[:-1]]
+        self.previous[self.by_type[1:][same]] = self.by_type[:-1][same]
+        self.next[self.by_type[:-1][same]] = self.by_type[1:][same]
+
+    def occurrences(self, lower: str, start: int, end: int) -> int:
+        """How many of tokens[start:end], read as joined words, are of the type ``lower``"""
+        type_id = self.type_ids.get(lower)
+        if type_id is None:
+            return 0
+        positions = self.by_type[self.type_starts[type_id]:self.type_starts[type_id + 1]]
+        return int(np.searchsorted(positions, end) - np.searchsorted(positions, start))
+
+    def type_counts(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Distinct types and hapax legomena of tokens[start:end] for each start, end pair"""
+        num_types = np.zeros(len(starts), dtype=np.int64)
+        hapax = np.zeros(len(starts), dtype=np.int64)
+        lengths = ends - starts
+        first = 0
+        while first < len(starts):
+            # ranges whose tokens fit in one chunk, at least one
+            last = max(int(np.searchsorted(np.cumsum(lengths[first:]), _CHUNK_TOKENS, side='right')), 1) + first
+            chunk = lengths[first:last]
+            owner = np.repeat(np.arange(first, last), chunk)
+            positions = np.arange(len(owner)) + np.repeat(starts[first:last] - (np.cumsum(chunk) - chunk), chunk)
+            is_first = self.previous[positions] < starts[owner]
+            num_types[first:last] = np.bincount(owner[is_first] - first, minlength=last - first)
+            is_hapax = is_first & (self.next[positions] >= ends[owner])
+            hapax[first:last] = np.bincount(owner[is_hapax] - first, minlength=last - first)
+            first = last
+        return num_types, hapax
+
+
+def document_index(document: TokenizedDocument) -> FeatureIndex:
+    """The FeatureIndex of a document, built on first use and kept with it"""
+    if document.feature_index is None:
+        document.feature_index = FeatureIndex(document)
+    return document.feature_index
+
+
+def range_counts(document: TokenizedDocument, bounds: Sequence[Tuple[int, int]]) -> List[RangeCounts]:
+    """Lexical counts of the joined segment tokens[start:end] for each (start, end) in ``bounds``"""
+    index = document_index(document)
+    starts = np.array([start for start, _ in bounds], dtype=np.int64).reshape(len(bounds))
+    ends = np.array([end for _, end in bounds], dtype=np.int64).reshape(len(bounds))
+    # every token before the final word reads as a sentence-internal word
+    finals = np.array([document.final_word(start, end) if end > start else start for start, end in bounds],
+                      dtype=np.int64).reshape(len(bounds))
+    inner_ends = np.maximum(finals, starts)
+    sums = (index.sums[inner_ends] - index.sums[starts]).tolist()
+    num_types, hapax = index.type_counts(starts, inner_ends)
+    num_types, hapax = num_types.tolist(), hapax.tolist()
+
+    counts = []
+    for i, (start, end) in enumerate(bounds):
+        if end > start:
+            # the final word ends a sentence wherever the segment is cut
+            final = int(finals[i])
+            word = word_properties(document.joined_word(final, last=True))
+            row = sums[i]
+            if word.lower is None:
+                row[5] += word.commas
+                row[6] += word.semicolons
+            else:
+                for column, value in enumerate((1, word.length, word.syllables, word.stopword, word.noun)):
+                    row[column] += value
+                seen = index.occurrences(word.lower, start, final)
+                num_types[i] += seen == 0
+                hapax[i] += 1 if seen == 0 else -1 if seen == 1 else 0
+        counts.append(RangeCounts(*sums[i], num_types[i], hapax[i]))
+    return counts
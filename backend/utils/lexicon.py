@@ -0,0 +1,110 @@
+"""Per-word-type lexical properties, memoized for the whole process
+
+Stylometric features only depend on what each word type contributes: its
+length, syllables, whether it is a stopword, a noun by suffix, and the
+commas and semicolons attached to it. Word frequencies follow a Zipfian
+distribution, so a few thousand types cover almost every token of any
+document; their properties are computed once and shared by every segment
+and request. The memo is bounded, so a stream of rare words cannot grow it
+without limit.
+"""
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from utils.nlp_resources import load_stopwords
+
+# stopwords are those of the language the tokenizer is set up for
+LANGUAGE = 'english'
+
+# distinct word types remembered; about 20 MB at most
+MAX_TYPES = 1 << 16
+
+# POS approximation using simple rules (without spaCy)
+NOUN_SUFFIXES = ('tion', 'ness', 'ment', 'ship', 'ity')
+
+_VOWELS = frozenset('aeiouy')
+
+
+class WordProperties(NamedTuple):
+    """What one token contributes to a segment's lexical counts
+
+    ``lower`` is None for tokens that are not alphabetic; they only count
+    their punctuation.
+    """
+    lower: Optional[str]
+    length: int
+    syllables: int
+    stopword: bool
+    noun: bool
+    commas: int
+    semicolons: int
+
+
+class LexicalCounts(NamedTuple):
+    words: int
+    length: int
+    syllables: int
+    stopwords: int
+    nouns: int
+    commas: int
+    semicolons: int
+    types: Dict[str, int]
+    hapax: int
+
+    @property
+    def num_types(self) -> int:
+        return len(self.types)
+
+
+def count_syllables(word: str) -> int:
+    """Simple syllable counter: vowel groups, less a final silent e, at least one"""
+    word = word.lower()
+    count = 0
+    previous_was_vowel = False
+    for char in word:
+        is_vowel = char in _VOWELS
+        if is_vowel and not previous_was_vowel:
+            count += 1
+        previous_was_vowel = is_vowel
+
+    if word.endswith('e'):
+        count -= 1
+    return max(count, 1)
+
+
+@lru_cache(maxsize=MAX_TYPES)
+def word_properties(word: str) -> WordProperties:
+    if not word.isalpha():
+        return WordProperties(None, 0, 0, False, False, word.count(','), word.count(';'))
+    lower = word.lower()
+    return WordProperties(lower, len(word), count_syllables(word), lower in load_stopwords(LANGUAGE),
+                          lower.endswith(NOUN_SUFFIXES), 0, 0)
+
+
+def lexical_counts(words: Iterable[str]) -> LexicalCounts:
+    """Lexical counts of a segment's tokens, computed once per distinct token"""
+    total = length = syllables = stopwords = nouns = commas = semicolons = 0
+    types = {}
+    for word, count in Counter(words).items():
+        lower, word_length, word_syllables, stopword, noun, word_commas, word_semicolons = word_properties(word)
+        if lower is None:
+            commas += count * word_commas
+            semicolons += count * word_semicolons
+            continue
+        total += count
+        length += count * word_length
+        syllables += count * word_syllables
+        if stopword:
+            stopwords += count
+        if noun:
+            nouns += count
+        types[lower] = types.get(lower, 0) + count
+
+    hapax = sum(1 for count in types.values() if count == 1)
+    return LexicalCounts(total, length, syllables, stopwords, nouns, commas, semicolons, types, hapax)
+
+
+def cache_stats() -> dict:
+    info = word_properties.cache_info()
+    return {'entries': info.currsize, 'max_entries': info.maxsize, 'hits': info.hits, 'misses': info.misses}
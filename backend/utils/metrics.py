@@ -0,0 +1,297 @@
+import bisect
+import contextvars
+import cProfile
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# default latency buckets in seconds, Prometheus style
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# stage -> seconds spent in it by the current request, when one is being timed
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: bucket counts (last one is +Inf), sum
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                labels = dict(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', {**labels, 'le': _format_value(bound)}, cumulative))
+                samples.append((f'{self.name}_sum', labels, total))
+                samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class Registry:
+    """Metrics rendered together in the Prometheus text format
+
+    Collectors are callables run at scrape time for values owned elsewhere,
+    such as cache statistics. Each returns ``(name, type, help, samples)``
+    tuples with samples as ``(labels, value)`` pairs.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict, float]]]]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(_sample_line(name, labels, value))
+
+        for collector in self._collectors:
+            for name, metric_type, help, samples in collector():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(_sample_line(name, labels, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'analysis_stage_duration_seconds',
+    'Time spent in each analysis stage per request',
+    ['stage']
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'http_request_duration_seconds',
+    'Time from receiving a request to the end of its response body',
+    ['method', 'path', 'status']
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    'llm_tokens_total',
+    'Tokens used by LLM calls as reported by the API',
+    ['kind']
+))
+LLM_CALLS = REGISTRY.register(Counter(
+    'llm_calls_total',
+    'LLM calls by outcome',
+    ['outcome']
+))
+LLM_CALLS_AVOIDED = REGISTRY.register(Counter(
+    'llm_calls_avoided_total',
+    'LLM calls not made: answered from the prompt cache or joined to an identical call in flight',
+    ['reason']
+))
+LLM_TOKENS_SAVED = REGISTRY.register(Counter(
+    'llm_tokens_saved_total',
+    'Tokens the avoided LLM calls would have used, as reported for the completion they reused',
+    ['kind']
+))
+REVISION_SEGMENTS = REGISTRY.register(Counter(
+    'revision_segments_total',
+    'Segments of revised documents, reused from the base revision or analyzed again',
+    ['outcome']
+))
+REVISION_EXPLANATIONS = REGISTRY.register(Counter(
+    'revision_explanations_total',
+    'Explanations of revised documents, reused from the base revision or generated',
+    ['outcome']
+))
+ANALYSES_REFUSED = REGISTRY.register(Counter(
+    'analyses_refused_total',
+    'Analyses refused by admission control, because the queue was full or the deadline passed while queued',
+    ['reason']
+))
+ANALYSIS_DEGRADATIONS = REGISTRY.register(Counter(
+    'analysis_degradations_total',
+    'Degradations applied to /analyze requests under load or to meet their deadline',
+    ['degradation']
+))
+
+
+def record_stage(stage: str, seconds: float):
+    """Record time spent in a stage, for /metrics and the request's Server-Timing"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] += seconds
+
+
+@contextmanager
+def timed(stage: str):
+    """Time the enclosed block as one run of ``stage``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_llm_usage(usage: Optional[Dict]):
+    """Count the tokens of one completion from the API's usage block"""
+    if not usage:
+        return
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        if usage.get(kind) is not None:
+            LLM_TOKENS.inc(usage[kind], kind=kind[:-len('_tokens')])
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Server-Timing header value, durations in milliseconds"""
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items())
+
+
+class TimingMiddleware:
+    """ASGI middleware timing every HTTP request
+
+    Stage timings recorded while a request runs are returned in its
+    Server-Timing header, added when the response starts; a streaming
+    response therefore only reports the stages that ran before its first
+    byte. Request latency is observed once the body has been sent.
+
+    With ``profile_dir`` set, a request sending ``X-Profile: 1`` is run
+    under cProfile and the stats are dumped to a file in that directory,
+    named in the ``X-Profile-Dump`` response header. The profiler sees the
+    whole event loop thread, so other requests served meanwhile show up too;
+    only one request is profiled at a time.
+    """
+
+    def __init__(self, app, profile_dir: Optional[str] = None):
+        self.app = app
+        self.profile_dir = profile_dir
+        self._profiling = threading.Lock()
+
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings = defaultdict(float)
+        token = _request_timings.set(timings)
+        status = 500
+
+        profiler = profile_path = None
+        if self.profile_dir and (b'x-profile', b'1') in scope.get('headers', []):
+            if self._profiling.acquire(blocking=False):
+                profiler = cProfile.Profile()
+                name = re.sub(r'[^A-Za-z0-9]+', '_', scope['path']).strip('_') or 'root'
+                profile_path = os.path.join(self.profile_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{id(timings):x}.prof')
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = list(message.get('headers', []))
+                elapsed = time.perf_counter() - start
+                header = server_timing({**timings, 'total': elapsed})
+                headers.append((b'server-timing', header.encode('latin-1')))
+                if profile_path:
+                    headers.append((b'x-profile-dump', os.path.basename(profile_path).encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            if profiler:
+                profiler.enable()
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if profiler:
+                profiler.disable()
+                try:
+                    profiler.dump_stats(profile_path)
+                except OSError as e:
+                    print(f"Profile dump error: {e}")
+                self._profiling.release()
+            _request_timings.reset(token)
+            # routes are labelled by their template, so /jobs/{job_id} is one series whatever
+            # the id; unmatched paths share one label so scanners cannot grow the series
+            route = scope.get('route')
+            path = route.path if route is not None else 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                    method=scope['method'], path=path, status=str(status))
+
+
+def _label_key(labelnames, labels):
+    return tuple((name, str(labels[name])) for name in labelnames)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return f'{value:.1f}'
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample_line(name, labels, value):
+    if labels:
+        rendered = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f'{name}{{{rendered}}} {_format_value(value)}'
+    return f'{name} {_format_value(value)}'
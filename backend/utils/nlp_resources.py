@@ -0,0 +1,159 @@
+"""NLTK resources loaded once per process, without network access
+
+Punkt, the stopword lists and the POS tagger are looked up in NLTK_DATA_DIR,
+then in the packaged ``backend/nltk_data`` directory, then on NLTK's usual
+search path.
+Nothing is downloaded implicitly; populate the packaged directory with
+
+    python -m utils.nlp_resources download
+
+``import nltk`` alone takes most of a second, so it is deferred until a
+resource is first needed. warm_up() loads everything up front: in the
+background after startup, or at import time before a pre-forking server
+forks its workers so they share the loaded tokenizer copy-on-write.
+"""
+import gc
+import os
+import sys
+import threading
+from typing import FrozenSet
+
+PACKAGED_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nltk_data')
+
+PACKAGES = ('punkt', 'stopwords', 'averaged_perceptron_tagger')
+
+TAGGER_MODEL = 'taggers/averaged_perceptron_tagger/averaged_perceptron_tagger.pickle'
+
+_lock = threading.RLock()
+_punkt = {}
+_stopwords = {}
+_word_tokenizer = None
+_tagger = None
+_configured = False
+
+
+def data_dirs():
+    """Directories searched before NLTK's default path"""
+    dirs = [os.environ.get('NLTK_DATA_DIR'), PACKAGED_DATA_DIR]
+    return [d for d in dirs if d and os.path.isdir(d)]
+
+
+def _nltk():
+    """Import nltk and put the configured data directories first on its path"""
+    global _configured
+    import nltk
+
+    if not _configured:
+        for path in reversed(data_dirs()):
+            if path not in nltk.data.path:
+                nltk.data.path.insert(0, path)
+        _configured = True
+    return nltk
+
+
+def _missing(resource, error):
+    return LookupError(
+        f"NLTK resource {resource!r} not found ({error.__class__.__name__}). "
+        f"Run 'python -m utils.nlp_resources download' or set NLTK_DATA_DIR."
+    )
+
+
+def load_punkt(language: str = 'english'):
+    """The punkt sentence tokenizer for ``language``, unpickled once"""
+    with _lock:
+        if language not in _punkt:
+            nltk = _nltk()
+            try:
+                _punkt[language] = nltk.data.load(f'tokenizers/punkt/{language}.pickle')
+            except LookupError as e:
+                raise _missing(f'tokenizers/punkt/{language}.pickle', e) from None
+        return _punkt[language]
+
+
+def word_tokenizer():
+    """The Treebank-style word tokenizer nltk.word_tokenize uses"""
+    global _word_tokenizer
+    with _lock:
+        if _word_tokenizer is None:
+            _nltk()
+            from nltk.tokenize import NLTKWordTokenizer
+            _word_tokenizer = NLTKWordTokenizer()
+        return _word_tokenizer
+
+
+def load_stopwords(language: str = 'english') -> FrozenSet[str]:
+    """Stopword list for ``language`` read straight from the corpus file"""
+    with _lock:
+        if language not in _stopwords:
+            nltk = _nltk()
+            try:
+                path = nltk.data.find(f'corpora/stopwords/{language}')
+            except LookupError as e:
+                raise _missing(f'corpora/stopwords/{language}', e) from None
+            with open(path, encoding='utf-8') as f:
+                _stopwords[language] = frozenset(line.strip() for line in f if line.strip())
+        return _stopwords[language]
+
+
+def pos_tagging_enabled() -> bool:
+    """Whether POS features come from the tagger; POS_TAGGING=0 turns it off"""
+    return os.environ.get('POS_TAGGING', '1') != '0'
+
+
+def load_tagger():
+    """NLTK's averaged perceptron POS tagger for English, unpickled once"""
+    global _tagger
+    with _lock:
+        if _tagger is None:
+            nltk = _nltk()
+            from nltk.tag.perceptron import PerceptronTagger
+            try:
+                path = nltk.data.find(TAGGER_MODEL)
+            except LookupError as e:
+                raise _missing(TAGGER_MODEL, e) from None
+            tagger = PerceptronTagger(load=False)
+            tagger.load(f'file:{path}')
+            _tagger = tagger
+        return _tagger
+
+
+def warm_up(language: str = 'english', freeze: bool = False):
+    """Load every resource and run each tokenizer once
+
+    Punkt compiles its regular expressions on first use, so a short text is
+    tokenized too. The POS tagger is loaded unless POS tagging is off or its
+    model is not installed. With ``freeze``, everything allocated so far is
+    moved out of the garbage collector's reach, so collections in forked
+    workers do not touch, and copy, the shared pages.
+    """
+    punkt = load_punkt(language)
+    load_stopwords(language)
+    tokenizer = word_tokenizer()
+    for sentence in punkt.tokenize("Warm up the tokenizer, e.g. Mr. Smith's text. It is done."):
+        tokenizer.tokenize(sentence)
+    if pos_tagging_enabled():
+        try:
+            load_tagger()
+        except LookupError:
+            # analyzers fall back to approximate POS features and say so
+            pass
+
+    if freeze:
+        gc.freeze()
+
+
+def download(target: str = PACKAGED_DATA_DIR):
+    """Download the resources into ``target``, the packaged directory by default"""
+    import nltk
+
+    os.makedirs(target, exist_ok=True)
+    for package in PACKAGES:
+        if not nltk.download(package, download_dir=target, quiet=True, raise_on_error=True):
+            raise RuntimeError(f"Failed to download NLTK package {package!r}")
+    print(f"NLTK resources in {target}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ['download']:
+        sys.exit("usage: python -m utils.nlp_resources download [target_dir]")
+    download(*sys.argv[2:3])
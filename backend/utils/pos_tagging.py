@@ -0,0 +1,231 @@
+"""Part-of-speech classes of a document's tokens for the stylometric features
+
+Every sentence of a document is tagged once with NLTK's averaged perceptron
+tagger, whatever the segment size or stride, and each segment reads its
+noun, verb, adjective and adverb counts off cumulative counts over the
+document's tokens. Tags only depend on the sentence, so tagged sentences
+are cached by a hash of their tokens: a document analyzed again, or one
+sharing sentences with an earlier one, is only tagged where it is new.
+"""
+import bisect
+import hashlib
+import threading
+from typing import List, Sequence
+
+import numpy as np
+
+from utils.cache import CacheLayer
+from utils.metrics import timed
+from utils.nlp_resources import load_tagger
+
+# coarse classes counted, by Penn Treebank tag prefix; 0 is every other tag
+POS_CLASSES = ('noun', 'verb', 'adj', 'adv')
+_TAG_CLASSES = {'NN': 1, 'VB': 2, 'JJ': 3, 'RB': 4}
+
+# tagged sentences remembered, about 150 bytes each
+MAX_CACHED_SENTENCES = 100000
+
+# the tagger's weights rearranged for batches, built once per process
+_batch_tagger = None
+_lock = threading.Lock()
+
+
+class POSTagger:
+    """Tags documents a sentence at a time, with a bounded cache of tagged sentences"""
+
+    def __init__(self, max_sentences: int = MAX_CACHED_SENTENCES):
+        self.cache = CacheLayer('pos_tags', max_sentences)
+
+    def tag_classes(self, sentences: Sequence[Sequence[str]]) -> List[bytes]:
+        """The class of every token of each sentence, one byte per token
+
+        Sentences missing from the cache are tagged in one pass, each
+        distinct sentence once.
+        """
+        keys = [_sentence_key(sentence) for sentence in sentences]
+        classes = [self.cache.get(key) for key in keys]
+
+        pending = {}
+        for i, key in enumerate(keys):
+            if classes[i] is None:
+                pending.setdefault(key, sentences[i])
+        if pending:
+            tagged = {}
+            for key, tags in zip(pending, self.batch_tagger.tag_sents(list(pending.values()))):
+                tagged[key] = bytes(_TAG_CLASSES.get(tag[:2], 0) for tag in tags)
+                self.cache.put(key, tagged[key])
+            classes = [tagged[key] if codes is None else codes for key, codes in zip(keys, classes)]
+        return classes
+
+    @property
+    def batch_tagger(self) -> 'BatchTagger':
+        global _batch_tagger
+        with _lock:
+            if _batch_tagger is None:
+                _batch_tagger = BatchTagger(load_tagger())
+            return _batch_tagger
+
+    def document_counts(self, document) -> np.ndarray:
+        """Cumulative counts of each POS class over a TokenizedDocument's alphabetic tokens
+
+        Row ``i`` counts ``tokens[:i]``, one column per POS_CLASSES entry.
+        Computed once per document and kept on it.
+        """
+        if document.pos_counts is None:
+            with timed('pos_tagging'):
+                counts = np.zeros((len(document) + 1, len(POS_CLASSES)), dtype=np.int64)
+                np.cumsum(self._class_counts(document, 0, len(document)), axis=0, out=counts[1:])
+            document.pos_counts = counts
+        return document.pos_counts
+
+    def revised_counts(self, document, base, edit) -> np.ndarray:
+        """document_counts of ``base`` revised by a TokenEdit, tagging only the sentences it touched"""
+        if document.pos_counts is None:
+            if base.pos_counts is None:
+                return self.document_counts(document)
+            with timed('pos_tagging'):
+                starts = document.sentence_starts
+                first = max(bisect.bisect_right(starts, edit.start) - 1, 0)
+                last = bisect.bisect_left(starts, edit.new_end)
+                start = starts[first] if starts else 0
+                end = starts[last] if last < len(starts) else len(document)
+
+                old = base.pos_counts
+                counts = np.empty((len(document) + 1, len(POS_CLASSES)), dtype=np.int64)
+                counts[:start + 1] = old[:start + 1]
+                np.cumsum(self._class_counts(document, start, end), axis=0, out=counts[start + 1:end + 1])
+                counts[start + 1:end + 1] += old[start]
+                # tokens after the edit keep their tags
+                counts[end + 1:] = old[end - edit.shift + 1:] - old[end - edit.shift] + counts[end]
+            document.pos_counts = counts
+        return document.pos_counts
+
+    def _class_counts(self, document, start, end):
+        """Which POS class each alphabetic token of the whole sentences tokens[start:end] falls in"""
+        tokens = document.tokens[start:end]
+        starts = document.sentence_starts
+        first, last = bisect.bisect_left(starts, start), bisect.bisect_left(starts, end)
+        bounds = [i - start for i in starts[first:last]] + [len(tokens)]
+        sentences = [tokens[a:b] for a, b in zip(bounds, bounds[1:])]
+        codes = np.frombuffer(b''.join(self.tag_classes(sentences)), dtype=np.uint8)
+        alpha = np.fromiter((token.isalpha() for token in tokens), dtype=bool, count=len(tokens))
+        return (codes[:, None] == np.arange(1, len(POS_CLASSES) + 1)) & alpha[:, None]
+
+    def segment_counts(self, segment) -> np.ndarray:
+        """Noun, verb, adjective and adverb counts of a SegmentView"""
+        counts = self.document_counts(segment.document)
+        return counts[segment.end] - counts[segment.start]
+
+
+class BatchTagger:
+    """NLTK's averaged perceptron tagger, decoding many sentences at once
+
+    Tags as PerceptronTagger.tag does. Its weights are held as one sparse
+    features x tags matrix. Most features of a token only depend on the
+    words around it, so those are scored for every token of every sentence
+    with one sparse product; decoding left to right then only adds the four
+    features built on the previous tags. Words the tagger knows to be
+    unambiguous are not scored at all.
+    """
+
+    def __init__(self, tagger):
+        self.tagdict = tagger.tagdict
+        self.normalize = tagger.normalize
+        # descending, so the first maximum is the alphabetically last tag, as in PerceptronTagger
+        self.tags = sorted(tagger.classes, reverse=True)
+        tag_index = {tag: i for i, tag in enumerate(self.tags)}
+
+        self.feature_index = {}
+        rows, columns, values = [], [], []
+        for feature, weights in tagger.model.weights.items():
+            row = self.feature_index.setdefault(feature, len(self.feature_index))
+            for tag, weight in weights.items():
+                rows.append(row)
+                columns.append(tag_index[tag])
+                values.append(weight)
+
+        from scipy.sparse import csr_matrix
+
+        self.weights = csr_matrix((values, (rows, columns)), shape=(len(self.feature_index), len(self.tags)))
+        self.weights.sum_duplicates()
+        # scores of the features on the two previous tags alone, by those tags
+        self._history = {}
+
+    def _history_scores(self, prev, prev2):
+        scores = np.zeros(len(self.tags))
+        for feature in ('i-1 tag ' + prev, 'i-2 tag ' + prev2, 'i tag+i-2 tag ' + prev + ' ' + prev2):
+            row = self.feature_index.get(feature)
+            if row is not None:
+                scores += self.weights[row].toarray()[0]
+        self._history[prev, prev2] = scores
+        return scores
+
+    def tag_sents(self, sentences: Sequence[Sequence[str]], batch_tokens: int = 8192) -> List[List[str]]:
+        """Tags of every token of each sentence, in batches of about ``batch_tokens`` tokens"""
+        tags = []
+        batch, size = [], 0
+        for sentence in sentences:
+            batch.append(sentence)
+            size += len(sentence)
+            if size >= batch_tokens:
+                tags.extend(self._tag_batch(batch))
+                batch, size = [], 0
+        if batch:
+            tags.extend(self._tag_batch(batch))
+        return tags
+
+    def _tag_batch(self, sentences):
+        from scipy.sparse import csr_matrix
+
+        tagdict, index = self.tagdict, self.feature_index
+        contexts = []
+        indptr, indices = [0], []
+        for sentence in sentences:
+            context = ['-START-', '-START2-'] + [self.normalize(w) for w in sentence] + ['-END-', '-END2-']
+            contexts.append(context)
+            for i, word in enumerate(sentence):
+                if word in tagdict:
+                    continue
+                i += 2
+                for feature in ('bias', 'i suffix ' + word[-3:], 'i pref1 ' + word[:1], 'i word ' + context[i],
+                                'i-1 word ' + context[i - 1], 'i-1 suffix ' + context[i - 1][-3:],
+                                'i-2 word ' + context[i - 2], 'i+1 word ' + context[i + 1],
+                                'i+1 suffix ' + context[i + 1][-3:], 'i+2 word ' + context[i + 2]):
+                    row = index.get(feature)
+                    if row is not None:
+                        indices.append(row)
+                indptr.append(len(indices))
+
+        static = csr_matrix((np.ones(len(indices)), indices, indptr),
+                            shape=(len(indptr) - 1, len(index))) @ self.weights
+        static = static.toarray()
+
+        tags = self.tags
+        weights_indptr, weights_indices, weights_data = self.weights.indptr, self.weights.indices, self.weights.data
+        results = []
+        scored = 0
+        for sentence, context in zip(sentences, contexts):
+            prev, prev2 = '-START-', '-START2-'
+            sentence_tags = []
+            for i, word in enumerate(sentence):
+                tag = tagdict.get(word)
+                if not tag:
+                    history = self._history.get((prev, prev2))
+                    if history is None:
+                        history = self._history_scores(prev, prev2)
+                    scores = static[scored]
+                    scored += 1
+                    scores += history
+                    row = index.get('i-1 tag+i word ' + prev + ' ' + context[i + 2])
+                    if row is not None:
+                        start, end = weights_indptr[row], weights_indptr[row + 1]
+                        scores[weights_indices[start:end]] += weights_data[start:end]
+                    tag = tags[scores.argmax()]
+                sentence_tags.append(tag)
+                prev2, prev = prev, tag
+            results.append(sentence_tags)
+        return results
+
+
+def _sentence_key(tokens: Sequence[str]) -> str:
+    return hashlib.blake2b('\0'.join(tokens).encode('utf-8'), digest_size=16).hexdigest()
@@ -0,0 +1,163 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+# below this many rows a scan of every vector is as fast as probing lists
+MIN_ROWS_FOR_LISTS = 4096
+
+
+class ProfileIndex:
+    """Memory-mapped unit vectors searchable by cosine similarity
+
+    An inverted-file index: the vectors are clustered with k-means and stored
+    grouped by cluster, so a query scores the cluster centroids and then only
+    the vectors of the ``n_probe`` closest clusters, about
+    ``n_probe / n_lists`` of the catalogue. Results are approximate; a larger
+    ``n_probe`` trades speed for recall, and probing every list is exact.
+
+    Each row may carry a fixed-size float vector of extra data, and the
+    directory holds free-form metadata alongside. Files are plain .npy and
+    JSON and are opened memory-mapped, so opening a large index is instant
+    and only the probed parts are read.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported profile index format {self.meta.get('format_version')!r} in {directory}")
+        with open(os.path.join(directory, 'ids.json'), encoding='utf-8') as f:
+            self.ids: List[str] = json.load(f)
+
+        self.vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+        self.extra = np.load(os.path.join(directory, 'extra.npy'), mmap_mode='r')
+        # small enough to keep in memory
+        self.centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        self._rows = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def default_n_probe(self) -> int:
+        return self.meta['default_n_probe']
+
+    def row(self, id: str) -> Optional[int]:
+        if self._rows is None:
+            self._rows = {id: row for row, id in enumerate(self.ids)}
+        return self._rows.get(id)
+
+    def search(self, query: np.ndarray, k: int = 10, n_probe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Rows of the ``k`` vectors most similar to ``query``, best first, with their similarity"""
+        query = _unit(np.asarray(query, dtype=np.float32))
+        n_probe = min(n_probe or self.default_n_probe, self.n_lists)
+
+        if n_probe == self.n_lists:
+            rows = np.arange(len(self))
+            similarities = np.asarray(self.vectors @ query)
+        else:
+            closest = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+            # contiguous reads, in file order
+            closest.sort()
+            rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in closest])
+            similarities = np.concatenate([self.vectors[self.offsets[i]:self.offsets[i + 1]] @ query
+                                           for i in closest])
+
+        k = min(k, len(rows))
+        if k == 0:
+            return []
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind='stable')]
+        return [(int(rows[i]), float(similarities[i])) for i in top]
+
+    @classmethod
+    def build(cls, directory: str, ids: Sequence[str], vectors: np.ndarray, extra: Optional[np.ndarray] = None,
+              meta: Optional[Dict] = None, n_lists: Optional[int] = None, n_probe: Optional[int] = None,
+              seed: int = 0) -> 'ProfileIndex':
+        """Cluster ``vectors`` and write the index to ``directory``, replacing any index there
+
+        Vectors are normalized to unit length. ``n_lists`` defaults to about
+        2 * sqrt(rows), with one list, an exhaustive scan, for small catalogues.
+        """
+        if len(set(ids)) != len(ids):
+            raise ValueError("Profile ids must be unique")
+        vectors = _unit(np.asarray(vectors, dtype=np.float32))
+        if len(vectors) != len(ids):
+            raise ValueError("Expected one vector per id")
+        extra = np.zeros((len(ids), 0), dtype=np.float32) if extra is None else np.asarray(extra, dtype=np.float32)
+
+        if n_lists is None:
+            n_lists = 1 if len(ids) < MIN_ROWS_FOR_LISTS else round(2 * math.sqrt(len(ids)))
+        n_lists = max(1, min(n_lists, len(ids)))
+        if n_probe is None:
+            n_probe = n_lists if n_lists == 1 else max(1, round(n_lists / 16))
+
+        centroids, assignment = _cluster(vectors, n_lists, seed)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))]).astype(np.int64)
+
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        # write everything next to the target, then swap directories
+        staging = tempfile.mkdtemp(prefix='.profile-index-', dir=parent)
+        try:
+            np.save(os.path.join(staging, 'vectors.npy'), vectors[order])
+            np.save(os.path.join(staging, 'extra.npy'), extra[order])
+            np.save(os.path.join(staging, 'centroids.npy'), centroids)
+            np.save(os.path.join(staging, 'offsets.npy'), offsets)
+            with open(os.path.join(staging, 'ids.json'), 'w', encoding='utf-8') as f:
+                json.dump([ids[i] for i in order], f)
+            with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({**(meta or {}), 'format_version': FORMAT_VERSION, 'rows': len(ids),
+                           'dimensions': vectors.shape[1], 'default_n_probe': n_probe}, f, indent=2)
+
+            if os.path.exists(directory):
+                retired = staging + '-old'
+                os.rename(directory, retired)
+                os.rename(staging, directory)
+                shutil.rmtree(retired)
+            else:
+                os.rename(staging, directory)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        return cls(directory)
+
+
+def _unit(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _cluster(vectors, n_lists, seed):
+    """Spherical k-means centroids and the closest centroid of every vector"""
+    if n_lists == 1:
+        return _unit(vectors.mean(axis=0, keepdims=True)), np.zeros(len(vectors), dtype=np.int64)
+
+    from sklearn.cluster import MiniBatchKMeans
+
+    rng = np.random.default_rng(seed)
+    # a few hundred vectors per list are plenty to place the centroids
+    sample_size = min(len(vectors), 256 * n_lists)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    kmeans = MiniBatchKMeans(n_clusters=n_lists, batch_size=4096, n_init=3, random_state=seed)
+    centroids = _unit(kmeans.fit(sample).cluster_centers_.astype(np.float32))
+
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), 8192):
+        assignment[start:start + 8192] = np.argmax(vectors[start:start + 8192] @ centroids.T, axis=1)
+    return centroids, assignment
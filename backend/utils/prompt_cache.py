@@ -0,0 +1,111 @@
+"""Completions of identical LLM prompts, shared instead of requested again
+
+Explanation prompts are built from a few numbers and the start of the first
+segment, so unrelated requests often send the same prompt. A completion is
+kept for ``ttl`` seconds under a hash of the model, the sampling
+parameters and the prompt. Identical prompts sent while the first is still
+waiting for its answer join that call instead of making their own
+(single flight), in the event loop and across threads alike. Every call
+avoided is counted, with the tokens its original call used.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from utils.cache import CacheLayer
+from utils.metrics import LLM_CALLS_AVOIDED, LLM_TOKENS_SAVED
+
+# a completion's text and the usage block its call reported
+Completion = Tuple[str, Optional[Dict[str, Any]]]
+
+
+class PromptCache:
+    """TTL and LRU bounded completions by prompt, with single-flight calls"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0):
+        self.cache = CacheLayer('llm_prompts', max_entries, ttl=ttl)
+        self._tasks: Dict[str, asyncio.Future] = {}
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, prompt: str, **params) -> str:
+        """Cache key of a prompt sent to ``model`` with the given sampling parameters"""
+        payload = json.dumps({'model': model, 'prompt': prompt, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def complete_async(self, key: str, call: Callable[[], Awaitable[Completion]]) -> str:
+        """The completion stored under ``key``, awaiting ``call()`` only if no identical call is in flight
+
+        The call runs as its own task, so a caller that gives up does not
+        cancel it for the others waiting on it.
+        """
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        task = self._tasks.get(key)
+        coalesced = task is not None
+        if not coalesced:
+            task = self._tasks[key] = asyncio.ensure_future(self._store_async(key, call))
+            task.add_done_callback(lambda done: self._finish_task(key, done))
+        content, usage = await asyncio.shield(task)
+        if coalesced:
+            self._saved('coalesced', usage)
+        return content
+
+    def complete(self, key: str, call: Callable[[], Completion]) -> str:
+        """Blocking variant of complete_async for calls made from threads"""
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = self._futures[key] = Future()
+        if not leader:
+            content, usage = future.result()
+            self._saved('coalesced', usage)
+            return content
+
+        try:
+            completion = call()
+            self.cache.put(key, completion)
+            future.set_result(completion)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._futures[key]
+        return completion[0]
+
+    def _cached(self, key):
+        completion = self.cache.get(key)
+        if completion is None:
+            return None
+        self._saved('cache', completion[1])
+        return completion[0]
+
+    async def _store_async(self, key, call):
+        completion = await call()
+        self.cache.put(key, completion)
+        return completion
+
+    def _finish_task(self, key, task):
+        self._tasks.pop(key, None)
+        # failures are raised to the callers still waiting; mark them retrieved for the others
+        if not task.cancelled():
+            task.exception()
+
+    def _saved(self, reason, usage):
+        """Count a call avoided and the tokens the call it reused reported"""
+        LLM_CALLS_AVOIDED.inc(reason=reason)
+        for kind in ('prompt_tokens', 'completion_tokens'):
+            if usage and usage.get(kind):
+                LLM_TOKENS_SAVED.inc(usage[kind], kind=kind[:-len('_tokens')])
@@ -1,5 +1,8 @@
 import re
-from typing import List
+from typing import Iterable, Iterator, List
+
+# the last whitespace of a text and what follows it
+_LAST_SPACE = re.compile(r'\s\S*$')
 
 class TextPreprocessor:
     def __init__(self):
@@ -35,4 +38,28 @@ class TextPreprocessor:
         text = self.clean_text(text)
         text = self.normalize_whitespace(text)
         
-        return text
\ No newline at end of file
+        return text
+    
+    def preprocess_chunks(self, chunks: Iterable[str], remove_urls: bool = False) -> Iterator[str]:
+        """preprocess over a text read in chunks, never holding all of it
+        
+        Each chunk is processed up to its last whitespace and the rest carried
+        into the next, so no word or URL is split. The pieces yielded,
+        concatenated, equal preprocess of the whole text.
+        """
+        carry = ''
+        started = False
+        for chunk in chunks:
+            text = carry + chunk
+            match = _LAST_SPACE.search(text)
+            if match is None:
+                carry = text
+                continue
+            carry = text[match.start() + 1:]
+            piece = self.preprocess(text[:match.start() + 1], remove_urls)
+            if piece:
+                yield ' ' + piece if started else piece
+                started = True
+        piece = self.preprocess(carry, remove_urls)
+        if piece:
+            yield ' ' + piece if started else piece
@@ -0,0 +1,562 @@
+import bisect
+import re
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from utils.nlp_resources import load_punkt, word_tokenizer
+
+# the word tokenizer rewrites double quotes as `` and ''
+_QUOTE_TOKENS = {'``', "''", '"'}
+_QUOTE_PATTERN = re.compile(r'``|\'\'|"')
+
+# word_tokenize splits the period off the last token of every sentence
+_FINAL_PERIOD = re.compile(r'[^.]\.$')
+
+# endings word_tokenize splits off a token only when a space follows, as one always
+# does in a joined segment; before a line break they stay on the token
+_SPACED_ENDING = re.compile(r"(?<=[^' ])(?:'[sSmMdD]?|'ll|'LL|'re|'RE|'ve|'VE|n't|N'T)$")
+
+# closing brackets and quotes word_tokenize lets follow the period it splits off a
+# sentence; a '' token that does not start its sentence reads as `` again instead
+_CLOSING = re.compile(r"[\]\)}>'\u00bb\u201d\u2019]+$")
+
+# closing punctuation punkt moves back onto the end of the previous sentence
+_CLOSER = re.compile(r'["\')\]}]+$')
+
+# characters compared at a time when looking for the edited part of a text
+_COMPARE_BLOCK = 4096
+
+
+class TokenEdit(NamedTuple):
+    """Tokens of a document that TokenizedDocument.revise tokenized again
+
+    ``tokens[start:old_end]`` of the old document became
+    ``tokens[start:new_end]`` of the new one; the tokens on either side are
+    the same, in the same original and joined sentences.
+    """
+    start: int
+    old_end: int
+    new_end: int
+
+    @property
+    def shift(self) -> int:
+        """How far tokens after the edit moved"""
+        return self.new_end - self.old_end
+
+
+class TokenizedDocument:
+    """Sentence and word tokenization of a document, computed once
+
+    ``tokens`` are identical to ``word_tokenize(text)``: the text is split into
+    sentences with punkt and each sentence is word tokenized. Every token keeps
+    its character offsets into the original text (``offsets``, one
+    start, end row per token), ``sentence_starts`` holds
+    the index of the first token of each sentence and ``sentence_offsets``
+    the character offset where punkt starts it.
+
+    Segments are the space-joined token strings of fixed-size windows, so
+    their sentences are those punkt finds in the joined tokens rather than in
+    the original text. ``segment_breaks`` records those boundaries for the whole
+    joined token stream, which lets every window be featurized as a view
+    without rebuilding its string and tokenizing it again.
+    """
+
+    def __init__(self, text: str, language: str = 'english'):
+        self.text = text
+        self.language = language
+
+        sent_tokenizer = load_punkt(language)
+        self.tokens, self.offsets, self.sentence_starts, self.sentence_offsets = _split_sentences(
+            text, 0, len(text), sent_tokenizer
+        )
+        self.segment_breaks = _joined_sentence_starts(sent_tokenizer, self.tokens)
+        # cumulative POS class counts, filled in by utils.pos_tagging when needed
+        self.pos_counts = None
+        # cumulative lexical counts, filled in by utils.feature_index when needed
+        self.feature_index = None
+        # tokens a joined segment splits in two, found on first use
+        self._spaced_endings = None
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    @property
+    def num_sentences(self) -> int:
+        return len(self.sentence_starts)
+
+    def view(self, start: int = 0, end: int = None) -> 'SegmentView':
+        """Return a view over tokens[start:end] using the original sentences"""
+        return SegmentView(self, start, self._clip(end), joined=False)
+
+    def segment(self, start: int, end: int) -> 'SegmentView':
+        """Return the segment tokens[start:end] as its joined string reads"""
+        return SegmentView(self, start, self._clip(end), joined=True)
+
+    def windows(self, size: int, stride: Optional[int] = None) -> Iterator['SegmentView']:
+        """Yield segments of ``size`` tokens starting every ``stride`` tokens
+
+        Without a stride the segments are consecutive and the last one may be
+        short. With one, every window is full size and a final window aligned
+        to the end of the document covers the tokens the stride steps over.
+        """
+        if stride is None:
+            for start in range(0, len(self.tokens), size):
+                yield self.segment(start, start + size)
+            return
+
+        last = max(len(self.tokens) - size, 0)
+        for start in range(0, last + 1, stride):
+            yield self.segment(start, start + size)
+        if last % stride:
+            yield self.segment(last, last + size)
+
+    def joined_word(self, index: int, last: bool = False) -> str:
+        """Token ``index`` as word tokenizing its segment leaves it
+
+        Word tokenization splits the period off the final token of every
+        sentence of the joined string; ``last`` marks the final token of a
+        segment, which ends a sentence wherever the segment is cut. Only
+        closing brackets and quotes may come between the token and the end of
+        its sentence. A token that kept a quote or contraction ending before
+        a line break loses it too; the ending is never a word, so only the
+        rest is returned.
+        """
+        token = self.tokens[index]
+        if _FINAL_PERIOD.search(token):
+            end = index + 1
+            while end < len(self.tokens) and _closing(self.tokens[end]) and not _contains(self.segment_breaks, end):
+                end += 1
+            if last or end == len(self.tokens) or _contains(self.segment_breaks, end):
+                token = token[:-1]
+        return _SPACED_ENDING.sub('', token)
+
+    def final_word(self, start: int, end: int) -> int:
+        """Index of the token that ends the joined segment tokens[start:end] as a sentence
+
+        That is its last token, or the one before the closing brackets and
+        quotes the segment ends on; the tokens after it are never words.
+        """
+        final = end - 1
+        while final > start and _closing(self.tokens[final]) and not _contains(self.segment_breaks, final):
+            final -= 1
+        return final
+
+    def spaced_endings(self) -> List[int]:
+        """Indices of the tokens that a joined segment splits in two, as words() does"""
+        if self._spaced_endings is None:
+            self._spaced_endings = [i for i, token in enumerate(self.tokens)
+                                    if "'" in token and _SPACED_ENDING.search(token)]
+        return self._spaced_endings
+
+    def revise(self, text: str) -> Tuple['TokenizedDocument', TokenEdit]:
+        """Tokenize an edited version of the text, redoing only the part around the edit
+
+        Punkt decides every sentence break from the tokens on either side of
+        it, so only the sentences from one before the changed characters to
+        one after them are split and word tokenized again, and likewise the
+        sentence breaks of the joined tokens. Tokens elsewhere are carried
+        over, their offsets shifted past the edit. The result is the same as
+        tokenizing ``text`` from scratch; the edit reports which tokens were
+        redone.
+        """
+        old = self.text
+        if not self.tokens or not text.strip():
+            document = TokenizedDocument(text, self.language)
+            return document, TokenEdit(0, len(self.tokens), len(document.tokens))
+
+        limit = min(len(old), len(text))
+        prefix = _common_prefix(old, text, limit)
+        suffix = _common_suffix(old, text, limit - prefix)
+        return self._retokenized(text, prefix, len(old) - suffix, len(text) - len(old))
+
+    @classmethod
+    def join(cls, text: str, parts: List[Tuple[int, 'TokenizedDocument']]) -> 'TokenizedDocument':
+        """Tokenization of ``text`` from the tokenizations of consecutive stretches of it
+
+        ``parts`` are (offset, document) pairs in order, each document
+        tokenizing the text from its offset up to the next one's. Every
+        stretch ends a sentence where it was cut, so the sentences on either
+        side of each seam are split again as revise splits them around an
+        edit. The result is the same as tokenizing ``text`` whole.
+        """
+        document = cls.__new__(cls)
+        document.text = text
+        document.language = parts[0][1].language if parts else 'english'
+        document.tokens, document.sentence_starts, document.sentence_offsets = [], [], []
+        document.segment_breaks = []
+        document.pos_counts = None
+        document.feature_index = None
+        document._spaced_endings = None
+        offsets, seams = [], []
+        for offset, part in parts:
+            if not part.tokens:
+                continue
+            base = len(document.tokens)
+            seams.append((offset, base))
+            document.tokens.extend(part.tokens)
+            offsets.append(part.offsets + offset)
+            document.sentence_starts.extend(base + i for i in part.sentence_starts)
+            document.sentence_offsets.extend(offset + i for i in part.sentence_offsets)
+            document.segment_breaks.extend(base + i for i in part.segment_breaks)
+        document.offsets = np.concatenate(offsets) if offsets else np.empty((0, 2), dtype=np.int64)
+
+        shift = 0
+        for offset, token in seams[1:]:
+            document, edit = document._retokenized(text, offset, offset, 0, seam=token + shift)
+            shift += edit.shift
+        return document
+
+    def excerpt(self, start: int, end: int) -> Tuple[int, 'TokenizedDocument']:
+        """The sentences holding tokens[start:end] as a document of their own
+
+        Returns the index of its first token in this document and the
+        excerpt, which keeps this document's sentence breaks and tagged POS
+        counts rather than computing them again: a segment of the excerpt
+        reads as the same tokens of this document do. Sent to a worker
+        instead of the whole document.
+        """
+        starts = self.sentence_starts
+        first = max(bisect.bisect_right(starts, start) - 1, 0)
+        last = bisect.bisect_left(starts, end)
+        token_start = starts[first] if starts else 0
+        token_end = starts[last] if last < len(starts) else len(self.tokens)
+        char_start = self.sentence_offsets[first] if starts else 0
+        char_end = self.sentence_offsets[last] if last < len(starts) else len(self.text)
+
+        document = TokenizedDocument.__new__(TokenizedDocument)
+        document.text = self.text[char_start:char_end]
+        document.language = self.language
+        document.tokens = self.tokens[token_start:token_end]
+        document.offsets = self.offsets[token_start:token_end] - char_start
+        document.sentence_starts = [i - token_start for i in starts[first:last]]
+        document.sentence_offsets = [offset - char_start for offset in self.sentence_offsets[first:last]]
+        breaks = self.segment_breaks
+        document.segment_breaks = [i - token_start for i in breaks[bisect.bisect_left(breaks, token_start):
+                                                                  bisect.bisect_left(breaks, token_end)]]
+        document.pos_counts = None
+        document.feature_index = None
+        document._spaced_endings = None
+        if self.pos_counts is not None:
+            document.pos_counts = self.pos_counts[token_start:token_end + 1] - self.pos_counts[token_start]
+        return token_start, document
+
+    def _retokenized(self, text, start, end, delta, seam=None):
+        """revise once the changed characters are known: ``self.text[start:end]``
+        became ``text[start:end + delta]``
+
+        ``seam`` is a token index the joined sentence breaks are split again
+        around even if no token changed.
+        """
+        old = self.text
+        sent_tokenizer = load_punkt(self.language)
+
+        # sentences split again, with a sentence of context on either side
+        first = max(bisect.bisect_right(self.sentence_offsets, start) - 2, 0)
+        last = bisect.bisect_right(self.sentence_offsets, max(start, end - 1)) + 1
+        char_start = self.sentence_offsets[first]
+        char_end = self.sentence_offsets[last] if last < self.num_sentences else len(old)
+        token_start = self.sentence_starts[first]
+        token_end = self.sentence_starts[last] if last < self.num_sentences else len(self.tokens)
+
+        tokens, offsets, sentence_starts, sentence_offsets = _split_sentences(
+            text, char_start, char_end + delta, sent_tokenizer
+        )
+        shift = len(tokens) - (token_end - token_start)
+
+        document = TokenizedDocument.__new__(TokenizedDocument)
+        document.text = text
+        document.language = self.language
+        document.tokens = self.tokens[:token_start] + tokens + self.tokens[token_end:]
+        document.offsets = np.concatenate([self.offsets[:token_start], offsets, self.offsets[token_end:] + delta])
+        document.sentence_starts = (self.sentence_starts[:first] + [token_start + i for i in sentence_starts]
+                                    + [i + shift for i in self.sentence_starts[last:]])
+        document.sentence_offsets = (self.sentence_offsets[:first] + sentence_offsets
+                                     + [offset + delta for offset in self.sentence_offsets[last:]])
+        document.pos_counts = None
+        document.feature_index = None
+        document._spaced_endings = None
+
+        # tokens that changed, which the joined sentence breaks are redone around
+        same_before = _common_prefix(self.tokens[token_start:token_end], tokens, min(token_end - token_start, len(tokens)))
+        same_after = _common_suffix(self.tokens[token_start:token_end], tokens,
+                                    min(token_end - token_start, len(tokens)) - same_before)
+        changed_start = token_start + same_before
+        changed_end = max(changed_start, token_end - same_after - 1)
+        if seam is not None:
+            changed_start, changed_end = min(changed_start, seam), max(changed_end, seam)
+
+        breaks = self.segment_breaks
+        break_first = max(bisect.bisect_right(breaks, changed_start) - 2, 0)
+        break_last = bisect.bisect_right(breaks, changed_end) + 1
+        joined_start = breaks[break_first]
+        joined_end = breaks[break_last] if break_last < len(breaks) else len(self.tokens)
+        document.segment_breaks = (
+            breaks[:break_first]
+            + [joined_start + i for i in _joined_sentence_starts(
+                sent_tokenizer, document.tokens[joined_start:joined_end + shift])]
+            + [i + shift for i in breaks[break_last:]]
+        )
+
+        start, old_end = min(token_start, joined_start), max(token_end, joined_end)
+        return document, TokenEdit(start, old_end, old_end + shift)
+
+    def _clip(self, end):
+        if end is None or end > len(self.tokens):
+            return len(self.tokens)
+        return end
+
+class StreamingTokenizer:
+    """Tokenization of a text fed in pieces, holding only the tokens still needed
+
+    Each piece is tokenized on its own and joined to the tokens held so far
+    (TokenizedDocument.join). Tokens, their sentences and the joined
+    sentence breaks are final once no later piece can change them; so
+    does tokenizing the whole text at once, once the text is complete.
+    Positions are token and character offsets from the start of the
+    stream; ``document`` holds the tokens from ``token_offset`` on.
+    """
+
+    def __init__(self, language: str = 'english'):
+        self.document = TokenizedDocument('', language)
+        self.token_offset = 0
+        self.char_offset = 0
+
+    def __len__(self) -> int:
+        return self.token_offset + len(self.document)
+
+    def feed(self, text: str):
+        """Append a piece of the text"""
+        document = self.document
+        part = TokenizedDocument(text, document.language)
+        self.document = TokenizedDocument.join(document.text + text, [(0, document), (len(document.text), part)])
+
+    def settled(self) -> int:
+        """Tokens before this position keep their tokenization whatever is fed next
+
+        The next piece splits again the last two sentences and the joined
+        sentences around them.
+        """
+        document = self.document
+        if document.num_sentences < 2:
+            return self.token_offset
+        breaks = document.segment_breaks
+        i = bisect.bisect_right(breaks, document.sentence_starts[-2]) - 3
+        return self.token_offset + (breaks[i] if i >= 0 else 0)
+
+    def segment(self, start: int, end: int) -> 'SegmentView':
+        """The segment of stream tokens [start, end), valid until the next feed or release"""
+        return self.document.segment(start - self.token_offset, end - self.token_offset)
+
+    def char_span(self, segment: 'SegmentView') -> Tuple[int, int]:
+        """Character offsets of a segment in the whole text"""
+        start, end = segment.char_span
+        return (self.char_offset + start, self.char_offset + end)
+
+    def release(self, index: int):
+        """Forget the tokens before stream position ``index``, which are no longer needed
+
+        Whole sentences and joined sentences are kept, so later pieces
+        still join as if nothing had been forgotten.
+        """
+        document = self.document
+        start = min(max(index - self.token_offset, 0), len(document))
+        breaks = document.segment_breaks
+        i = bisect.bisect_right(breaks, start) - 1
+        if i >= 0:
+            start = breaks[i]
+        if start == 0:
+            return
+        token_start, excerpt = document.excerpt(start, len(document))
+        self.token_offset += token_start
+        self.char_offset += len(document.text) - len(excerpt.text)
+        self.document = excerpt
+
+class SegmentView:
+    """A contiguous token range of a TokenizedDocument"""
+
+    __slots__ = ('document', 'start', 'end', 'joined')
+
+    def __init__(self, document: TokenizedDocument, start: int, end: int, joined: bool = True):
+        self.document = document
+        self.start = start
+        self.end = end
+        self.joined = joined
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self) -> str:
+        return f'SegmentView(start={self.start}, end={self.end})'
+
+    @property
+    def tokens(self) -> List[str]:
+        return self.document.tokens[self.start:self.end]
+
+    @property
+    def text(self) -> str:
+        """Segment as the space-joined token string"""
+        return ' '.join(self.tokens)
+
+    @property
+    def char_span(self) -> Tuple[int, int]:
+        """Character offsets of the segment in the original text"""
+        if self.start >= self.end:
+            return (0, 0)
+        offsets = self.document.offsets
+        return (int(offsets[self.start, 0]), int(offsets[self.end - 1, 1]))
+
+    def words(self) -> List[str]:
+        """Tokens as word tokenizing the segment yields them"""
+        tokens = self.tokens
+        if not self.joined:
+            return tokens
+
+        # a sentence of the joined string may end on an abbreviation such as
+        # "etc." that kept its period in the original text, and a token may
+        # have kept a quote or contraction ending before a line break
+        splits = []
+        pos = self.start
+        for stop in self._sentence_stops():
+            final = self.document.final_word(pos, stop)
+            if _FINAL_PERIOD.search(tokens[final - self.start]):
+                splits.append(final)
+            # closing quotes other than the first token of a sentence read as opening ones
+            for i in range(pos + 1 - self.start, stop - self.start):
+                if tokens[i] == "''":
+                    tokens[i] = '``'
+            pos = stop
+        spaced = self.document.spaced_endings()
+        splits += spaced[bisect.bisect_left(spaced, self.start):bisect.bisect_left(spaced, self.end)]
+        for i in sorted(splits, reverse=True):
+            token = tokens[i - self.start]
+            split = len(token) - 1 if _FINAL_PERIOD.search(token) else _SPACED_ENDING.search(token).start()
+            tokens[i - self.start:i - self.start + 1] = [token[:split], token[split:]]
+        return tokens
+
+    def sentence_lengths(self) -> List[int]:
+        """Token counts of each sentence in the segment, consistent with words()"""
+        lengths = []
+        pos = self.start
+        spaced = self.document.spaced_endings() if self.joined else []
+        for stop in self._sentence_stops():
+            length = stop - pos
+            if self.joined:
+                if _FINAL_PERIOD.search(self.document.tokens[self.document.final_word(pos, stop)]):
+                    length += 1
+                length += bisect.bisect_left(spaced, stop) - bisect.bisect_left(spaced, pos)
+            lengths.append(length)
+            pos = stop
+
+        return lengths
+
+    def _sentence_stops(self) -> List[int]:
+        """End token index of every sentence, clipped to the segment bounds"""
+        if self.start >= self.end:
+            return []
+
+        tokens = self.document.tokens
+        starts = self.document.segment_breaks if self.joined else self.document.sentence_starts
+        first = bisect.bisect_right(starts, self.start)
+        last = bisect.bisect_left(starts, self.end)
+
+        stops = []
+        for boundary in starts[first:last]:
+            if self.joined and not stops:
+                # a boundary only exists if the token that ended the sentence
+                # is inside the segment; closing quotes and brackets moved
+                # onto the previous sentence do not end it on their own
+                trigger = boundary - 1
+                if _CLOSER.match(tokens[trigger]):
+                    trigger -= 1
+                if trigger < self.start:
+                    continue
+            stops.append(boundary)
+        stops.append(self.end)
+
+        return stops
+
+
+def _split_sentences(text: str, start: int, end: int, sent_tokenizer):
+    """Tokens of text[start:end] with their offsets, and the first token and
+    character offset of each sentence"""
+    # same word tokenizer configuration nltk.word_tokenize uses
+    words = word_tokenizer()
+    tokens, offsets, sentence_starts, sentence_offsets = [], [], [], []
+    for sent_start, sent_end in sent_tokenizer.span_tokenize(text[start:end]):
+        sentence = text[start + sent_start:start + sent_end]
+        sentence_tokens = words.tokenize(sentence)
+        sentence_starts.append(len(tokens))
+        sentence_offsets.append(start + sent_start)
+        tokens.extend(sentence_tokens)
+        offsets.extend(_align_tokens(sentence, sentence_tokens, start + sent_start))
+    return tokens, np.array(offsets, dtype=np.int64).reshape(-1, 2), sentence_starts, sentence_offsets
+
+
+def _joined_sentence_starts(sent_tokenizer, tokens: List[str]) -> List[int]:
+    """Token indices where punkt starts a sentence in the joined tokens"""
+    positions = []
+    pos = 0
+    for token in tokens:
+        positions.append(pos)
+        pos += len(token) + 1
+
+    joined = ' '.join(tokens)
+    return [bisect.bisect_left(positions, start)
+            for start, _ in sent_tokenizer.span_tokenize(joined)]
+
+
+def _common_prefix(a, b, limit: int) -> int:
+    """Length of the common prefix of two strings or lists, at most ``limit``"""
+    n = 0
+    while n < limit:
+        # slices compare at C speed; only a differing block is scanned item by item
+        block = min(n + _COMPARE_BLOCK, limit)
+        if a[n:block] != b[n:block]:
+            while a[n] == b[n]:
+                n += 1
+            return n
+        n = block
+    return limit
+
+
+def _common_suffix(a, b, limit: int) -> int:
+    """Length of the common suffix of two strings or lists, at most ``limit``"""
+    n = 0
+    while n < limit:
+        block = min(n + _COMPARE_BLOCK, limit)
+        if a[len(a) - block:len(a) - n] != b[len(b) - block:len(b) - n]:
+            while a[len(a) - n - 1] == b[len(b) - n - 1]:
+                n += 1
+            return n
+        n = block
+    return limit
+
+
+def _closing(token: str) -> bool:
+    return token != "''" and _CLOSING.match(token) is not None
+
+
+def _contains(sorted_values: List[int], value: int) -> bool:
+    i = bisect.bisect_left(sorted_values, value)
+    return i < len(sorted_values) and sorted_values[i] == value
+
+
+def _align_tokens(sentence: str, tokens: List[str], base: int) -> List[Tuple[int, int]]:
+    """Map tokens back to character offsets, tolerating rewritten quotes"""
+    offsets = []
+    cursor = 0
+    for token in tokens:
+        if token in _QUOTE_TOKENS:
+            match = _QUOTE_PATTERN.search(sentence, cursor)
+            start, end = (match.start(), match.end()) if match else (cursor, cursor)
+        else:
+            start = sentence.find(token, cursor)
+            if start < 0:
+                start = end = cursor
+            else:
+                end = start + len(token)
+        offsets.append((base + start, base + end))
+        cursor = end
+
+    return offsets